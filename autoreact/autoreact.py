@@ -8,8 +8,15 @@ from redbot.core.bot import Red
 from redbot.core.utils.views import SimpleMenu
 from typing import Optional, Union
 
+from .matcher import PatternMatcher
+from .sandbox import RegexTimeout, RegexPool, check_pattern
+
 log = logging.getLogger("red.crab-cogs.autoreact")
 
+MATCH_TIMEOUT = 1.0
+MATCH_WORKERS = 2
+TRIAL_TIMEOUT = 0.25
+
 def batched(lst: list, n: int):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
@@ -26,18 +33,39 @@ class Autoreact(commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=61757472)
         self.autoreacts: dict[int, dict[str, re.Pattern]] = {}
+        self.matchers: dict[int, PatternMatcher[str]] = {}
         self.coreact_chance: dict[int, float] = {}
-        self.config.register_guild(autoreact_regexes={}, coreact_chance=0.0)
+        self.workers = RegexPool(MATCH_WORKERS, MATCH_TIMEOUT)
+        self.config.register_guild(autoreact_regexes={}, disabled_regexes={}, coreact_chance=0.0)
 
     async def cog_load(self):
         all_config = await self.config.all_guilds()
         self.autoreacts = {guild_id: {emoji: re.compile(text) for emoji, text in conf['autoreact_regexes'].items()}
                            for guild_id, conf in all_config.items()}
         self.coreact_chance = {guild_id: conf['coreact_chance'] for guild_id, conf in all_config.items()}
+        for guild_id in self.autoreacts:
+            self.update_matcher(guild_id)
+
+    async def cog_unload(self):
+        self.workers.stop()
 
     async def red_delete_data_for_user(self, requester: str, user_id: int):
         pass
 
+    def update_matcher(self, guild_id: int):
+        self.matchers[guild_id] = PatternMatcher(dict(self.autoreacts.get(guild_id, {})))
+
+    async def disable_autoreacts(self, guild: discord.Guild, pattern: re.Pattern):
+        emojis = [emoji for emoji, regex in self.autoreacts.get(guild.id, {}).items() if regex == pattern]
+        async with self.config.guild(guild).autoreact_regexes() as autoreacts, \
+                self.config.guild(guild).disabled_regexes() as disabled:
+            for emoji in emojis:
+                disabled[emoji] = autoreacts.pop(emoji, pattern.pattern)
+                self.autoreacts[guild.id].pop(emoji, None)
+        self.update_matcher(guild.id)
+        log.warning(f"Disabled autoreacts {' '.join(emojis)} in guild {guild.id}, "
+                    f"their regex took over {MATCH_TIMEOUT} seconds: {pattern.pattern}")
+
     # Listeners
 
     @commands.Cog.listener()
@@ -47,14 +75,18 @@ class Autoreact(commands.Cog):
         channel_perms = message.channel.permissions_for(message.guild.me)
         if not channel_perms.add_reactions:
             return
-        autoreact = self.autoreacts.get(message.guild.id, None)
-        if not autoreact:
+        matcher = self.matchers.get(message.guild.id, None)
+        if not matcher:
             return
         if not await self.is_valid_red_message(message):
             return
-        for emoji, regex in autoreact.items():
-            if not regex.search(message.content):
-                continue
+        if not (candidates := matcher.candidates(message.content)):
+            return
+        try:
+            matches = await self.workers.search([matcher.patterns[emoji] for emoji in candidates], message.content)
+        except RegexTimeout as error:
+            return await self.disable_autoreacts(message.guild, error.pattern)
+        for emoji in (candidates[i] for i in matches):
             try:
                 await message.add_reaction(emoji)
             except Exception as error:
@@ -62,6 +94,7 @@ class Autoreact(commands.Cog):
                     async with self.config.guild(message.guild).autoreact_regexes() as autoreacts:
                         removed1 = autoreacts.pop(emoji, None)
                         removed2 = self.autoreacts[message.guild.id].pop(emoji, None)
+                        self.update_matcher(message.guild.id)
                         if removed1 or removed2:
                             log.info(f"Removed invalid or deleted emoji {emoji}")
                             return
@@ -118,11 +151,22 @@ class Autoreact(commands.Cog):
         except Exception as error:
             await ctx.send(f"Invalid regex pattern: {error}")
             return
+        if reason := check_pattern(pattern):
+            await ctx.send(f"Sorry, that regex could freeze the bot because {reason}.")
+            return
+        try:
+            await self.workers.trial(pattern, TRIAL_TIMEOUT)
+        except RegexTimeout:
+            await ctx.send("Sorry, that regex is too slow when checking long messages.")
+            return
         emoji = str(emoji)
         self.autoreacts.setdefault(ctx.guild.id, {})
+        async with self.config.guild(ctx.guild).disabled_regexes() as disabled:
+            disabled.pop(emoji, None)
         async with self.config.guild(ctx.guild).autoreact_regexes() as autoreacts:
             autoreacts[emoji] = pattern.pattern
             self.autoreacts[ctx.guild.id][emoji] = pattern
+            self.update_matcher(ctx.guild.id)
             await ctx.react_quietly("✅")
 
     @autoreact.command()
@@ -135,10 +179,13 @@ class Autoreact(commands.Cog):
             return
         emoji = str(emoji)
         self.autoreacts.setdefault(ctx.guild.id, {})
+        async with self.config.guild(ctx.guild).disabled_regexes() as disabled:
+            removed3 = disabled.pop(emoji, None)
         async with self.config.guild(ctx.guild).autoreact_regexes() as autoreacts:
             removed1 = autoreacts.pop(emoji, None)
             removed2 = self.autoreacts[ctx.guild.id].pop(emoji, None)
-            if removed1 or removed2:
+            self.update_matcher(ctx.guild.id)
+            if removed1 or removed2 or removed3:
                 await ctx.react_quietly("✅")
             else:
                 await ctx.send("No autoreacts found for that emoji.")
@@ -146,10 +193,13 @@ class Autoreact(commands.Cog):
     @autoreact.command()
     async def list(self, ctx: commands.Context):
         """Shows all autoreacts."""
-        if ctx.guild.id not in self.autoreacts or not self.autoreacts[ctx.guild.id]:
+        disabled = await self.config.guild(ctx.guild).disabled_regexes()
+        if not self.autoreacts.get(ctx.guild.id) and not disabled:
             return await ctx.send("None.")
         autoreacts = [f"{emoji} {regex.pattern if '`' in regex.pattern else f'`{regex.pattern}`'}"
-                      for emoji, regex in self.autoreacts[ctx.guild.id].items()]
+                      for emoji, regex in self.autoreacts.get(ctx.guild.id, {}).items()]
+        autoreacts += [f"{emoji} ⚠ Disabled for being too slow: {pattern if '`' in pattern else f'`{pattern}`'}"
+                       for emoji, pattern in disabled.items()]
         pages = []
         for i, batch in enumerate(batched(autoreacts, 10)):
             embed = discord.Embed(title="Server Autoreacts", color=await ctx.embed_color())
@@ -0,0 +1,190 @@
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Generic, List, Optional, Set, TypeVar
+
+try:
+    import re._parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse
+
+T = TypeVar("T")
+
+REPEATS = tuple(op for op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)) if op)
+ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", None)
+SIGMAS = "Σσς"  # lowercases differently at the end of a word
+# the only non-ASCII characters that re.IGNORECASE considers equal to an ASCII letter
+ASCII_EQUIVALENTS = str.maketrans({"İ": "i", "ı": "i", "ſ": "s", "\u212a": "k"})
+
+
+def normalize(text: str) -> str:
+    return text.translate(ASCII_EQUIVALENTS).lower()
+
+
+def literal_allowed(char: str, ignorecase: bool) -> bool:
+    if ignorecase:
+        return char.isascii()
+    return char not in SIGMAS
+
+
+def better(a: Optional[FrozenSet[str]], b: Optional[FrozenSet[str]]) -> Optional[FrozenSet[str]]:
+    """The set of literals least likely to appear by chance: longest shortest literal, then fewest literals."""
+    if a is None or b is None:
+        return a if b is None else b
+    return max(a, b, key=lambda literals: (min(map(len, literals)), -len(literals)))
+
+
+def find_literals(items, ignorecase: bool) -> Optional[FrozenSet[str]]:
+    """Returns a set of strings such that any text matching the parsed pattern contains at least one of them."""
+    best = None
+    run = []
+
+    def flush():
+        nonlocal best, run
+        if run:
+            best = better(best, frozenset(["".join(run)]))
+        run = []
+
+    for op, av in items:
+        if op == sre_parse.LITERAL and literal_allowed(chr(av), ignorecase):
+            run.append(chr(av))
+            continue
+        if op in REPEATS and av[0] >= 1 and len(av[2]) == 1 and av[2][0][0] == sre_parse.LITERAL \
+                and literal_allowed(chr(av[2][0][1]), ignorecase):
+            char = chr(av[2][0][1])
+            run += [char] * av[0]
+            if av[1] != av[0]:  # the last repetition is right before whatever follows
+                flush()
+                run.append(char)
+            continue
+        flush()
+        if op == sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            scoped = (ignorecase or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            best = better(best, find_literals(subpattern, scoped))
+        elif op == ATOMIC_GROUP:
+            best = better(best, find_literals(av, ignorecase))
+        elif op in REPEATS and av[0] >= 1:
+            best = better(best, find_literals(av[2], ignorecase))
+        elif op == sre_parse.BRANCH:
+            branches = [find_literals(branch, ignorecase) for branch in av[1]]
+            if all(branches):
+                best = better(best, frozenset().union(*branches))
+    flush()
+    return best
+
+
+@lru_cache(maxsize=4096)
+def required_literals(pattern: re.Pattern) -> Optional[FrozenSet[str]]:
+    """Strings of which at least one appears in the normalized text of any match, or None if there aren't any."""
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:  # noqa, reason: private module that may change between python versions
+        return None
+    literals = find_literals(parsed, bool(parsed.state.flags & re.IGNORECASE))
+    return frozenset(normalize(literal) for literal in literals) if literals else None
+
+
+class AhoCorasick(Generic[T]):
+    """Finds every string from a set that appears in a text, in a single pass over the text."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Set[T]] = [set()]
+
+    def add(self, word: str, value: T):
+        state = 0
+        for char in word:
+            if char not in self.goto[state]:
+                self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+            state = self.goto[state][char]
+        self.output[state].add(value)
+
+    def build(self):
+        """Links every state to the longest suffix of it that is also in the trie. Call it after adding every word."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+
+    def search(self, text: str) -> Set[T]:
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class PatternMatcher(Generic[T]):
+    """
+    Finds which of many regexes match a text. A regex only runs if the text contains one of the literal strings
+    that any of its matches must contain, found with a single Aho-Corasick pass. Regexes without such literals always run.
+    """
+
+    def __init__(self, patterns: Dict[T, re.Pattern]):
+        self.patterns = patterns
+        self.order = {key: i for i, key in enumerate(patterns)}
+        self.unfiltered: Set[T] = set()
+        self.automaton: AhoCorasick[T] = AhoCorasick()
+        for key, pattern in patterns.items():
+            literals = required_literals(pattern)
+            if literals is None:
+                self.unfiltered.add(key)
+                continue
+            for literal in literals:
+                self.automaton.add(literal, key)
+        self.automaton.build()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def candidates(self, text: str) -> List[T]:
+        """Returns the keys of the patterns that might match, in the order they were given."""
+        return sorted(self.automaton.search(normalize(text)) | self.unfiltered, key=self.order.__getitem__)
+
+    def search(self, text: str) -> List[T]:
+        """Returns the keys of the patterns that match, in the order they were given."""
+        return [key for key in self.candidates(text) if self.patterns[key].search(text)]
+
+
+if __name__ == "__main__":  # python -m autoreact.matcher to compare against running every regex
+    import random
+    import string
+    import timeit
+
+    rng = random.Random(0)
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))) for _ in range(3000)]
+    templates = [
+        lambda: rf"\b{rng.choice(words)}\b",
+        lambda: rf"(?i)\b{rng.choice(words)}s?\b",
+        lambda: rf"(?i)({rng.choice(words)}|{rng.choice(words)}|{rng.choice(words)})",
+        lambda: rf"{rng.choice(words)}+ {rng.choice(words)}",
+        lambda: rf"(?i)^{rng.choice(words)}.*{rng.choice(words)}$",
+        lambda: rf"\d{{{rng.randint(3, 6)}}}",
+    ]
+    messages = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 40))) for _ in range(2000)]
+    messages += [message.upper() for message in messages[:200]] + ["12345 ſ Σ " + message for message in messages[:200]]
+    for count in (10, 100, 300, 1000):
+        patterns = {i: re.compile(rng.choice(templates)()) for i in range(count)}
+        matcher = PatternMatcher(patterns)
+        naive = lambda text: [key for key, regex in patterns.items() if regex.search(text)]  # noqa
+        mismatches = sum(matcher.search(message) != naive(message) for message in messages)
+        ours = timeit.timeit(lambda: [matcher.search(message) for message in messages], number=3) / 3 / len(messages)
+        theirs = timeit.timeit(lambda: [naive(message) for message in messages], number=3) / 3 / len(messages)
+        print(f"{count} patterns ({len(matcher.unfiltered)} without literals): {ours * 1e6:.1f} µs per message "
+              f"vs {theirs * 1e6:.1f} µs running every regex ({theirs / ours:.1f}x), mismatches: {mismatches}")
@@ -0,0 +1,183 @@
+import asyncio
+import multiprocessing
+import re
+import runpy
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import List, Optional, Set
+
+from .matcher import ATOMIC_GROUP, REPEATS, sre_parse
+
+TRIAL_LENGTH = 2000  # longest message without nitro
+TRIAL_MAX_CHARS = 20
+WORKER_SCRIPT = str(Path(__file__).with_name("worker.py"))
+CATEGORY_SAMPLES = {
+    sre_parse.CATEGORY_DIGIT: "0", sre_parse.CATEGORY_NOT_DIGIT: "a",
+    sre_parse.CATEGORY_SPACE: " ", sre_parse.CATEGORY_NOT_SPACE: "a",
+    sre_parse.CATEGORY_WORD: "a", sre_parse.CATEGORY_NOT_WORD: " ",
+}
+
+
+class RegexTimeout(Exception):
+    def __init__(self, pattern: re.Pattern):
+        super().__init__(f"Regex took too long: {pattern.pattern}")
+        self.pattern = pattern
+
+
+def can_repeat(av) -> bool:
+    return av[1] > 1 and av[2].getwidth()[1] > 0
+
+
+def varies(av) -> bool:
+    """Whether a repetition can match a different number of times, unlike \\d{3}, so it can be split up in many ways."""
+    return av[1] > av[0] and av[2].getwidth()[1] > 0
+
+
+def nested_quantifier(items, repeated: bool = False) -> bool:
+    """Whether a repetition contains another one, like (a+)+, which can take exponential time to fail."""
+    for op, av in items:
+        if op in REPEATS and (varies(av) if repeated else can_repeat(av)):
+            if repeated or nested_quantifier(av[2], True):
+                return True
+        elif op in REPEATS and nested_quantifier(av[2], repeated):
+            return True
+        elif op == sre_parse.SUBPATTERN and nested_quantifier(av[3], repeated):
+            return True
+        elif op == sre_parse.BRANCH and any(nested_quantifier(branch, repeated) for branch in av[1]):
+            return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and nested_quantifier(av[1], repeated):
+            return True
+        elif op == ATOMIC_GROUP and nested_quantifier(av, repeated):
+            return True
+    return False
+
+
+def sample_chars(items, chars: Set[str]):
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            chars.add(chr(av))
+        elif op == sre_parse.ANY:
+            chars.add("a")
+        elif op == sre_parse.IN:
+            for set_op, set_av in av:
+                if set_op == sre_parse.LITERAL:
+                    chars.add(chr(set_av))
+                elif set_op == sre_parse.RANGE:
+                    chars.add(chr(set_av[0]))
+                elif set_op == sre_parse.CATEGORY and set_av in CATEGORY_SAMPLES:
+                    chars.add(CATEGORY_SAMPLES[set_av])
+        elif op in REPEATS:
+            sample_chars(av[2], chars)
+        elif op == sre_parse.SUBPATTERN:
+            sample_chars(av[3], chars)
+        elif op == ATOMIC_GROUP:
+            sample_chars(av, chars)
+        elif op == sre_parse.BRANCH:
+            for branch in av[1]:
+                sample_chars(branch, chars)
+
+
+def check_pattern(pattern: re.Pattern) -> Optional[str]:
+    """Returns why a pattern is unsafe to run on every message, if it finds a reason without running it."""
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:  # noqa, reason: private module that may change between python versions
+        return None
+    if nested_quantifier(parsed):
+        return "it repeats something that is already repeated, like (a+)+"
+    return None
+
+
+def adversarial_inputs(pattern: re.Pattern) -> List[str]:
+    """Long runs of the characters a pattern looks for, ending in one it can't match, to make it backtrack."""
+    chars = set()
+    try:
+        sample_chars(sre_parse.parse(pattern.pattern, pattern.flags), chars)
+    except Exception:  # noqa, reason: private module that may change between python versions
+        pass
+    chars = sorted(chars)[:TRIAL_MAX_CHARS] or ["a"]
+    inputs = [char * TRIAL_LENGTH + "\0" for char in chars]
+    if len(chars) > 1:
+        mix = "".join(chars)
+        inputs.append(mix * (TRIAL_LENGTH // len(mix)) + "\0")
+    return inputs
+
+
+class RegexWorker:
+    """
+    A separate process that runs regexes, one search at a time, so a slow pattern can't freeze the bot.
+    If a search takes too long the process is killed, and a new one is started for the next search.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.process: Optional[multiprocessing.Process] = None
+        self.connection: Optional[Connection] = None
+        self.current = None
+
+    def start(self):
+        self.connection, child = self.context.Pipe()
+        self.current = self.context.Value("i", -1, lock=False)
+        init_globals = {"connection": child, "current": self.current}
+        self.process = self.context.Process(target=runpy.run_path, args=(WORKER_SCRIPT, init_globals, "__regex_worker__"),
+                                            daemon=True)
+        self.process.start()
+        child.close()
+        self.connection.recv()
+
+    def stop(self):
+        if self.process:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process = None
+
+    def request(self, patterns: List[re.Pattern], text: str, timeout: float) -> Optional[List[int]]:
+        self.connection.send((patterns, text))
+        if not self.connection.poll(timeout):
+            return None
+        return self.connection.recv()
+
+    async def search(self, patterns: List[re.Pattern], text: str, timeout: float) -> List[int]:
+        if not self.process or not self.process.is_alive():
+            await asyncio.to_thread(self.start)
+        try:
+            result = await asyncio.to_thread(self.request, patterns, text, timeout)
+        except (asyncio.CancelledError, OSError, EOFError):
+            self.stop()  # the answer would arrive out of order
+            raise
+        if result is None:
+            index = self.current.value
+            self.stop()
+            raise RegexTimeout(patterns[index])
+        return result
+
+
+class RegexPool:
+    """A few regex workers, so a slow search in one server doesn't hold up the messages of every other server."""
+
+    def __init__(self, size: int, timeout: float):
+        self.timeout = timeout
+        # forking a bot with running threads is unsafe, and the forkserver makes restarting a worker cheap
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.workers = [RegexWorker(multiprocessing.get_context(method)) for _ in range(size)]
+        self.idle: asyncio.Queue[RegexWorker] = asyncio.Queue()
+        for worker in self.workers:
+            self.idle.put_nowait(worker)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    async def search(self, patterns: List[re.Pattern], text: str, timeout: Optional[float] = None) -> List[int]:
+        """Returns the indices of the patterns that match, or raises RegexTimeout with the one that was too slow."""
+        worker = await self.idle.get()
+        try:
+            return await worker.search(patterns, text, timeout or self.timeout)
+        finally:
+            self.idle.put_nowait(worker)
+
+    async def trial(self, pattern: re.Pattern, timeout: float):
+        """Raises RegexTimeout if the pattern takes too long against inputs made to slow it down."""
+        for text in adversarial_inputs(pattern):
+            await self.search([pattern], text, timeout)
@@ -0,0 +1,73 @@
+import re
+import random
+import string
+
+from autoreact.matcher import AhoCorasick, PatternMatcher, required_literals
+
+
+def literals(pattern: str, flags: int = 0):
+    return required_literals(re.compile(pattern, flags))
+
+
+def test_required_literals():
+    assert literals(r"\bhello\b") == {"hello"}
+    assert literals(r"(?i)Hello") == {"hello"}
+    assert literals(r"cat|dog") == {"cat", "dog"}
+    assert literals(r"ab+c") == {"ab"}
+    assert literals(r"colou?r") == {"colo"}
+    assert literals(r"x{3}yz") == {"xxxyz"}
+
+
+def test_no_required_literals():
+    assert literals(r"\d+") is None
+    assert literals(r"a*") is None
+    assert literals(r"cat|\w+") is None
+    assert literals(r"(?i)σ") is None
+
+
+def test_aho_corasick():
+    automaton = AhoCorasick()
+    for word in ("he", "she", "his", "hers"):
+        automaton.add(word, word)
+    automaton.build()
+    assert automaton.search("ushers") == {"he", "she", "hers"}
+    assert automaton.search("this") == {"his"}
+    assert automaton.search("nothing") == set()
+
+
+def test_candidates():
+    matcher = PatternMatcher({
+        "😺": re.compile(r"\bcats?\b"),
+        "🐶": re.compile(r"(?i)\bdog\b"),
+        "🔢": re.compile(r"\d{3}"),
+    })
+    assert matcher.candidates("i like cats") == ["😺", "🔢"]
+    assert matcher.candidates("DOG") == ["🐶", "🔢"]
+    assert matcher.candidates("hello") == ["🔢"]
+    assert matcher.search("my cat is 100") == ["😺", "🔢"]
+    assert matcher.search("concatenate") == []
+
+
+def test_ignorecase_equivalents():
+    matcher = PatternMatcher({"k": re.compile(r"(?i)kiss"), "s": re.compile(r"(?i)\bbus\b")})
+    assert matcher.search("KİSS") == ["k"]  # kelvin sign and dotted capital i
+    assert matcher.search("buſ") == ["s"]  # long s
+
+
+def test_matches_every_regex():
+    rng = random.Random(0)
+    words = ["".join(rng.choice("abcde") for _ in range(rng.randint(2, 5))) for _ in range(100)]
+    templates = [
+        lambda: rf"\b{rng.choice(words)}\b",
+        lambda: rf"(?i){rng.choice(words)}s?",
+        lambda: rf"({rng.choice(words)}|{rng.choice(words)})",
+        lambda: rf"{rng.choice(words)}+ {rng.choice(words)}",
+        lambda: rf"^{rng.choice(words)}.*{rng.choice(words)}$",
+        lambda: rf"[ab]{{2,3}}{rng.choice(words)}",
+    ]
+    patterns = {i: re.compile(rng.choice(templates)()) for i in range(200)}
+    matcher = PatternMatcher(patterns)
+    for _ in range(500):
+        text = " ".join(rng.choice(words + [string.ascii_uppercase]) for _ in range(rng.randint(1, 10)))
+        text = text.upper() if rng.random() < 0.2 else text
+        assert matcher.search(text) == [key for key, pattern in patterns.items() if pattern.search(text)]
@@ -0,0 +1,41 @@
+import re
+import asyncio
+import pytest
+
+from autoreact.sandbox import RegexPool, RegexTimeout, adversarial_inputs, check_pattern
+
+
+@pytest.mark.parametrize("pattern", [r"(a+)+", r"(a*)*b", r"(\w+\s?)+$", r"(a{2,3})+", r"(\d+){3}", r"((ab)*c)+",
+                                     r"(?:x|y+)+", r"(?=(a+)+)"])
+def test_nested_quantifiers_are_rejected(pattern):
+    assert check_pattern(re.compile(pattern))
+
+
+@pytest.mark.parametrize("pattern", [r"\bhello\b", r"a+b+", r"(\d{3}-)+", r"(ab|cd)+", r"(a{3}){2,}", r"(a+){1}",
+                                     r"(?i)(?:nya)+~*", r"(abc)?+"])
+def test_safe_patterns_are_accepted(pattern):
+    assert check_pattern(re.compile(pattern)) is None
+
+
+def test_adversarial_inputs():
+    inputs = adversarial_inputs(re.compile(r"[ab]\d"))
+    assert "a" * 2000 + "\0" in inputs
+    assert "0" * 2000 + "\0" in inputs
+    assert any(len(set(text)) > 2 for text in inputs)
+
+
+def test_pool():
+    async def run():
+        pool = RegexPool(2, 1.0)
+        try:
+            assert await pool.search([re.compile("cat"), re.compile("dog"), re.compile("c.t")], "a cat") == [0, 2]
+            slow = re.compile(r"(a|aa)+$")
+            with pytest.raises(RegexTimeout) as error:
+                await pool.search([re.compile("a"), slow], "a" * 50 + "b", 0.2)
+            assert error.value.pattern is slow
+            assert await pool.search([re.compile("a")], "a") == [0]  # replaced the worker
+            await pool.trial(re.compile(r"\bhello\b"), 1.0)
+        finally:
+            pool.stop()
+
+    asyncio.run(run())
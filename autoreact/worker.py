@@ -0,0 +1,24 @@
+"""
+The loop of a regex worker process. RegexWorker runs this file by path instead of importing it, since Red doesn't
+put the cogs folder in sys.path, so it must only use the standard library.
+"""
+
+
+def serve(connection, current):
+    """Before each search it records which pattern is running, so a timeout can be blamed on it."""
+    connection.send(None)  # ready, so starting up doesn't count towards the timeout of the first search
+    while True:
+        try:
+            patterns, text = connection.recv()
+        except EOFError:
+            return
+        matches = []
+        for i, pattern in enumerate(patterns):
+            current.value = i
+            if pattern.search(text):
+                matches.append(i)
+        connection.send(matches)
+
+
+if __name__ == "__regex_worker__":
+    serve(connection, current)  # noqa, reason: given by RegexWorker.start
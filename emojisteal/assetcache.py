@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import asyncio
+import aiohttp
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class AssetCache:
+    """
+    Keeps downloaded emoji images on disk, keyed by emoji ID and whether it's animated, so popular emojis
+    stolen in many servers are only downloaded once. Transcoded images are kept alongside them.
+    Emoji images never change, but once an entry is old enough it's revalidated with a conditional request,
+    which costs no download if the CDN still has the same file.
+    The least recently used files are deleted once their total size exceeds max_bytes.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, revalidate_after: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.entries: Dict[str, dict] = {}
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(emoji_id: int, animated: bool) -> str:
+        return f"{emoji_id}_{'a' if animated else 's'}"
+
+    def file(self, key: str) -> Path:
+        return self.path / f"{key}.bin"
+
+    def index_file(self) -> Path:
+        return self.path / "index.json"
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def open(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            self.entries = json.loads(self.index_file().read_text())
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+        self.entries = {key: entry for key, entry in self.entries.items() if self.file(key).exists()}
+
+    def save(self, index: str):
+        temp = self.index_file().with_suffix(".tmp")
+        temp.write_text(index)
+        os.replace(temp, self.index_file())
+
+    def evict(self):
+        size = sum(entry["size"] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["used"]):
+            if size <= self.max_bytes:
+                break
+            size -= self.entries.pop(key)["size"]
+            self.file(key).unlink(missing_ok=True)
+
+    async def get(self, session: aiohttp.ClientSession, url: str, emoji_id: int, animated: bool) -> bytes:
+        key = self.key(emoji_id, animated)
+        entry = self.entries.get(key)
+        now = time.time()
+        headers = {}
+        if entry and now - entry["checked"] < self.revalidate_after:
+            data = await asyncio.to_thread(self.read, key)
+            if data is not None:
+                self.hits += 1
+                entry["used"] = now
+                return data
+        if entry and self.file(key).exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        async with session.get(url, headers=headers) as resp:
+            if resp.status == 304 and (data := await asyncio.to_thread(self.read, key)) is not None:
+                self.hits += 1
+                entry.update(checked=now, used=now)
+                await self.commit()
+                return data
+            resp.raise_for_status()
+            data = await resp.read()
+            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        self.misses += 1
+        await self.store(key, data, etag=etag, last_modified=last_modified)
+        return data
+
+    async def load(self, key: str) -> Optional[bytes]:
+        """Returns a stored file that never needs revalidating, such as a transcoded image."""
+        if key not in self.entries:
+            return None
+        data = await asyncio.to_thread(self.read, key)
+        if data is not None and key in self.entries:
+            self.hits += 1
+            self.entries[key]["used"] = time.time()
+        return data
+
+    async def store(self, key: str, data: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        now = time.time()
+        await asyncio.to_thread(self.write, key, data)
+        self.entries[key] = {"size": len(data), "checked": now, "used": now, "etag": etag, "last_modified": last_modified}
+        await self.commit()
+
+    async def commit(self):
+        async with self.lock:
+            self.evict()
+            await asyncio.to_thread(self.save, json.dumps(self.entries))
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            return self.file(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes):
+        temp = self.file(key).with_suffix(".tmp")
+        temp.write_bytes(data)
+        os.replace(temp, self.file(key))
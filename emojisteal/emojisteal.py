@@ -1,17 +1,43 @@
 import io
 import re
+import json
+import site
+import asyncio
+import tempfile
 import zipfile
 import aiohttp
 import discord
-from dataclasses import dataclass
-from itertools import zip_longest
+import multiprocessing
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import blake2b
+from pathlib import Path
+from dataclasses import dataclass, field
 from redbot.core import commands, app_commands
-from typing import Optional, Union, List
+from redbot.core.data_manager import cog_data_path
+from typing import Optional, Union, List, Dict, Tuple, IO, AsyncIterator
+
+from .assetcache import AssetCache
+from .transcode import Target, transcode, file_extension
 
 IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".gif", ".webp")
 STICKER_KB = 512
 STICKER_DIM = 320
 STICKER_TIME = 5
+EMOJI_KB = 256
+EMOJI_DIM = 128
+SOURCE_MAX_MB = 25
+EMOJI_CACHE_MB = 100
+EMOJI_REVALIDATE_AFTER = 7*24*60*60
+PACK_CONCURRENCY = 4
+PACK_MANIFEST = "manifest.json"
+PACK_VERSION = 1
+PACK_MARGIN_KB = 256
+PACK_CHUNK_SIZE = 64 * 1024
+EMOJI_TARGET = Target("emoji", EMOJI_KB * 1024, EMOJI_DIM, "GIF", ("PNG", "JPEG", "GIF"))
+STICKER_TARGET = Target("sticker", STICKER_KB * 1024, STICKER_DIM, "PNG", ("PNG",), STICKER_TIME)
 
 MISSING_EMOJIS = "Can't find emojis or stickers in that message."
 MISSING_REFERENCE = "Reply to a message with this command to steal an emoji."
@@ -24,16 +50,20 @@ STICKER_SUCCESS = "✅ Uploaded sticker"
 STICKER_SLOTS = "⚠ This server doesn't have any more space for stickers!"
 EMOJI_FAIL = "❌ Failed to upload"
 EMOJI_SLOTS = "⚠ This server doesn't have any more space for emojis!"
+EMOJI_SLOTS_SKIPPED = "⚠ Not enough space for"
 INVALID_EMOJI = "Invalid emoji or emoji ID."
+PACK_EMPTY = "This server doesn't have any emojis or stickers to export."
+PACK_EXPORTED = "📦 {} emojis and {} stickers"
+PACK_MISSING = "Attach one or more zip files made with the export command, or zip files of images."
+PACK_EXISTING = "⏭ Already in this server:"
+PACK_NOTHING = "There was nothing to import."
+PACK_INVALID_ENTRY = "Invalid manifest entry"
+TRANSCODE_CRASH = "The image converter crashed, the image may be too big"
 STICKER_TOO_BIG = f"Stickers may only be up to {STICKER_KB} KB and {STICKER_DIM}x{STICKER_DIM} pixels and last up to {STICKER_TIME} seconds."
 STICKER_ATTACHMENT = """
->>> For a non-moving sticker, simply use this command and attach a PNG image.
-For a moving sticker, Discord limitations make it very annoying. Follow these steps:
-1. Scale down and optimize your video/gif in <https://ezgif.com>
-2. Convert it to APNG in that same website.
-3. Download it and put it inside a zip file.
-4. Use this command and attach that zip file.
-\n**Important:** """ + STICKER_TOO_BIG
+>>> Use this command and attach an image or gif, or a zip file containing one.
+Bigger images are scaled down and compressed automatically, and gifs are converted to APNG.
+\n**Important:** """ + f"Files may be up to {SOURCE_MAX_MB} MB. " + STICKER_TOO_BIG
 
 
 @dataclass(init=True, order=True, frozen=True)
@@ -53,6 +83,25 @@ class StolenEmoji:
         return isinstance(other, StolenEmoji) and self.id == other.id
 
 
+@dataclass
+class UploadSummary:
+    added: List[Union[discord.Emoji, discord.GuildSticker]] = field(default_factory=list)
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    no_slots: List[str] = field(default_factory=list)
+    existing: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        lines = []
+        if self.added:
+            lines.append(' '.join(str(e) for e in self.added))
+        if self.no_slots:
+            lines.append(EMOJI_SLOTS if not self.added and not self.failed else f"{EMOJI_SLOTS_SKIPPED} {', '.join(self.no_slots)}")
+        if self.existing:
+            lines.append(f"{PACK_EXISTING} {', '.join(self.existing)}")
+        lines += [f"{EMOJI_FAIL} {name}, {error}" for name, error in self.failed]
+        return '\n'.join(lines)[:2000]
+
+
 class EmojiSteal(commands.Cog):
     """Steals emojis and stickers sent by other people and optionally uploads them to your own server. Supports context menu commands."""
 
@@ -63,10 +112,20 @@ class EmojiSteal(commands.Cog):
         self.steal_upload_context_menu = app_commands.ContextMenu(name='Steal+Upload Emotes', callback=self.steal_upload_app_command)
         self.bot.tree.add_command(self.steal_context_menu)
         self.bot.tree.add_command(self.steal_upload_context_menu)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.asset_cache = AssetCache(cog_data_path(self) / "emojis", EMOJI_CACHE_MB * 1024**2, EMOJI_REVALIDATE_AFTER)
+        self.transcoder = self.create_transcoder()
+
+    async def cog_load(self) -> None:
+        self.session = aiohttp.ClientSession()
+        await asyncio.to_thread(self.asset_cache.open)
 
     async def cog_unload(self) -> None:
         self.bot.tree.remove_command(self.steal_context_menu.name, type=self.steal_context_menu.type)
         self.bot.tree.remove_command(self.steal_upload_context_menu.name, type=self.steal_upload_context_menu.type)
+        if self.session:
+            await self.session.close()
+        self.transcoder.shutdown(wait=False, cancel_futures=True)
 
     async def red_delete_data_for_user(self, requester: str, user_id: int):
         pass
@@ -74,12 +133,206 @@ class EmojiSteal(commands.Cog):
     @staticmethod
     def get_emojis(content: str) -> Optional[List[StolenEmoji]]:
         results = re.findall(r"<(a?):(\w+):(\d{10,20})>", content)
-        return [StolenEmoji(*result) for result in results]
+        return [StolenEmoji(bool(animated), name, int(emoji_id)) for animated, name, emoji_id in results]
     
     @staticmethod
-    def available_emoji_slots(guild: discord.Guild, animated: bool):
-        current_emojis = len([em for em in guild.emojis if em.animated == animated])
-        return guild.emoji_limit - current_emojis
+    def available_emoji_slots(guild: discord.Guild) -> Dict[bool, int]:
+        """Free slots for static and animated emojis, keyed by whether they're animated."""
+        current_emojis = Counter(em.animated for em in guild.emojis)
+        return {animated: guild.emoji_limit - current_emojis[animated] for animated in (False, True)}
+
+    async def download_emoji(self, emoji: StolenEmoji) -> bytes:
+        return await self.asset_cache.get(self.session, emoji.url, emoji.id, emoji.animated)
+
+    @staticmethod
+    def create_transcoder() -> ProcessPoolExecutor:
+        # forking a bot with running threads is unsafe. Red doesn't put the cogs folder in sys.path,
+        # so the worker adds it itself before it imports the cog to find the transcode function.
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(method),
+                                   initializer=site.addsitedir, initargs=(str(Path(__file__).parent.parent),))
+
+    async def fit_image(self, data: bytes, target: Target) -> bytes:
+        """Scales down and compresses an image in the worker process until it fits, reusing earlier results."""
+        key = f"{blake2b(data, digest_size=16).hexdigest()}_{target.name}"
+        if (result := await self.asset_cache.load(key)) is not None:
+            return result
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.transcoder, transcode, data, target)
+        except BrokenProcessPool:
+            self.transcoder = self.create_transcoder()
+            raise ValueError(TRANSCODE_CRASH)
+        if result != data:
+            await self.asset_cache.store(key, result)
+        return result
+
+    async def upload_sticker(self, guild: discord.Guild, name: str, description: str, data: bytes,
+                             emoji: str = STICKER_EMOJI) -> discord.GuildSticker:
+        data = await self.fit_image(data, STICKER_TARGET)
+        file = discord.File(io.BytesIO(data), filename=f"{name}.{file_extension(data)}")
+        return await guild.create_sticker(name=name, description=description, emoji=emoji, file=file)
+
+    async def upload_emojis(self, guild: discord.Guild, emojis: List[StolenEmoji], names: List[Optional[str]]) -> UploadSummary:
+        """Downloads every emoji at once, then uploads them in order while keeping count of the free slots."""
+        summary = UploadSummary()
+        slots = self.available_emoji_slots(guild)
+        pending = []
+        for i, emoji in enumerate(emojis):
+            name = names[i] if i < len(names) and names[i] else emoji.name
+            if slots[emoji.animated] <= 0:
+                summary.no_slots.append(name)
+                continue
+            slots[emoji.animated] -= 1  # reserved, given back if the upload fails
+            pending.append((emoji, name, asyncio.create_task(self.download_emoji(emoji))))
+        try:
+            for emoji, name, download in pending:
+                try:
+                    image = await download
+                    if len(image) > EMOJI_TARGET.max_bytes:
+                        image = await self.fit_image(image, EMOJI_TARGET)
+                    # discord.py waits out rate limits, so uploads are paced by the emoji bucket of the guild
+                    summary.added.append(await guild.create_custom_emoji(name=name, image=image))
+                except (aiohttp.ClientError, discord.HTTPException, ValueError) as error:
+                    slots[emoji.animated] += 1
+                    summary.failed.append((name, f"{type(error).__name__}: {error}"))
+        finally:
+            for _, _, download in pending:
+                download.cancel()
+        return summary
+
+    async def read_pack_item(self, item: Union[discord.Emoji, discord.GuildSticker]) -> bytes:
+        if isinstance(item, discord.Emoji):
+            return await self.download_emoji(StolenEmoji(item.animated, item.name, item.id))
+        return await item.read()
+
+    @staticmethod
+    def close_pack(archive: zipfile.ZipFile, fp: IO[bytes], manifest: dict):
+        archive.writestr(PACK_MANIFEST, json.dumps(manifest, indent=2, ensure_ascii=False))
+        archive.close()
+        fp.seek(0)
+
+    async def export_pack(self, guild: discord.Guild, max_bytes: int, failed: List[str]) -> AsyncIterator[Tuple[IO[bytes], dict]]:
+        """
+        Writes the emojis and stickers of a guild into temporary zip files, downloading a few at a time.
+        A new file is started before one would get too big to upload, and each one has its own manifest.
+        """
+        items = [("emojis", emoji) for emoji in guild.emojis] \
+            + [("stickers", sticker) for sticker in guild.stickers if sticker.format != discord.StickerFormatType.lottie]
+        fp, archive, manifest = None, None, {}
+        try:
+            for i in range(0, len(items), PACK_CONCURRENCY):
+                batch = items[i:i + PACK_CONCURRENCY]
+                results = await asyncio.gather(*(self.read_pack_item(item) for _, item in batch), return_exceptions=True)
+                for (kind, item), data in zip(batch, results):
+                    if isinstance(data, Exception):
+                        failed.append(item.name)
+                        continue
+                    if archive and fp.tell() + len(data) + PACK_MARGIN_KB * 1024 > max_bytes:
+                        await asyncio.to_thread(self.close_pack, archive, fp, manifest)
+                        yield fp, manifest
+                        fp.close()
+                        archive = None
+                    if not archive:
+                        fp = tempfile.TemporaryFile()
+                        archive = zipfile.ZipFile(fp, "w")  # images are already compressed
+                        manifest = {"version": PACK_VERSION, "guild": guild.name, "emojis": [], "stickers": []}
+                    entry = {"file": f"{kind}/{item.id}.{file_extension(data)}", "name": item.name}
+                    if kind == "emojis":
+                        entry["animated"] = item.animated
+                    else:
+                        entry.update(description=item.description, emoji=item.emoji)
+                    await asyncio.to_thread(archive.writestr, entry["file"], data)
+                    manifest[kind].append(entry)
+            if archive:
+                await asyncio.to_thread(self.close_pack, archive, fp, manifest)
+                yield fp, manifest
+        finally:
+            if fp:
+                fp.close()
+
+    @staticmethod
+    def read_manifest(archive: zipfile.ZipFile, filename: str, failed: List[Tuple[str, str]]) -> dict:
+        """Reads the manifest of an exported pack, or makes one for a zip of plain images.
+        Entries without a file and a name are left out and added to failed."""
+        if PACK_MANIFEST in archive.namelist():
+            manifest = json.loads(archive.read(PACK_MANIFEST))
+            if not isinstance(manifest, dict) or not isinstance(manifest.get("version", PACK_VERSION), int) \
+                    or manifest.get("version", PACK_VERSION) > PACK_VERSION:
+                raise ValueError("Unsupported manifest")
+            for kind in ("emojis", "stickers"):
+                entries = manifest.get(kind, [])
+                if not isinstance(entries, list):
+                    raise ValueError(f"Unsupported manifest, {kind} isn't a list")
+                manifest[kind] = []
+                for i, entry in enumerate(entries):
+                    if isinstance(entry, dict) and isinstance(entry.get("file"), str) and isinstance(entry.get("name"), str):
+                        manifest[kind].append(entry)
+                    else:
+                        name = entry.get("name") if isinstance(entry, dict) else None
+                        failed.append((str(name or f"{filename} {kind} #{i + 1}"), PACK_INVALID_ENTRY))
+            return manifest
+        emojis = []
+        for file in archive.namelist():
+            name, _, extension = file.rpartition("/")[2].rpartition(".")
+            name = ''.join(re.findall(r"\w+", name))[:32]
+            if f".{extension.lower()}" in IMAGE_TYPES and len(name) >= 2:
+                emojis.append({"file": file, "name": name, "animated": extension.lower() == "gif"})
+        return {"emojis": emojis, "stickers": []}
+
+    async def import_pack_item(self, guild: discord.Guild, archive: zipfile.ZipFile, entry: dict, sticker: bool,
+                               semaphore: asyncio.Semaphore, summary: UploadSummary):
+        async with semaphore:
+            try:
+                if archive.getinfo(entry["file"]).file_size > SOURCE_MAX_MB * 1024**2:
+                    raise ValueError(f"Files may be up to {SOURCE_MAX_MB} MB")
+                data = await asyncio.to_thread(archive.read, entry["file"])
+                if sticker:
+                    summary.added.append(await self.upload_sticker(
+                        guild, entry["name"], entry.get("description") or STICKER_DESC, data, entry.get("emoji") or STICKER_EMOJI))
+                else:
+                    if len(data) > EMOJI_TARGET.max_bytes:
+                        data = await self.fit_image(data, EMOJI_TARGET)
+                    summary.added.append(await guild.create_custom_emoji(name=entry["name"], image=data))
+            except (KeyError, ValueError, zipfile.BadZipFile, discord.HTTPException) as error:
+                summary.failed.append((entry["name"], f"{type(error).__name__}: {error}"))
+
+    async def import_packs(self, guild: discord.Guild, packs: List[Tuple[zipfile.ZipFile, dict]], summary: UploadSummary):
+        """
+        Uploads the entries of some packs a few at a time, reading each file from its zip only when it's needed.
+        Entries already in the guild are skipped, so importing the same packs again resumes after any failures.
+        """
+        existing_emojis = {(emoji.name, emoji.animated) for emoji in guild.emojis}
+        existing_stickers = {sticker.name for sticker in guild.stickers}
+        slots = self.available_emoji_slots(guild)
+        sticker_slots = guild.sticker_limit - len(guild.stickers)
+        semaphore = asyncio.Semaphore(PACK_CONCURRENCY)
+        jobs = []
+        for archive, manifest in packs:
+            for entry in manifest["emojis"]:
+                animated = bool(entry.get("animated"))
+                if (entry.get("name"), animated) in existing_emojis:
+                    summary.existing.append(entry["name"])
+                elif slots[animated] <= 0:
+                    summary.no_slots.append(entry["name"])
+                else:
+                    slots[animated] -= 1
+                    jobs.append(self.import_pack_item(guild, archive, entry, False, semaphore, summary))
+            for entry in manifest["stickers"]:
+                if entry.get("name") in existing_stickers:
+                    summary.existing.append(entry["name"])
+                elif sticker_slots <= 0:
+                    summary.no_slots.append(entry["name"])
+                else:
+                    sticker_slots -= 1
+                    jobs.append(self.import_pack_item(guild, archive, entry, True, semaphore, summary))
+        await asyncio.gather(*jobs)
+
+    async def download_to_file(self, url: str, fp: IO[bytes]):
+        async with self.session.get(url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(PACK_CHUNK_SIZE):
+                fp.write(chunk)
+        fp.seek(0)
 
     async def steal_ctx(self, ctx: commands.Context) -> Optional[List[Union[StolenEmoji, discord.StickerItem]]]:
         reference = ctx.message.reference
@@ -127,10 +380,9 @@ class EmojiSteal(commands.Cog):
             if len(ctx.guild.stickers) >= ctx.guild.sticker_limit:
                 return await ctx.send(STICKER_SLOTS)
             sticker = emojis[0]
-            fp = io.BytesIO()
             try:
-                await sticker.save(fp)
-                await ctx.guild.create_sticker(name=sticker.name, description=STICKER_DESC, emoji=STICKER_EMOJI, file=discord.File(fp))
+                async with ctx.typing():
+                    await self.upload_sticker(ctx.guild, sticker.name, STICKER_DESC, await sticker.read())
             except Exception as error:
                 return await ctx.send(f"{STICKER_FAIL}, {type(error).__name__}: {error}")
             return await ctx.send(f"{STICKER_SUCCESS}: {sticker.name}")
@@ -139,22 +391,9 @@ class EmojiSteal(commands.Cog):
         names = [name if len(name) >= 2 else None for name in names]
         emojis = list(dict.fromkeys(emojis))
 
-        async with aiohttp.ClientSession() as session:
-            for emoji, name in zip_longest(emojis, names):
-                if not self.available_emoji_slots(ctx.guild, emoji.animated):
-                    return await ctx.send(EMOJI_SLOTS)
-                if not emoji:
-                    break
-                try:
-                    async with session.get(emoji.url) as resp:
-                        image = io.BytesIO(await resp.read()).read()
-                    added = await ctx.guild.create_custom_emoji(name=name or emoji.name, image=image)
-                except Exception as error:
-                    return await ctx.send(f"{EMOJI_FAIL} {emoji.name}, {type(error).__name__}: {error}")
-                try:
-                    await ctx.message.add_reaction(added)
-                except:
-                    pass
+        async with ctx.typing():
+            summary = await self.upload_emojis(ctx.guild, emojis, names)
+        await ctx.send(str(summary))
 
     # context menu added in __init__
     @app_commands.guild_only()
@@ -172,37 +411,15 @@ class EmojiSteal(commands.Cog):
             if len(ctx.guild.stickers) >= ctx.guild.sticker_limit:
                 return await ctx.edit_original_response(content=STICKER_SLOTS)
             sticker = emojis[0]
-            fp = io.BytesIO()
             try:
-                await sticker.save(fp)
-                await ctx.guild.create_sticker(
-                    name=sticker.name, description=STICKER_DESC, emoji=STICKER_EMOJI, file=discord.File(fp))
+                await self.upload_sticker(ctx.guild, sticker.name, STICKER_DESC, await sticker.read())
             except Exception as error:
                 return await ctx.edit_original_response(content=f"{STICKER_FAIL}, {type(error).__name__}: {error}")
             return await ctx.edit_original_response(content=f"{STICKER_SUCCESS}: {sticker.name}")
 
-        added_emojis = []
         emojis = list(dict.fromkeys(emojis))
-        async with aiohttp.ClientSession() as session:
-            for emoji in emojis:
-                if not self.available_emoji_slots(ctx.guild, emoji.animated):
-                    response = EMOJI_SLOTS
-                    if added_emojis:
-                        response = ' '.join([str(e) for e in added_emojis]) + '\n' + response
-                    return await ctx.edit_original_response(content=response)
-                try:
-                    async with session.get(emoji.url) as resp:
-                        image = io.BytesIO(await resp.read()).read()
-                    added = await ctx.guild.create_custom_emoji(name=emoji.name, image=image)
-                except Exception as error:
-                    response = f"{EMOJI_FAIL} {emoji.name}, {type(error).__name__}: {error}"
-                    if added_emojis:
-                        response = ' '.join([str(e) for e in added_emojis]) + '\n' + response
-                    return await ctx.edit_original_response(content=response)
-                added_emojis.append(added)
-        
-        response = ' '.join([str(e) for e in added_emojis])
-        await ctx.edit_original_response(content=response)
+        summary = await self.upload_emojis(ctx.guild, emojis, [])
+        await ctx.edit_original_response(content=str(summary))
 
     @commands.command()
     async def getemoji(self, ctx: commands.Context, *, emoji: str):
@@ -210,6 +427,8 @@ class EmojiSteal(commands.Cog):
         emoji = emoji.strip()
         if emoji.isnumeric():
             emojis = [StolenEmoji(False, "e", int(emoji)), StolenEmoji(True, "e", int(emoji))]
+            # if it was stolen before, we already know whether it's animated
+            emojis = [e for e in emojis if self.asset_cache.key(e.id, e.animated) in self.asset_cache] or emojis
         elif not (emojis := self.get_emojis(emoji)):
             await ctx.send(INVALID_EMOJI)
             return
@@ -222,27 +441,72 @@ class EmojiSteal(commands.Cog):
         """Uploads a sticker to the server, useful for mobile."""
         if len(ctx.guild.stickers) >= ctx.guild.sticker_limit:
             return await ctx.send(content=STICKER_SLOTS)
-        if not ctx.message.attachments or not ctx.message.attachments[0].filename.endswith((".png", ".zip")):
+        if not ctx.message.attachments or not ctx.message.attachments[0].filename.lower().endswith(IMAGE_TYPES + (".zip",)):
             return await ctx.send(STICKER_ATTACHMENT)
         attachment = ctx.message.attachments[0]
-        if attachment.size > STICKER_KB * 1024 or attachment.width and attachment.width > STICKER_DIM or attachment.height and attachment.height > STICKER_DIM:
-            return await ctx.send(STICKER_TOO_BIG)
+        if attachment.size > SOURCE_MAX_MB * 1024**2:
+            return await ctx.send(STICKER_ATTACHMENT)
         await ctx.typing()
         name = name or attachment.filename.split('.')[0]
-        fp = io.BytesIO()
         try:
-            await attachment.save(fp)
-            if attachment.filename.endswith(".zip"):
-                zip = zipfile.ZipFile(fp)  # noqa
-                files = zipfile.ZipFile.namelist(zip)
-                file = next(f for f in files if f.endswith(".png"))
-                if not file:
-                    return await ctx.send(STICKER_ATTACHMENT)
-                fp = io.BytesIO(zip.read(file))
-            sticker = await ctx.guild.create_sticker(
-                name=name, description=f"{UPLOADED_BY} {ctx.author}", emoji=STICKER_EMOJI, file=discord.File(fp))
+            data = await attachment.read()
+            if attachment.filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(io.BytesIO(data)) as zip:  # noqa
+                    file = next((f for f in zip.infolist() if f.filename.lower().endswith(IMAGE_TYPES)), None)
+                    if not file or file.file_size > SOURCE_MAX_MB * 1024**2:
+                        return await ctx.send(STICKER_ATTACHMENT)
+                    data = zip.read(file)
+            sticker = await self.upload_sticker(ctx.guild, name, f"{UPLOADED_BY} {ctx.author}", data)
         except Exception as error:
             if "exceed" in str(error):
                 return await ctx.send(STICKER_TOO_BIG)
             return await ctx.send(f"{STICKER_FAIL}, {type(error).__name__}: {error}")
         return await ctx.send(f"{STICKER_SUCCESS}: {sticker.name}")
+
+    @commands.group(name="emojipack", invoke_without_command=True)
+    @commands.guild_only()
+    async def emojipack_command(self, ctx: commands.Context):
+        """Copies every emoji and sticker of a server into another one, through zip files."""
+        await ctx.send_help()
+
+    @emojipack_command.command(name="export")
+    @commands.has_permissions(manage_emojis=True)
+    @commands.bot_has_permissions(attach_files=True)
+    async def emojipack_export(self, ctx: commands.Context):
+        """Saves every emoji and sticker of this server into zip files, to be imported somewhere else."""
+        failed = []
+        parts = 0
+        async with ctx.typing():
+            async for fp, manifest in self.export_pack(ctx.guild, ctx.guild.filesize_limit, failed):
+                parts += 1
+                content = PACK_EXPORTED.format(len(manifest["emojis"]), len(manifest["stickers"]))
+                if failed:
+                    content += f"\n{EMOJI_FAIL} {', '.join(failed)}"[:1900]
+                    failed.clear()
+                await ctx.send(content, file=discord.File(fp, filename=f"emojipack_{ctx.guild.id}_{parts}.zip"))
+        if not parts:
+            await ctx.send(PACK_EMPTY)
+
+    @emojipack_command.command(name="import")
+    @commands.has_permissions(manage_emojis=True)
+    @commands.bot_has_permissions(manage_emojis=True)
+    async def emojipack_import(self, ctx: commands.Context):
+        """Uploads the emojis and stickers from attached zip files, skipping the ones already in this server.
+        If some fail, run it again with the same files to continue where it left off."""
+        attachments = [attachment for attachment in ctx.message.attachments if attachment.filename.lower().endswith(".zip")]
+        if not attachments:
+            return await ctx.send(PACK_MISSING)
+        summary = UploadSummary()
+        async with ctx.typing():
+            with ExitStack() as stack:
+                packs = []
+                for attachment in attachments:
+                    fp = stack.enter_context(tempfile.TemporaryFile())
+                    try:
+                        await self.download_to_file(attachment.url, fp)
+                        archive = stack.enter_context(zipfile.ZipFile(fp))
+                        packs.append((archive, self.read_manifest(archive, attachment.filename, summary.failed)))
+                    except (aiohttp.ClientError, zipfile.BadZipFile, ValueError) as error:
+                        summary.failed.append((attachment.filename, f"{type(error).__name__}: {error}"))
+                await self.import_packs(ctx.guild, packs, summary)
+        await ctx.send(str(summary) or PACK_NOTHING)
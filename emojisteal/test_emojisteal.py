@@ -0,0 +1,39 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from emojisteal.emojisteal import EmojiSteal, StolenEmoji
+
+MESSAGE = "look <:smile:123456789012345678> <a:dance:223456789012345678> <:wave:323456789012345678>"
+
+
+def make_cog(tmp_path) -> EmojiSteal:
+    with patch("emojisteal.emojisteal.cog_data_path", return_value=tmp_path):
+        cog = EmojiSteal(MagicMock())
+    cog.download_emoji = AsyncMock(return_value=b"GIF89a")
+    return cog
+
+
+def make_guild(static: int, animated: int, limit: int) -> SimpleNamespace:
+    emojis = [SimpleNamespace(animated=False)] * static + [SimpleNamespace(animated=True)] * animated
+    create = AsyncMock(side_effect=lambda name, image: SimpleNamespace(name=name))
+    return SimpleNamespace(emojis=emojis, emoji_limit=limit, create_custom_emoji=create)
+
+
+def test_get_emojis():
+    emojis = EmojiSteal.get_emojis(MESSAGE)
+    assert emojis == [StolenEmoji(False, "smile", 123456789012345678), StolenEmoji(True, "dance", 223456789012345678),
+                      StolenEmoji(False, "wave", 323456789012345678)]
+    assert [emoji.animated for emoji in emojis] == [False, True, False]
+    assert emojis[1].url == "https://cdn.discordapp.com/emojis/223456789012345678.gif"
+    assert EmojiSteal.get_emojis("no emojis :smile:") == []
+
+
+def test_upload_emojis(tmp_path):
+    cog = make_cog(tmp_path)
+    guild = make_guild(static=49, animated=0, limit=50)
+    summary = asyncio.run(cog.upload_emojis(guild, EmojiSteal.get_emojis(MESSAGE), ["happy"]))
+    assert [emoji.name for emoji in summary.added] == ["happy", "dance"]
+    assert summary.no_slots == ["wave"]
+    assert not summary.failed
+    cog.transcoder.shutdown()
@@ -0,0 +1,144 @@
+import io
+import math
+from dataclasses import dataclass
+from PIL import Image, ImageSequence
+from typing import List, Optional, Tuple
+
+MAX_FRAMES = 500
+DEFAULT_FRAME_DURATION = 100
+SCALES = (1.0, 0.85, 0.7, 0.55, 0.4, 0.25)
+COLORS = (0, 256, 128, 64, 32, 16)  # 0 keeps full color
+FRAME_STEPS = (1, 2, 3, 4)
+
+
+@dataclass(frozen=True)
+class Target:
+    name: str
+    max_bytes: int
+    max_dim: int
+    animated_format: str
+    static_formats: Tuple[str, ...]
+    max_duration: Optional[float] = None
+
+
+Level = Tuple[float, int, int]
+
+
+def file_extension(data: bytes) -> str:
+    if data.startswith(b"GIF8"):
+        return "gif"
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    if data[8:12] == b"WEBP":
+        return "webp"
+    return "jpg"
+
+
+def load_frames(img: Image.Image, max_dim: int, max_duration: Optional[float]) -> Tuple[List[Image.Image], List[int]]:
+    """Loads the frames already scaled down to the target size, so big animations don't take up gigabytes."""
+    frames, durations = [], []
+    ratio = min(1.0, max_dim / max(img.size))
+    size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+    for frame in ImageSequence.Iterator(img):
+        frame = frame.convert("RGBA")
+        frames.append(frame.resize(size, Image.Resampling.LANCZOS) if ratio < 1 else frame)
+        durations.append(frame.info.get("duration") or DEFAULT_FRAME_DURATION)
+        if len(frames) >= MAX_FRAMES or max_duration and sum(durations) >= max_duration * 1000:
+            break
+    if max_duration and sum(durations) > max_duration * 1000:
+        durations[-1] -= sum(durations) - int(max_duration * 1000)
+    return frames, durations
+
+
+def quality_levels(animated: bool, full_color: bool) -> List[Level]:
+    """Every combination of scale, palette size and frame step, from the biggest expected output to the smallest."""
+    levels = [(scale, colors, step)
+              for scale in SCALES
+              for colors in COLORS if colors or full_color
+              for step in (FRAME_STEPS if animated else (1,))]
+    return sorted(levels, key=lambda lv: lv[0]**2 * (math.log2(lv[1]) if lv[1] else 32) / lv[2], reverse=True)
+
+
+def drop_frames(frames: List[Image.Image], durations: List[int], step: int) -> Tuple[List[Image.Image], List[int]]:
+    """Keeps one of every few frames, each one lasting as long as the frames it replaces."""
+    kept = frames[::step]
+    return kept, [sum(durations[i:i + step]) for i in range(0, len(durations), step)]
+
+
+def to_palette(frames: List[Image.Image], colors: int, dither: Image.Dither) -> Tuple[List[Image.Image], int]:
+    """Quantizes every frame to one shared palette, as APNG requires, with its last entry for transparent pixels."""
+    width, height = frames[0].size
+    sample = frames[::max(1, len(frames) // 16)]
+    montage = Image.new("RGB", (width, height * len(sample)))
+    for i, frame in enumerate(sample):
+        montage.paste(frame.convert("RGB"), (0, height * i))
+    palette_img = montage.quantize(colors - 1, method=Image.Quantize.FASTOCTREE)
+    palette = palette_img.getpalette()
+    transparency = len(palette) // 3
+    palette += [0, 0, 0] * (256 - transparency)
+    results = []
+    for frame in frames:
+        result = frame.convert("RGB").quantize(palette=palette_img, dither=dither)
+        result.putpalette(palette)
+        result.paste(transparency, mask=frame.getchannel("A").point(lambda a: 255 if a < 128 else 0))
+        results.append(result)
+    return results, transparency
+
+
+def encode(frames: List[Image.Image], durations: List[int], level: Level, image_format: str) -> bytes:
+    scale, colors, step = level
+    frames, durations = drop_frames(frames, durations, step)
+    if scale < 1:
+        width, height = frames[0].size
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        frames = [frame.resize(size, Image.Resampling.LANCZOS) for frame in frames]
+    options = {}
+    if colors:
+        dither = Image.Dither.NONE if len(frames) > 1 else Image.Dither.FLOYDSTEINBERG  # dithering flickers
+        frames, options["transparency"] = to_palette(frames, colors, dither)
+    if len(frames) > 1:
+        options.update(save_all=True, append_images=frames[1:], duration=durations, loop=0)
+        # frames are complete images, each one replaces the last
+        if image_format == "GIF":
+            options.update(disposal=2)
+        else:
+            options.update(disposal=0, blend=0)
+    fp = io.BytesIO()
+    frames[0].save(fp, image_format, optimize=True, **options)
+    return fp.getvalue()
+
+
+def transcode(data: bytes, target: Target) -> bytes:
+    """
+    Shrinks an image until it fits the target, converting it to a format the target accepts.
+    Searches for the best quality level that fits, encoding the image only a handful of times.
+    Slow for big animations, so it's meant to be run in a worker process.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            animated = getattr(img, "n_frames", 1) > 1
+            image_format = target.animated_format if animated else target.static_formats[0]
+            duration = sum(frame.info.get("duration") or DEFAULT_FRAME_DURATION for frame in ImageSequence.Iterator(img)) \
+                if animated and target.max_duration else 0
+            if (len(data) <= target.max_bytes and max(img.size) <= target.max_dim
+                    and (img.format == target.animated_format if animated else img.format in target.static_formats)
+                    and (not target.max_duration or duration <= target.max_duration * 1000)):
+                return data
+            frames, durations = load_frames(img, target.max_dim, target.max_duration)
+    except (OSError, Image.DecompressionBombError) as error:
+        raise ValueError("That file isn't a supported image") from error
+
+    levels = quality_levels(animated, full_color=image_format != "GIF")
+    best = None
+    low, high = 0, len(levels) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        result = encode(frames, durations, levels[mid], image_format)
+        if len(result) <= target.max_bytes:
+            best = result
+            high = mid - 1
+        else:
+            low = mid + 1
+    if best is None:
+        raise ValueError(f"Couldn't compress the image below {target.max_bytes // 1024} KB")
+    return best
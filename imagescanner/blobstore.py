@@ -0,0 +1,91 @@
+import os
+from collections import OrderedDict
+from hashlib import blake2b
+from pathlib import Path
+from typing import Optional
+
+from imagescanner.constants import log
+
+BLOB_SUFFIX = ".blob"
+
+
+class BlobStore:
+    """
+    Keeps image files on disk named after a hash of their contents, so identical images are only stored once.
+    The least recently used files are deleted once their total size exceeds max_bytes.
+    Reading and writing files should happen in a thread, while the bookkeeping happens in the event loop.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+
+    def __contains__(self, blob_hash: str) -> bool:
+        return blob_hash in self.entries
+
+    def open(self):
+        """Finds the blobs left from last time, in order of last use."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        blobs = []
+        for file in self.path.iterdir():
+            if file.suffix != BLOB_SUFFIX:
+                file.unlink(missing_ok=True)  # unfinished write
+                continue
+            stat = file.stat()
+            blobs.append((stat.st_mtime, file.stem, stat.st_size))
+        for _, blob_hash, size in sorted(blobs):
+            self.entries[blob_hash] = size
+            self.size += size
+        self.evict()
+
+    @staticmethod
+    def hash(data: bytes) -> str:
+        return blake2b(data, digest_size=16).hexdigest()
+
+    def get_path(self, blob_hash: str) -> Path:
+        return self.path / (blob_hash + BLOB_SUFFIX)
+
+    def write(self, data: bytes) -> str:
+        """Saves a blob to disk and returns its hash. Call it in a thread, then call add()."""
+        blob_hash = self.hash(data)
+        path = self.get_path(blob_hash)
+        if not path.exists():
+            temp = path.with_suffix(".tmp")
+            temp.write_bytes(data)
+            os.replace(temp, path)
+        return blob_hash
+
+    def add(self, blob_hash: str, size: int):
+        if blob_hash not in self.entries:
+            self.entries[blob_hash] = size
+            self.size += size
+        self.entries.move_to_end(blob_hash)
+        self.evict()
+
+    def touch(self, blob_hash: str) -> Optional[Path]:
+        """Marks a blob as recently used and returns its path, if it's still stored."""
+        if blob_hash not in self.entries:
+            return None
+        self.entries.move_to_end(blob_hash)
+        path = self.get_path(blob_hash)
+        try:
+            os.utime(path)  # so the order survives a restart
+        except FileNotFoundError:
+            self.size -= self.entries.pop(blob_hash)
+            return None
+        return path
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            blob_hash, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                self.get_path(blob_hash).unlink(missing_ok=True)
+            except OSError:
+                log.exception("Deleting cached image")
+
+    def resize(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.evict()
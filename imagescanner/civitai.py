@@ -0,0 +1,64 @@
+import asyncio
+import aiohttp
+from typing import Dict, Optional, Tuple
+
+from imagescanner.constants import log, HEADERS, CIVITAI_CONCURRENCY, CIVITAI_TIMEOUT
+
+CIVITAI_API_URL = "https://civitai.com/api/v1/model-versions/by-hash/"
+
+
+class CivitaiClient:
+    """
+    Looks up models on Civitai by hash through a single pooled session.
+    Concurrent lookups of the same hash share one request, and at most a few requests run at once.
+    """
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore = asyncio.Semaphore(CIVITAI_CONCURRENCY)
+        self.pending: Dict[str, asyncio.Future] = {}
+
+    def open(self):
+        connector = aiohttp.TCPConnector(limit_per_host=CIVITAI_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=CIVITAI_TIMEOUT)
+        self.session = aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get_model(self, short_hash: str) -> Tuple[bool, Optional[Tuple[int, int]]]:
+        """
+        Returns whether the lookup succeeded, and the model ID and version ID if the hash was found.
+        A failed lookup shouldn't be remembered as not found.
+        """
+        if short_hash in self.pending:
+            return await asyncio.shield(self.pending[short_hash])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[short_hash] = future
+        try:
+            result = await self.fetch_model(short_hash)
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # mark as retrieved in case nobody else was waiting
+            raise
+        finally:
+            del self.pending[short_hash]
+
+    async def fetch_model(self, short_hash: str) -> Tuple[bool, Optional[Tuple[int, int]]]:
+        async with self.semaphore:
+            try:
+                async with self.session.get(f"{CIVITAI_API_URL}{short_hash}") as resp:
+                    if resp.status == 404:
+                        return True, None
+                    resp.raise_for_status()
+                    data = await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                log.exception("Trying to grab model from Civitai")
+                return False, None
+        if not data or "modelId" not in data:
+            return True, None
+        return True, (data["modelId"], data["id"])
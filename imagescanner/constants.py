@@ -1,16 +1,28 @@
-import re
 import logging
 
 log = logging.getLogger("red.crab-cogs.imagescanner")
 
 IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
 VIEW_TIMEOUT = 5*60
-
-# language=RegExp
-LOOKAHEAD_PATTERN = rf'(?=(?:[^"]*"[^"]*")*[^"]*$)'  # ensures the characters surrounding the lookahead are not inside quotes
-PARAM_REGEX = re.compile(rf" ?([^:]+): (.+?),{LOOKAHEAD_PATTERN}")
-PARAM_GROUP_REGEX = re.compile(rf", [^:]+: {{.+?{LOOKAHEAD_PATTERN}}}")
-HASHES_GROUP_REGEX = re.compile(rf", Hashes: ({{.+?{LOOKAHEAD_PATTERN}}})")
+RANGE_CHUNK_SIZE = 64 * 1024
+CACHE_TTL = 24*60*60
+LEGACY_CACHE_MB_PER_IMAGE = 2  # image_cache_size used to be a number of images
+METADATA_CACHE_SIZE = 10000
+CIVITAI_CONCURRENCY = 4
+CIVITAI_TIMEOUT = 10
+MODEL_CACHE_TTL = 30*24*60*60
+MODEL_NOT_FOUND_TTL = 24*60*60
+MODEL_CACHE_FLUSH_INTERVAL = 60
+BACKFILL_BATCH_SIZE = 50
+BACKFILL_CONCURRENCY = 4
+BACKFILL_PROGRESS_INTERVAL = 10
+THUMBNAIL_SIZE = 64
+REPOST_MAX_DISTANCE = 4
+SCAN_QUEUE_SIZE = 100
+SCAN_WORKERS = 4
+SCAN_CHANNEL_LIMIT = 20
+SCAN_DOWNLOAD_CONCURRENCY = 8
+RED_CHECK_TTL = 60
 
 PARAMS_BLACKLIST = [
     "Template", "hashes",
@@ -0,0 +1,66 @@
+import re
+import json
+from collections import OrderedDict
+from typing import Dict, Iterator, List
+
+from imagescanner.utils import get_params_from_string
+
+EXPORT_FORMATS = ("text", "yaml", "json")
+MAX_FIELD_LENGTH = 10000
+DIFF_MIN_SHARED = 0.5
+YAML_PLAIN_KEY_REGEX = re.compile(r"[A-Za-z][\w ]*")
+
+
+def truncate(value: str) -> str:
+    if len(value) <= MAX_FIELD_LENGTH:
+        return value
+    return value[:MAX_FIELD_LENGTH] + f"… [{len(value) - MAX_FIELD_LENGTH:,} more characters]"
+
+
+def parse_fields(data: str) -> Dict[str, str]:
+    try:
+        params = get_params_from_string(data, max_length=None)
+    except (ValueError, KeyError):
+        params = OrderedDict(Parameters=data)
+    return OrderedDict((key, truncate(value.strip())) for key, value in params.items())
+
+
+def split_shared(documents: List[Dict[str, str]]) -> Dict[str, str]:
+    """Returns the fields that every image has in common, if they're most of them, and removes them from each image."""
+    if len(documents) < 2:
+        return {}
+    shared = OrderedDict((key, value) for key, value in documents[0].items()
+                         if all(doc.get(key) == value for doc in documents[1:]))
+    if len(shared) < DIFF_MIN_SHARED * max(len(doc) for doc in documents):
+        return {}
+    for doc in documents:
+        for key in shared:
+            del doc[key]
+    return shared
+
+
+def yaml_document(fields: Dict[str, str]) -> str:
+    # json strings are valid yaml scalars, and never need escaping decisions
+    return "---\n" + "".join(f"{key if YAML_PLAIN_KEY_REGEX.fullmatch(key) else json.dumps(key, ensure_ascii=False)}: "
+                             f"{json.dumps(value, ensure_ascii=False)}\n" for key, value in fields.items())
+
+
+def export_metadata(metadata: Dict[int, str], export_format: str, diff: bool = True) -> Iterator[str]:
+    """Yields the parameters of each image one document at a time, as plain text, yaml documents or a json array."""
+    if export_format == "text":
+        for n, (_, data) in enumerate(sorted(metadata.items())):
+            yield ("\n\n" if n else "") + data
+        return
+    documents = [OrderedDict(image=str(i + 1), **parse_fields(data)) for i, data in sorted(metadata.items())]
+    shared = split_shared(documents) if diff else {}
+    if shared:
+        shared = OrderedDict(image="shared by all", **shared)
+        documents.insert(0, shared)
+    if export_format == "yaml":
+        for doc in documents:
+            yield yaml_document(doc)
+    else:
+        yield "["
+        for n, doc in enumerate(documents):
+            yield ("," if n else "") + "\n" + json.dumps(doc, ensure_ascii=False, indent=2)
+        yield "\n]"
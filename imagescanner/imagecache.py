@@ -0,0 +1,122 @@
+import time
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import discord
+
+from imagescanner.blobstore import BlobStore
+from imagescanner.constants import CACHE_TTL, METADATA_CACHE_SIZE
+
+
+class ImageCache:
+    """
+    Remembers the scanned metadata, rendered embeds and images of recent messages.
+    Metadata and embeds are small, so they're bounded by entry count. Images are stored on disk in a blob store
+    bounded by total size, and only the hash of each message's images is kept in memory.
+    Everything is evicted in least-recently-used order and expires after a day.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.blobs = BlobStore(path, max_bytes)
+        self.metadata: OrderedDict[int, Tuple[float, Dict[int, str]]] = OrderedDict()
+        self.embeds: OrderedDict[int, Tuple[float, Dict[int, discord.Embed]]] = OrderedDict()
+        self.images: OrderedDict[Tuple[int, int], Tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, message_id: int) -> bool:
+        entry = self.metadata.get(message_id)
+        return entry is not None and entry[0] > time.time() - CACHE_TTL
+
+    async def put(self, message_id: int, metadata: Dict[int, str], image_bytes: Dict[int, bytes]):
+        """Caches the metadata and images of a message, writing the images from a thread."""
+        self.set_metadata(message_id, metadata)
+        for i, data in image_bytes.items():
+            await self.add_image(message_id, i, data)
+
+    def open(self):
+        self.blobs.open()
+
+    def get_metadata(self, message_id: int) -> Optional[Dict[int, str]]:
+        if message_id not in self:
+            self.misses += 1
+            self.metadata.pop(message_id, None)
+            return None
+        self.hits += 1
+        self.metadata.move_to_end(message_id)
+        return self.metadata[message_id][1]
+
+    def set_metadata(self, message_id: int, metadata: Dict[int, str]):
+        self.metadata[message_id] = (time.time(), metadata)
+        self.metadata.move_to_end(message_id)
+        while len(self.metadata) > METADATA_CACHE_SIZE:
+            self.metadata.popitem(last=False)
+            self.evictions += 1
+
+    def get_embeds(self, message_id: int) -> Optional[Dict[int, discord.Embed]]:
+        entry = self.embeds.get(message_id)
+        if entry is None or entry[0] <= time.time() - CACHE_TTL:
+            return None
+        self.embeds.move_to_end(message_id)
+        return entry[1]
+
+    def set_embeds(self, message_id: int, embeds: Dict[int, discord.Embed]):
+        self.embeds[message_id] = (time.time(), embeds)
+        self.embeds.move_to_end(message_id)
+        while len(self.embeds) > METADATA_CACHE_SIZE:
+            self.embeds.popitem(last=False)
+
+    def clear_embeds(self):
+        self.embeds.clear()
+
+    def get_image(self, message_id: int, i: int) -> Optional[Tuple[Path, str]]:
+        """Returns the path of a cached image file and its hash."""
+        entry = self.images.get((message_id, i))
+        if entry is None or entry[0] <= time.time() - CACHE_TTL:
+            return None
+        path = self.blobs.touch(entry[1])
+        if path is None:
+            del self.images[(message_id, i)]
+            return None
+        self.images.move_to_end((message_id, i))
+        return path, entry[1]
+
+    async def add_image(self, message_id: int, i: int, data: bytes) -> Optional[Tuple[Path, str]]:
+        if len(data) > self.blobs.max_bytes:
+            return None
+        blob_hash = await asyncio.to_thread(self.blobs.write, data)
+        self.set_image(message_id, i, blob_hash, len(data))
+        return self.blobs.get_path(blob_hash), blob_hash
+
+    def set_image(self, message_id: int, i: int, blob_hash: str, size: int):
+        self.blobs.add(blob_hash, size)
+        self.images[(message_id, i)] = (time.time(), blob_hash)
+        self.images.move_to_end((message_id, i))
+        self.evict()
+
+    def evict(self):
+        cutoff = time.time() - CACHE_TTL
+        for key in [key for key, (created, blob_hash) in self.images.items() if created <= cutoff or blob_hash not in self.blobs]:
+            del self.images[key]
+            self.evictions += 1
+        while len(self.images) > METADATA_CACHE_SIZE:
+            self.images.popitem(last=False)
+
+    def resize(self, max_bytes: int):
+        self.blobs.resize(max_bytes)
+        self.evict()
+
+    def clear(self):
+        self.metadata.clear()
+        self.embeds.clear()
+        self.images.clear()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = f"{self.hits / total:.0%}" if total else "N/A"
+        return f"{len(self.metadata)} posts and {len(self.images)} images cached, with {len(self.blobs.entries)} files " \
+               f"using {self.blobs.size / 1024**2:.1f}/{self.blobs.max_bytes / 1024**2:.0f} MB of disk. " \
+               f"{self.hits} hits, {self.misses} misses ({hit_rate} hit rate), {self.evictions} evictions."
@@ -1,17 +1,27 @@
 import io
 import re
 import json
+import time
 import asyncio
+import tempfile
 import aiohttp
 import discord
-from hashlib import md5
 from redbot.core import commands, app_commands, Config
-from expiringdict import ExpiringDict
-from typing import Optional
+from redbot.core.data_manager import cog_data_path
+from typing import Optional, Dict, List, Tuple
 
 import imagescanner.utils as utils
 from imagescanner.imageview import ImageView
-from imagescanner.constants import log, IMAGE_TYPES, HASHES_GROUP_REGEX, HEADERS
+from imagescanner.imagecache import ImageCache
+from imagescanner.metadataindex import MetadataIndex
+from imagescanner.civitai import CivitaiClient
+from imagescanner.modelcache import ModelCache
+from imagescanner.scanqueue import ScanQueue
+from imagescanner.export import EXPORT_FORMATS, export_metadata
+from imagescanner.params import find_hashes
+from imagescanner.constants import log, IMAGE_TYPES, BACKFILL_BATCH_SIZE, BACKFILL_CONCURRENCY, BACKFILL_PROGRESS_INTERVAL, \
+    REPOST_MAX_DISTANCE, SCAN_QUEUE_SIZE, SCAN_WORKERS, SCAN_CHANNEL_LIMIT, SCAN_DOWNLOAD_CONCURRENCY, RED_CHECK_TTL, \
+    LEGACY_CACHE_MB_PER_IMAGE
 
 
 class ImageScanner(commands.Cog):
@@ -26,11 +36,20 @@ class ImageScanner(commands.Cog):
         self.attach_images = True
         self.use_civitai = True
         self.civitai_emoji = ""
-        self.model_cache = {}
-        self.model_not_found_cache = ExpiringDict(max_len=100, max_age_seconds=24*60*60)
-        self.image_cache: Optional[ExpiringDict] = None
-        self.image_cache_size = 100
+        self.model_cache: Optional[ModelCache] = None
+        self.image_cache_mb = 1024
+        self.image_cache = ImageCache(cog_data_path(self) / "images", self.image_cache_mb * 1024**2)
+        self.index_size = 100000
+        self.index: Optional[MetadataIndex] = None
         self.always_scan_generated_images = False
+        self.flag_reposts = False
+        self.export_format = "text"
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.civitai = CivitaiClient()
+        self.backfill_task: Optional[asyncio.Task] = None
+        self.scan_queue = ScanQueue(self.process_message, SCAN_QUEUE_SIZE, SCAN_WORKERS, SCAN_CHANNEL_LIMIT)
+        self.download_semaphore = asyncio.Semaphore(SCAN_DOWNLOAD_CONCURRENCY)
+        self.red_check_cache: Dict[Tuple[int, int], Tuple[float, bool]] = {}
         defaults = {
             "channels": [],
             "scanlimit": self.scan_limit,
@@ -38,8 +57,11 @@ class ImageScanner(commands.Cog):
             "use_civitai": self.use_civitai,
             "civitai_emoji": self.civitai_emoji,
             "model_cache_v2": {},
-            "image_cache_size": self.image_cache_size,
-            "always_scan_generated_images": self.always_scan_generated_images
+            "image_cache_mb": self.image_cache_mb,
+            "index_size": self.index_size,
+            "always_scan_generated_images": self.always_scan_generated_images,
+            "flag_reposts": self.flag_reposts,
+            "export_format": self.export_format,
         }
         self.config.register_global(**defaults)
         self.context_menu = app_commands.ContextMenu(name='Image Info', callback=self.scanimage)
@@ -51,46 +73,129 @@ class ImageScanner(commands.Cog):
         self.attach_images = await self.config.attach_images()
         self.use_civitai = await self.config.use_civitai()
         self.civitai_emoji = await self.config.civitai_emoji()
-        self.model_cache = await self.config.model_cache_v2()
-        self.image_cache_size = await self.config.image_cache_size()
-        self.image_cache = ExpiringDict(max_len=self.image_cache_size, max_age_seconds=24*60*60)
+        legacy_cache_size = await self.config.get_raw("image_cache_size", default=None)
+        if legacy_cache_size is not None:
+            await self.config.image_cache_mb.set(min(102400, legacy_cache_size * LEGACY_CACHE_MB_PER_IMAGE))
+            await self.config.clear_raw("image_cache_size")
+        self.image_cache_mb = await self.config.image_cache_mb()
+        self.image_cache.resize(self.image_cache_mb * 1024**2)
+        await asyncio.to_thread(self.image_cache.open)
+        self.index_size = await self.config.index_size()
         self.always_scan_generated_images = await self.config.always_scan_generated_images()
+        self.flag_reposts = await self.config.flag_reposts()
+        self.export_format = await self.config.export_format()
+        self.session = aiohttp.ClientSession()
+        self.civitai.open()
+        self.index = MetadataIndex(cog_data_path(self) / "index.db", self.index_size)
+        await self.index.open()
+        self.scan_queue.start()
+        self.model_cache = ModelCache(cog_data_path(self) / "models.db")
+        await self.model_cache.open()
+        if old_model_cache := await self.config.model_cache_v2():
+            for short_hash, model_id in old_model_cache.items():
+                self.model_cache.set(short_hash, tuple(model_id))
+            await self.model_cache.flush()
+            await self.config.model_cache_v2.clear()
 
     async def cog_unload(self):
+        self.scan_queue.stop()
+        if self.backfill_task and not self.backfill_task.done():
+            self.backfill_task.cancel()
         self.bot.tree.remove_command(self.context_menu.name, type=self.context_menu.type)
         self.image_cache.clear()
+        if self.session:
+            await self.session.close()
+        await self.civitai.close()
+        if self.model_cache:
+            await self.model_cache.close()
+        if self.index:
+            await self.index.close()
 
     async def red_delete_data_for_user(self, requester: str, user_id: int):
-        pass
+        if self.index:
+            await self.index.remove_author(user_id)
 
     async def is_valid_red_message(self, message: discord.Message) -> bool:
-        return await self.bot.allowed_by_whitelist_blacklist(message.author) \
-               and await self.bot.ignored_channel_or_guild(message) \
-               and not await self.bot.cog_disabled_in_guild(self, message.guild)
+        # remembered for a short time, as busy channels would otherwise repeat these for every message
+        key = (message.author.id, message.channel.id)
+        now = time.monotonic()
+        if key in self.red_check_cache and self.red_check_cache[key][0] > now:
+            return self.red_check_cache[key][1]
+        result = await self.bot.allowed_by_whitelist_blacklist(message.author) \
+                 and await self.bot.ignored_channel_or_guild(message) \
+                 and not await self.bot.cog_disabled_in_guild(self, message.guild)
+        if len(self.red_check_cache) > 1000:
+            self.red_check_cache = {k: v for k, v in self.red_check_cache.items() if v[0] > now}
+        self.red_check_cache[key] = (now + RED_CHECK_TTL, result)
+        return result
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Scan images for AI metadata in allowed channels"""
-        if not message.guild or message.author.bot or message.channel.id not in self.scan_channels:
+        if not message.attachments or not message.guild or message.author.bot or message.channel.id not in self.scan_channels:
+            return
+        attachments = self.get_scannable_attachments(message)
+        if not attachments:
             return
         channel_perms = message.channel.permissions_for(message.guild.me)
         if not channel_perms.add_reactions:
             return
-        attachments = [a for a in message.attachments if a.filename.lower().endswith((".png", ".jpeg", ".jpg")) and a.size < self.scan_limit]
-        if not attachments:
-            return
         if not await self.is_valid_red_message(message):
             return
-        metadata, image_bytes = {}, {}
-        tasks = [utils.read_attachment_metadata(i, attachment, metadata, image_bytes)
-                 for i, attachment in enumerate(attachments)]
-        await asyncio.gather(*tasks)
+        self.scan_queue.submit(message, attachments)
+
+    async def process_message(self, message: discord.Message, attachments: List[discord.Attachment]):
+        reposts = {}
+        metadata = await self.scan_attachments(message, attachments, reposts)
         if metadata:
-            if self.image_cache_size > 0:
-                self.image_cache[message.id] = (metadata, image_bytes)
             await message.add_reaction('🔎')
-        else:
-            self.image_cache[message.id] = ({}, {})
+            if reposts and self.flag_reposts:
+                await message.add_reaction('♻')
+            await self.get_embeds(message, metadata)  # ready for the first reaction
+
+    def get_scannable_attachments(self, message: discord.Message) -> List[discord.Attachment]:
+        return [a for a in message.attachments if a.filename.lower().endswith((".png", ".jpeg", ".jpg", ".webp")) and a.size < self.scan_limit]
+
+    async def scan_attachments(self, message: discord.Message, attachments: List[discord.Attachment],
+                               reposts: Optional[Dict[int, int]] = None) -> Dict[int, str]:
+        """Reads the parameters of each attachment. Reposts of an image that was already scanned get the parameters
+        of the original only if they have none of their own.
+        The index of each reposted attachment and the ID of its original message are added to reposts."""
+        metadata, image_hashes = {}, {}
+        reposts = reposts if reposts is not None else {}
+
+        async def scan(i: int, attachment: discord.Attachment):
+            async with self.download_semaphore:
+                repost = None
+                image_hash = await utils.read_attachment_hash(self.session, attachment)
+                if image_hash is not None:
+                    image_hashes[i] = image_hash
+                    if repost := await self.index.find_repost(image_hash, REPOST_MAX_DISTANCE, message.id):
+                        reposts[i] = repost[0]
+                await utils.read_attachment_metadata(self.session, i, attachment, metadata)
+                if repost and i not in metadata:
+                    metadata[i] = repost[1]
+
+        await asyncio.gather(*[scan(i, attachment) for i, attachment in enumerate(attachments)])
+        self.image_cache.set_metadata(message.id, metadata)
+        await self.index.add(message.id, message.channel.id, message.author.id, metadata, image_hashes)
+        return metadata
+
+    async def get_metadata(self, message: discord.Message, attachments: List[discord.Attachment]) -> Dict[int, str]:
+        """Looks for a previous scan in memory, then on disk, before downloading anything."""
+        metadata = self.image_cache.get_metadata(message.id)
+        if metadata is None:
+            metadata = await self.index.get(message.id)
+            if metadata is not None:
+                self.image_cache.set_metadata(message.id, metadata)
+        if metadata is None:
+            metadata = await self.scan_attachments(message, attachments)
+        return metadata
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id in self.scan_channels and self.index:
+            await self.index.remove(payload.message_id)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, ctx: discord.RawReactionActionEvent):
@@ -110,13 +215,7 @@ class ImageScanner(commands.Cog):
             return
         if not await self.is_valid_red_message(message):
             return
-        if message.id in self.image_cache:
-            metadata, image_bytes = self.image_cache[message.id]
-        else:
-            metadata, image_bytes = {}, {}
-            tasks = [utils.read_attachment_metadata(i, attachment, metadata, image_bytes)
-                     for i, attachment in enumerate(attachments)]
-            await asyncio.gather(*tasks)
+        metadata = await self.get_metadata(message, attachments)
         if not metadata:
             embed = utils.get_embed({}, message.author)
             embed.description = f"{message.jump_url}\nThis post contains no image generation data."
@@ -126,61 +225,100 @@ class ImageScanner(commands.Cog):
             except discord.Forbidden:
                 log.info(f"User {ctx.member.id} does not accept DMs")
             return
-        for i, data in sorted(metadata.items()):
-            params = utils.get_params_from_string(data)
-            embed = utils.get_embed(params, message.author)
-            embed.description = message.jump_url if self.civitai_emoji else f":arrow_right: {message.jump_url}"
-            if len(metadata) > 1:
-                embed.title += f" ({i+1}/{len(metadata)})"
-            if self.use_civitai:
-                desc_ext = []
-                if "Model hash" in params:
-                    link = await self.grab_civitai_model_link(params["Model hash"])
-                    if link:
-                        desc_ext.append(f"[Model:{params['Model']}]({link})" if "Model" in params else f"[Model]({link})")
-                        utils.remove_field(embed, "Model hash")
-                #  vae hashes seem to be bugged in automatic1111 webui
-                utils.remove_field(embed, "VAE hash")
-                # if "VAE hash" in params:
-                #     link = await self.grab_civitai_model_link(params["VAE hash"])
-                #     if link:
-                #         desc_ext.append(f"[VAE:{params['VAE']}]({link})" if "VAE" in params else f"[VAE]({link})")
-                #         self.remove_field(embed, "VAE hash")
-                if m := HASHES_GROUP_REGEX.search(data):
+        # start every download while the embeds are built, but send the DMs in order
+        downloads = {i: asyncio.create_task(self.get_image_file(message, attachments, i))
+                     for i in metadata if self.attach_images}
+        try:
+            embeds = await self.get_embeds(message, metadata)
+            for i, cached_embed in sorted(embeds.items()):
+                embed = cached_embed.copy()
+                view = ImageView(metadata[i], embed)
+                file = await downloads[i] if i in downloads else None
+                if file is not None:
+                    embed.set_image(url=f"attachment://{file.filename}")
                     try:
-                        hashes = json.loads(m.group(1))
-                    except:
-                        log.exception("Trying to parse Civitai hashes")
-                    else:
-                        hashes["model"] = None
-                        hashes["vae"] = None
-                        links = {name: await self.grab_civitai_model_link(short_hash)
-                                 for name, short_hash in hashes.items()}
-                        for name, link in links.items():
-                            if link:
-                                desc_ext.append(f"[{name}]({link})")
-                if desc_ext:
-                    embed.description += f"\n{self.civitai_emoji} " if self.civitai_emoji else "\n🔗 **Civitai:** "
-                    embed.description += ", ".join(desc_ext)
-            view = ImageView(data, embed)
-            if self.attach_images and i in image_bytes:
-                img = io.BytesIO(image_bytes[i])
-                filename = md5(image_bytes[i]).hexdigest() + ".png"
-                file = discord.File(img, filename=filename)
-                embed.set_image(url=f"attachment://{filename}")
-                try:
-                    msg = await ctx.member.send(embed=embed, file=file, view=view)
-                    view.message = msg
-                except discord.Forbidden:
-                    log.info(f"User {ctx.member.id} does not accept DMs")
-            else:
-                if len(attachments) > i:
-                    embed.set_thumbnail(url=attachments[i].url)
+                        msg = await ctx.member.send(embed=embed, file=file, view=view)
+                        view.message = msg
+                    except discord.Forbidden:
+                        log.info(f"User {ctx.member.id} does not accept DMs")
+                        return
+                else:
+                    if len(attachments) > i:
+                        embed.set_thumbnail(url=attachments[i].url)
+                    try:
+                        msg = await ctx.member.send(embed=embed, view=view)
+                        view.message = msg
+                    except discord.Forbidden:
+                        log.info(f"User {ctx.member.id} does not accept DMs")
+                        return
+        finally:
+            for task in downloads.values():
+                task.cancel()
+
+    async def get_embeds(self, message: discord.Message, metadata: Dict[int, str]) -> Dict[int, discord.Embed]:
+        """Builds the embed of every image of a post at once, or reuses them from a previous reaction."""
+        embeds = self.image_cache.get_embeds(message.id)
+        if embeds is None:
+            results = await asyncio.gather(*[self.build_embed(message, i, data, len(metadata)) for i, data in metadata.items()])
+            embeds = dict(zip(metadata.keys(), results))
+            self.image_cache.set_embeds(message.id, embeds)
+        return embeds
+
+    async def build_embed(self, message: discord.Message, i: int, data: str, count: int) -> discord.Embed:
+        params = utils.get_params_from_string(data)
+        embed = utils.get_embed(params, message.author)
+        embed.description = message.jump_url if self.civitai_emoji else f":arrow_right: {message.jump_url}"
+        if count > 1:
+            embed.title += f" ({i+1}/{count})"
+        if self.use_civitai:
+            desc_ext = []
+            hashes = {}
+            if hashes_json := find_hashes(data):
                 try:
-                    msg = await ctx.member.send(embed=embed, view=view)
-                    view.message = msg
-                except discord.Forbidden:
-                    log.info(f"User {ctx.member.id} does not accept DMs")
+                    hashes = json.loads(hashes_json)
+                except:
+                    log.exception("Trying to parse Civitai hashes")
+                else:
+                    hashes["model"] = None
+                    hashes["vae"] = None
+            # resolve all hashes at once
+            model_hash = params.get("Model hash")
+            model_link, *links = await asyncio.gather(self.grab_civitai_model_link(model_hash),
+                                                      *[self.grab_civitai_model_link(short_hash) for short_hash in hashes.values()])
+            if model_link:
+                desc_ext.append(f"[Model:{params['Model']}]({model_link})" if "Model" in params else f"[Model]({model_link})")
+                utils.remove_field(embed, "Model hash")
+            #  vae hashes seem to be bugged in automatic1111 webui
+            utils.remove_field(embed, "VAE hash")
+            # if "VAE hash" in params:
+            #     link = await self.grab_civitai_model_link(params["VAE hash"])
+            #     if link:
+            #         desc_ext.append(f"[VAE:{params['VAE']}]({link})" if "VAE" in params else f"[VAE]({link})")
+            #         self.remove_field(embed, "VAE hash")
+            for name, link in zip(hashes.keys(), links):
+                if link:
+                    desc_ext.append(f"[{name}]({link})")
+            if desc_ext:
+                embed.description += f"\n{self.civitai_emoji} " if self.civitai_emoji else "\n🔗 **Civitai:** "
+                embed.description += ", ".join(desc_ext)
+        return embed
+
+    async def get_image_file(self, message: discord.Message, attachments: List[discord.Attachment], i: int) -> Optional[discord.File]:
+        """Streams the image from the disk cache, downloading it first if needed."""
+        if cached := self.image_cache.get_image(message.id, i):
+            path, blob_hash = cached
+            return discord.File(path, filename=f"{blob_hash}.png")
+        if len(attachments) <= i:
+            return None
+        try:  # only the metadata was downloaded when scanning
+            image_data = await attachments[i].read()
+        except discord.HTTPException:
+            log.exception("Downloading attachment")
+            return None
+        if cached := await self.image_cache.add_image(message.id, i, image_data):
+            path, blob_hash = cached
+            return discord.File(path, filename=f"{blob_hash}.png")
+        return discord.File(io.BytesIO(image_data), filename=f"{self.image_cache.blobs.hash(image_data)}.png")
 
     @staticmethod
     def convert_novelai_info(img_info: dict):  # used by novelai cog
@@ -193,50 +331,79 @@ class ImageScanner(commands.Cog):
         if not attachments:
             await ctx.response.send_message("This post contains no images.", ephemeral=True)
             return
-        if message.id in self.image_cache:
-            metadata, image_bytes = self.image_cache[message.id]
-        else:
-            metadata, image_bytes = {}, {}
-            tasks = [utils.read_attachment_metadata(i, attachment, metadata, image_bytes)
-                     for i, attachment in enumerate(attachments)]
-            await asyncio.gather(*tasks)
+        metadata = await self.get_metadata(message, attachments)
+        export_format = self.export_format
         if not metadata:
+            export_format = "text"
+            metadata = {}  # don't modify the cached copy
             for i, att in enumerate(attachments):
                 size_kb, size_mb = round(att.size / 1024), round(att.size / 1024**2, 2)
                 metadata[i] = f"Filename: {att.filename}, Dimensions: {att.width}x{att.height}, " \
                               f"Filesize: " + (f"{size_mb} MB" if size_mb >= 1.0 else f"{size_kb} KB")
-        response = "\n\n".join([data for i, data in sorted(metadata.items())])
-        if len(response) < 1980:
-            await ctx.response.send_message(f"```yaml\n{response}```", ephemeral=True)
+        # short responses fit in a message, otherwise the rest of the documents are written straight to the file
+        chunks = export_metadata(metadata, export_format)
+        response = ""
+        for chunk in chunks:
+            response += chunk
+            if len(response) >= 1980:
+                break
         else:
-            with io.StringIO() as f:
-                f.write(response)
-                f.seek(0)
-                await ctx.response.send_message(file=discord.File(f, "parameters.yaml"), ephemeral=True)
+            return await ctx.response.send_message(f"```{'json' if export_format == 'json' else 'yaml'}\n{response}```", ephemeral=True)
+        extension = "json" if export_format == "json" else "yaml"
+        with tempfile.TemporaryFile() as f:
+            f.write(response.encode())
+            for chunk in chunks:
+                f.write(chunk.encode())
+            f.seek(0)
+            await ctx.response.send_message(file=discord.File(f, f"parameters.{extension}"), ephemeral=True)
+
+    @app_commands.command(name="imagesearch",
+                          description="Search AI images posted in this server by prompt, model or hash.")
+    @app_commands.describe(query="Words in the prompt, negative prompt, model name or resource hashes.",
+                           model="Only images made with a model containing this name.",
+                           sampler="Only images made with a sampler containing this name.",
+                           seed_min="Only images with a seed of at least this number.",
+                           seed_max="Only images with a seed of at most this number.")
+    @app_commands.guild_only()
+    async def imagesearch(self,
+                          ctx: discord.Interaction,
+                          query: Optional[str],
+                          model: Optional[str],
+                          sampler: Optional[str],
+                          seed_min: Optional[app_commands.Range[int, 0]],
+                          seed_max: Optional[app_commands.Range[int, 0]]):
+        if not any((query, model, sampler, seed_min is not None, seed_max is not None)):
+            return await ctx.response.send_message("Please enter something to search for.", ephemeral=True)
+        channels = [ch for ch in [*ctx.guild.channels, *ctx.guild.threads]
+                    if isinstance(ch, discord.abc.Messageable) and ch.permissions_for(ctx.user).read_message_history]
+        start = time.perf_counter()
+        results = await self.index.search([ch.id for ch in channels], query or "", model or "", sampler or "", seed_min, seed_max)
+        elapsed = (time.perf_counter() - start) * 1000
+        embed = discord.Embed(title="Image search", color=await self.bot.get_embed_color(ctx.channel))
+        lines = []
+        for result in results:
+            link = f"https://discord.com/channels/{ctx.guild.id}/{result.channel_id}/{result.message_id}"
+            details = ", ".join(filter(None, (result.model, f"seed {result.seed}" if result.seed is not None else None)))
+            snippet = result.snippet.replace("\n", " ") or "*No prompt*"
+            line = f"[Image]({link}) by <@{result.author_id}>" + (f" ({details})" if details else "") + f"\n> {snippet[:300]}"
+            if sum(len(ln) + 1 for ln in lines) + len(line) > 4000:
+                break
+            lines.append(line)
+        embed.description = "\n".join(lines) if lines else "No images found."
+        embed.set_footer(text=f"{len(results)} results in {elapsed:.0f} ms")
+        await ctx.response.send_message(embed=embed, ephemeral=True)
 
     async def grab_civitai_model_link(self, short_hash: str) -> Optional[str]:
         if not short_hash:
             return None
-        elif short_hash in self.model_cache:
-            model_id = self.model_cache[short_hash]
-        elif short_hash in self.model_not_found_cache:
-            return None
-        else:
-            url = f"https://civitai.com/api/v1/model-versions/by-hash/{short_hash}"
-            try:
-                async with aiohttp.ClientSession(headers=HEADERS) as session:
-                    async with session.get(url) as resp:
-                        data = await resp.json()
-            except:
-                log.exception("Trying to grab model from Civitai")
+        cached, model_id = self.model_cache.get(short_hash)
+        if not cached:
+            success, model_id = await self.civitai.get_model(short_hash)
+            if not success:
                 return None
-            if not data or "modelId" not in data:
-                self.model_not_found_cache[short_hash] = True
-                return None
-            model_id = (data['modelId'], data['id'])
-            self.model_cache[short_hash] = model_id
-            async with self.config.model_cache_v2() as model_cache:
-                model_cache[short_hash] = model_id
+            self.model_cache.set(short_hash, model_id)
+        if not model_id:
+            return None
         return f"https://civitai.com/models/{model_id[0]}?modelVersionId={model_id[1]}"
 
     # Config commands
@@ -302,6 +469,7 @@ class ImageScanner(commands.Cog):
         """Toggles whether images should look for models on Civitai."""
         self.use_civitai = not self.use_civitai
         await self.config.use_civitai.set(self.use_civitai)
+        self.image_cache.clear_embeds()
         if self.use_civitai:
             await ctx.reply("Images sent in DMs will now try to find models on Civitai.")
         else:
@@ -313,6 +481,7 @@ class ImageScanner(commands.Cog):
         if emoji is None:
             self.civitai_emoji = ""
             await self.config.civitai_emoji.set("")
+            self.image_cache.clear_embeds()
             await ctx.reply(f"No emoji will appear when Civitai links are shown to users, only the word \"Civitai\".")
             return
         try:
@@ -322,23 +491,134 @@ class ImageScanner(commands.Cog):
         else:
             self.civitai_emoji = str(emoji)
             await self.config.civitai_emoji.set(str(emoji))
+            self.image_cache.clear_embeds()
             await ctx.reply(f"{emoji} will now appear when Civitai links are shown to users.")
 
     @scanset.command(name="cache")
     async def scanset_cache(self, ctx: commands.Context, size: Optional[int]):
-        """How many images to cache in memory."""
+        """How many megabytes of images to cache on disk."""
         if size is None:
-            size = await self.config.image_cache_size()
-            await ctx.reply(f"Up to {size} recent images will be cached in memory to prevent duplicate downloads. "
+            await ctx.reply(f"Up to {self.image_cache_mb} MB of recent images will be cached on disk to prevent duplicate downloads. "
+                            f"Images are removed from cache after 24 hours.\n{self.image_cache.stats()}")
+        elif size < 0 or size > 102400:
+            await ctx.reply("Please choose a value between 0 and 102400, or none to see the current value.")
+        else:
+            self.image_cache_mb = size
+            self.image_cache.resize(size * 1024**2)
+            await self.config.image_cache_mb.set(size)
+            await ctx.reply(f"Up to {size} MB of recent images will be cached on disk to prevent duplicate downloads. "
                             f"Images are removed from cache after 24 hours.")
-        elif size < 0 or size > 1000:
-            await ctx.reply("Please choose a value between 0 and 1000, or none to see the current value.")
+
+    @scanset.command(name="index")
+    async def scanset_index(self, ctx: commands.Context, size: Optional[int]):
+        """How many scanned posts to remember on disk, so they don't need to be downloaded again."""
+        if size is None:
+            await ctx.reply(f"The parameters of up to {self.index_size:,} scanned posts will be remembered on disk. "
+                            f"{self.index.stats()}")
+        elif size < 0 or size > 10_000_000:
+            await ctx.reply("Please choose a value between 0 and 10000000, or none to see the current value.")
+        else:
+            self.index_size = size
+            await self.index.resize(size)
+            await self.config.index_size.set(size)
+            await ctx.reply(f"The parameters of up to {size:,} scanned posts will be remembered on disk.")
+
+    @scanset.command(name="backfill")
+    async def scanset_backfill(self, ctx: commands.Context, channel: Optional[discord.TextChannel], add_reactions: Optional[bool] = False):
+        """Scans past images in a channel, so that they can be looked up without downloading them again.
+
+        Progress is saved, so running it again on the same channel continues where it left off.
+        Use it without a channel to stop the current backfill, or add True after the channel to also react to the images."""
+        if self.backfill_task and not self.backfill_task.done():
+            self.backfill_task.cancel()
+            return await ctx.react_quietly("✅")
+        if channel is None:
+            return await ctx.send_help()
+        if not channel.permissions_for(channel.guild.me).read_message_history:
+            return await ctx.reply("I don't have permission to read the history of that channel.")
+        self.backfill_task = asyncio.create_task(self.backfill(ctx, channel, add_reactions))
+
+    async def backfill(self, ctx: commands.Context, channel: discord.TextChannel, add_reactions: bool):
+        last_message_id, scanned, found = await self.index.get_checkpoint(channel.id)
+        after = discord.Object(last_message_id) if last_message_id else None
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+        start_time, last_update, session_scanned = time.perf_counter(), 0.0, 0
+        status = await ctx.reply(f"Backfilling {channel.mention}" + (f", continuing from {scanned:,} messages..." if scanned else "..."))
+
+        def progress() -> str:
+            rate = session_scanned / max(time.perf_counter() - start_time, 1)
+            return f"{scanned:,} messages scanned in {channel.mention}, {found:,} with parameters ({rate:.1f} messages/s)"
+
+        async def scan(message: discord.Message) -> bool:
+            async with semaphore:
+                metadata = await self.scan_attachments(message, self.get_scannable_attachments(message))
+            if metadata and add_reactions and channel.permissions_for(channel.guild.me).add_reactions:
+                await message.add_reaction('🔎')
+            return bool(metadata)
+
+        async def process(batch: List[discord.Message]):
+            nonlocal scanned, found, session_scanned
+            known = await self.index.contains([m.id for m in batch])
+            pending = [m for m in batch if m.id not in known and not m.author.bot and self.get_scannable_attachments(m)]
+            results = await asyncio.gather(*[scan(m) for m in pending], return_exceptions=True)
+            for message, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    log.error(f"Backfilling message {message.id}", exc_info=result)
+            found += sum(1 for result in results if result is True)
+            scanned += len(batch)
+            session_scanned += len(batch)
+            await self.index.set_checkpoint(channel.id, batch[-1].id, scanned, found)
+
+        try:
+            batch = []
+            async for message in channel.history(limit=None, after=after, oldest_first=True):
+                batch.append(message)
+                if len(batch) < BACKFILL_BATCH_SIZE:
+                    continue
+                await process(batch)
+                batch = []
+                if time.perf_counter() - last_update > BACKFILL_PROGRESS_INTERVAL:
+                    last_update = time.perf_counter()
+                    await status.edit(content=f"Backfilling... {progress()}")
+            if batch:
+                await process(batch)
+        except asyncio.CancelledError:
+            await status.edit(content=f"Backfill stopped. {progress()}. Run the command again to continue.")
+            raise
+        except Exception:
+            log.exception("Backfilling channel")
+            await status.edit(content=f"Backfill stopped due to an error. {progress()}. Run the command again to continue.")
+        else:
+            await status.edit(content=f"Backfill complete. {progress()}")
+
+    @scanset.command(name="reposts")
+    async def scanset_reposts(self, ctx: commands.Context):
+        """Toggles reacting with ♻ to images that look like ones posted before."""
+        self.flag_reposts = not self.flag_reposts
+        await self.config.flag_reposts.set(self.flag_reposts)
+        if self.flag_reposts:
+            await ctx.reply("Scanned images that look like a previously scanned image will now get a ♻ reaction.")
         else:
-            await self.config.image_cache_size.set(size)
-            await ctx.reply(f"Up to {size} recent images will be cached in memory to prevent duplicate downloads. "
-                            f"Images are removed from cache after 24 hours."
-                            f"\nRequires a cog reload to apply the new value, which will clear the cache.")
-            
+            await ctx.reply("Reposted images will no longer be flagged, but they will still reuse the original's parameters.")
+
+    @scanset.command(name="stats")
+    async def scanset_stats(self, ctx: commands.Context):
+        """Shows how many images have been scanned and how well the caches are doing."""
+        await ctx.reply(f"**Scan queue:** {self.scan_queue.stats()}\n"
+                        f"**Cache:** {self.image_cache.stats()}\n"
+                        f"**Index:** {self.index.stats()}")
+
+    @scanset.command(name="exportformat")
+    async def scanset_exportformat(self, ctx: commands.Context, export_format: Optional[str]):
+        """Sets how the Image Info context menu shows parameters: text, yaml or json.
+
+        yaml and json show each parameter as its own field, and when several images share most of their parameters, those are shown once."""
+        if export_format is None or export_format.lower() not in EXPORT_FORMATS:
+            return await ctx.reply(f"The current export format is {self.export_format}. Choose one of: {', '.join(EXPORT_FORMATS)}")
+        self.export_format = export_format.lower()
+        await self.config.export_format.set(self.export_format)
+        await ctx.react_quietly("✅")
+
     @scanset.command(name="scangenerated")
     async def scanset_scangenerated(self, ctx: commands.Context):
         """Toggles always scanning images generated by the bot itself, regardless of channel whitelisting in ImageScanner."""
@@ -0,0 +1,295 @@
+import re
+import html
+import zlib
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+EXIF_HEADER = b"Exif\0\0"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\0"
+EXIF_IFD_POINTER = 0x8769
+EXIF_USER_COMMENT = 0x9286
+WEBP_FLAG_EXIF = 0x08
+WEBP_FLAG_XMP = 0x04
+THREAD_THRESHOLD = 1024**2
+
+# language=RegExp
+XMP_PARAMETERS_REGEX = re.compile(r'(?:parameters|UserComment)(?:="([^"]*)"|[^>]*>\s*(?:<rdf:Alt>\s*<rdf:li[^>]*>)?([^<]+))')
+
+
+def decode_user_comment(comment: bytes) -> str:
+    """EXIF UserComment starts with an 8-byte character code."""
+    code, body = comment[:8], comment[8:]
+    if code.startswith(b"UNICODE"):
+        if body.startswith(b"\xff\xfe") or len(body) > 1 and body[1] == 0 and body[0] != 0:
+            return body.decode("utf-16-le", errors="ignore").lstrip("\ufeff").rstrip("\0")
+        if body.count(0) >= len(body) // 3:
+            return body.decode("utf-16-be", errors="ignore").lstrip("\ufeff").rstrip("\0")
+    return body.decode("utf8", errors="ignore").rstrip("\0")
+
+
+def read_exif_user_comment(tiff: memoryview) -> Optional[str]:
+    """Walks the TIFF structure of an EXIF block to find the UserComment tag, without decoding anything else."""
+    if len(tiff) < 8 or bytes(tiff[:2]) not in (b"II", b"MM"):
+        return None
+    endian = "little" if tiff[0] == ord("I") else "big"
+
+    def find_tag(ifd: int, tag: int) -> Optional[memoryview]:
+        if ifd + 2 > len(tiff):
+            return None
+        count = int.from_bytes(tiff[ifd:ifd+2], endian)
+        for entry in range(ifd + 2, min(ifd + 2 + 12 * count, len(tiff) - 11), 12):
+            if int.from_bytes(tiff[entry:entry+2], endian) != tag:
+                continue
+            size = int.from_bytes(tiff[entry+4:entry+8], endian)
+            if int.from_bytes(tiff[entry+2:entry+4], endian) == 4:  # LONG
+                size *= 4
+            if size <= 4:
+                return tiff[entry+8:entry+8+size]
+            offset = int.from_bytes(tiff[entry+8:entry+12], endian)
+            return tiff[offset:offset+size]
+        return None
+
+    ifd0 = int.from_bytes(tiff[4:8], endian)
+    comment = find_tag(ifd0, EXIF_USER_COMMENT)
+    if comment is None and (pointer := find_tag(ifd0, EXIF_IFD_POINTER)) is not None and len(pointer) == 4:
+        comment = find_tag(int.from_bytes(pointer, endian), EXIF_USER_COMMENT)
+    return decode_user_comment(comment.tobytes()) if comment else None
+
+
+def read_xmp_parameters(xmp: memoryview) -> Optional[str]:
+    if m := XMP_PARAMETERS_REGEX.search(str(xmp, "utf8", errors="ignore")):
+        return html.unescape(m.group(1) or m.group(2))
+    return None
+
+
+class MetadataParser(ABC):
+    """
+    Incremental parser for the metadata of an image file. Each call to feed() receives the bytes of the file
+    starting at self.offset, and returns how many of them were consumed. The result may exceed the bytes given,
+    meaning the following bytes can be skipped without being downloaded.
+    """
+
+    def __init__(self):
+        self.info: Dict[str, str] = {}
+        self.offset = 0
+        self.done = False
+
+    @abstractmethod
+    def feed(self, data: memoryview) -> int:
+        """Reads the bytes of the file starting at self.offset, and returns how many were consumed or skipped."""
+
+    def found(self) -> bool:
+        return "parameters" in self.info or "Comment" in self.info
+
+
+class PngParser(MetadataParser):
+    def feed(self, data: memoryview) -> int:
+        pos = 0
+        if self.offset == 0:
+            if len(data) < 8:
+                return 0
+            if data[:8] != PNG_SIGNATURE:
+                self.done = True
+                return 0
+            pos = 8
+        while pos + 8 <= len(data):
+            length = int.from_bytes(data[pos:pos+4], "big")
+            chunk_type = data[pos+4:pos+8].tobytes()
+            if chunk_type in (b"IDAT", b"IEND"):
+                self.done = True
+                break
+            end = pos + 12 + length
+            if chunk_type in PNG_TEXT_CHUNKS:
+                if end > len(data):
+                    break
+                self.read_text_chunk(chunk_type, data[pos+8:pos+8+length].tobytes())
+                if self.found():
+                    self.done = True
+                    pos = end
+                    break
+            pos = end
+        self.offset += pos
+        return pos
+
+    def read_text_chunk(self, chunk_type: bytes, chunk: bytes):
+        key, _, value = chunk.partition(b"\0")
+        try:
+            if chunk_type == b"tEXt":
+                self.info[key.decode("latin-1")] = value.decode("latin-1")
+            elif chunk_type == b"zTXt":
+                self.info[key.decode("latin-1")] = zlib.decompress(value[1:]).decode("latin-1")
+            elif chunk_type == b"iTXt":
+                compressed, rest = value[0], value[2:]
+                _, _, rest = rest.partition(b"\0")  # language tag
+                _, _, text = rest.partition(b"\0")  # translated keyword
+                self.info[key.decode("latin-1")] = (zlib.decompress(text) if compressed else text).decode("utf8")
+        except (zlib.error, UnicodeDecodeError, IndexError):
+            pass
+
+
+class JpegParser(MetadataParser):
+    def feed(self, data: memoryview) -> int:
+        pos = 0
+        if self.offset == 0:
+            if len(data) < 2:
+                return 0
+            if data[:2] != b"\xff\xd8":
+                self.done = True
+                return 0
+            pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                self.done = True
+                break
+            marker = data[pos+1]
+            if marker == 0xFF:  # fill byte
+                pos += 1
+                continue
+            if marker in (0xD9, 0xDA):  # end of image, start of scan
+                self.done = True
+                break
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # no length
+                pos += 2
+                continue
+            end = pos + 2 + int.from_bytes(data[pos+2:pos+4], "big")
+            if marker == 0xE1:
+                if end > len(data):
+                    break
+                segment = data[pos+4:end]
+                if segment[:6] == EXIF_HEADER:
+                    comment = read_exif_user_comment(segment[6:])
+                    if comment:
+                        self.info["parameters"] = comment
+                elif segment[:len(XMP_HEADER)] == XMP_HEADER:
+                    parameters = read_xmp_parameters(segment[len(XMP_HEADER):])
+                    if parameters:
+                        self.info["parameters"] = parameters
+                if self.found():
+                    self.done = True
+                    pos = end
+                    break
+            pos = end
+        self.offset += pos
+        return pos
+
+
+class WebpParser(MetadataParser):
+    # EXIF and XMP chunks come after the image data in WebP, so the image chunks are skipped over instead
+    def feed(self, data: memoryview) -> int:
+        pos = 0
+        if self.offset == 0:
+            if len(data) < 12:
+                return 0
+            if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+                self.done = True
+                return 0
+            pos = 12
+        while pos + 8 <= len(data):
+            fourcc = data[pos:pos+4].tobytes()
+            size = int.from_bytes(data[pos+4:pos+8], "little")
+            end = pos + 8 + size + (size & 1)
+            if fourcc in (b"VP8 ", b"VP8L") and self.offset + pos == 12:  # simple format without metadata
+                self.done = True
+                break
+            if fourcc in (b"VP8X", b"EXIF", b"XMP "):
+                if end > len(data):
+                    break
+                payload = data[pos+8:pos+8+size]
+                if fourcc == b"VP8X" and not payload[0] & (WEBP_FLAG_EXIF | WEBP_FLAG_XMP):
+                    self.done = True
+                    pos = end
+                    break
+                if fourcc == b"EXIF":
+                    comment = read_exif_user_comment(payload[6:] if payload[:6] == EXIF_HEADER else payload)
+                    if comment:
+                        self.info["parameters"] = comment
+                elif fourcc == b"XMP ":
+                    parameters = read_xmp_parameters(payload)
+                    if parameters:
+                        self.info["parameters"] = parameters
+                if self.found():
+                    self.done = True
+                    pos = end
+                    break
+            pos = end
+        self.offset += pos
+        return pos
+
+
+PARSERS = {
+    ".png": PngParser,
+    ".jpg": JpegParser,
+    ".jpeg": JpegParser,
+    ".webp": WebpParser,
+}
+
+
+def get_parser(filename: str) -> Optional[MetadataParser]:
+    for extension, parser in PARSERS.items():
+        if filename.lower().endswith(extension):
+            return parser()
+    return None
+
+
+def sniff_parser(data: bytes) -> Optional[MetadataParser]:
+    if data.startswith(PNG_SIGNATURE):
+        return PngParser()
+    if data.startswith(b"\xff\xd8"):
+        return JpegParser()
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return WebpParser()
+    return None
+
+
+def feed_parser(parser: MetadataParser, data: memoryview) -> int:
+    """Feeds a complete buffer until the parser finishes or runs out of data."""
+    total = 0
+    while not parser.done and total < len(data):
+        consumed = parser.feed(data[total:])
+        if not consumed:
+            break
+        total += consumed
+    return total
+
+
+def parse_metadata(data: bytes) -> Dict[str, str]:
+    """Reads the text metadata of a full PNG, JPEG or WebP file."""
+    parser = sniff_parser(data[:12])
+    if not parser:
+        return {}
+    with memoryview(data) as view:
+        feed_parser(parser, view)
+    return parser.info
+
+
+async def parse_metadata_async(data: bytes) -> Dict[str, str]:
+    if len(data) > THREAD_THRESHOLD:
+        return await asyncio.to_thread(parse_metadata, data)
+    return parse_metadata(data)
+
+
+if __name__ == "__main__":  # python -m imagescanner.metadata [image files] to compare against PIL
+    import io
+    import sys
+    import timeit
+    from PIL import Image
+
+    def parse_with_pil(data: bytes):
+        with Image.open(io.BytesIO(data)) as img:
+            info = dict(img.info)
+            comment = img.getexif().get_ifd(EXIF_IFD_POINTER).get(EXIF_USER_COMMENT)
+            if comment:
+                info["parameters"] = decode_user_comment(comment)
+            return info
+
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            file_data = f.read()
+        runs = 200
+        ours = timeit.timeit(lambda: parse_metadata(file_data), number=runs) / runs
+        pil = timeit.timeit(lambda: parse_with_pil(file_data), number=runs) / runs
+        same = parse_metadata(file_data).get("parameters") == parse_with_pil(file_data).get("parameters")
+        print(f"{path}: {ours * 1e6:.1f} µs vs PIL {pil * 1e6:.1f} µs ({pil / ours:.1f}x), same result: {same}")
@@ -0,0 +1,281 @@
+import re
+import json
+import aiosqlite as sql
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from imagescanner.utils import get_params_from_string
+from imagescanner.params import find_hashes
+from imagescanner.phash import BKTree
+from imagescanner.constants import log
+
+DB_TABLE_MESSAGES = "messages"
+DB_TABLE_PARAMETERS = "parameters"
+DB_TABLE_CHECKPOINTS = "checkpoints"
+DB_TABLE_DETAILS = "details"
+DB_TABLE_SEARCH = "search"
+DB_TABLE_IMAGE_HASHES = "image_hashes"
+PRUNE_SLACK = 0.1
+SEARCH_TOKEN_REGEX = re.compile(r"\w+")
+
+
+@dataclass
+class SearchResult:
+    message_id: int
+    channel_id: int
+    author_id: int
+    attachment: int
+    snippet: str
+    model: Optional[str]
+    seed: Optional[int]
+
+
+def get_search_fields(parameters: str) -> Tuple[str, str, str, str, str, Optional[int]]:
+    """Extracts the prompt, negative prompt, model, hashes, sampler and seed of a parameter string."""
+    try:
+        params = get_params_from_string(parameters, max_length=None)
+    except (ValueError, KeyError):
+        return parameters, "", "", "", "", None
+    prompt = params.get("Prompt") or params.get("NovelAI3 Prompt") or ""
+    model = params.get("Model") or ("NovelAI" if "NovelAI3 Prompt" in params else "")
+    hashes = [params.get("Model hash", "")]
+    try:
+        hashes += [str(short_hash) for short_hash in json.loads(find_hashes(parameters) or "{}").values()]
+    except (ValueError, AttributeError):
+        pass
+    seed = params.get("Seed", "")
+    return (prompt.strip(), params.get("Negative Prompt", "").strip(), model, " ".join(filter(None, hashes)),
+            params.get("Sampler", ""), int(seed) if seed.isdigit() else None)
+
+
+class MetadataIndex:
+    """
+    Remembers the parameters found in every scanned message on disk, keyed by message ID and attachment index,
+    so that old posts don't need to be downloaded again. Messages without parameters are remembered too.
+    Once it holds more than max_messages, the oldest messages are pruned, as message IDs are chronological.
+    The perceptual hash of each image is also kept in memory in a BK-tree, to find reposts of indexed images.
+    """
+
+    def __init__(self, path: Path, max_messages: int):
+        self.path = path
+        self.max_messages = max_messages
+        self.db: Optional[sql.Connection] = None
+        self.count = 0
+        self.hash_tree: BKTree[Tuple[int, int]] = BKTree()
+
+    async def open(self):
+        self.db = await sql.connect(self.path)
+        await self.db.execute("PRAGMA journal_mode=WAL;")
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_MESSAGES} "
+                              f"(message_id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL);")
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_PARAMETERS} "
+                              f"(message_id INTEGER NOT NULL, attachment INTEGER NOT NULL, parameters TEXT NOT NULL, "
+                              f"PRIMARY KEY (message_id, attachment)) WITHOUT ROWID;")
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_CHECKPOINTS} "
+                              f"(channel_id INTEGER PRIMARY KEY, last_message_id INTEGER NOT NULL, "
+                              f"scanned INTEGER NOT NULL, found INTEGER NOT NULL);")
+        # each image's searchable fields, where the FTS rowid is the details id
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_DETAILS} "
+                              f"(id INTEGER PRIMARY KEY, message_id INTEGER NOT NULL, attachment INTEGER NOT NULL, "
+                              f"model TEXT, sampler TEXT, seed INTEGER, UNIQUE (message_id, attachment));")
+        await self.db.execute(f"CREATE INDEX IF NOT EXISTS {DB_TABLE_DETAILS}_seed ON {DB_TABLE_DETAILS} (seed);")
+        await self.db.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {DB_TABLE_SEARCH} "
+                              f"USING fts5(prompt, negative_prompt, model, hashes, tokenize='unicode61');")
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_IMAGE_HASHES} "
+                              f"(message_id INTEGER NOT NULL, attachment INTEGER NOT NULL, hash INTEGER NOT NULL, "
+                              f"PRIMARY KEY (message_id, attachment)) WITHOUT ROWID;")
+        await self.db.commit()
+        async with self.db.execute(f"SELECT COUNT(*) FROM {DB_TABLE_MESSAGES}") as cursor:
+            self.count = (await cursor.fetchone())[0]
+        await self.prune()
+        await self.build_search()
+        await self.build_hash_tree()
+
+    async def close(self):
+        if self.db:
+            await self.db.close()
+            self.db = None
+
+    async def get(self, message_id: int) -> Optional[Dict[int, str]]:
+        """Returns the parameters of each attachment of a scanned message, or None if it was never scanned."""
+        if not self.db:
+            return None
+        async with self.db.execute(f"SELECT p.attachment, p.parameters FROM {DB_TABLE_MESSAGES} m "
+                                   f"LEFT JOIN {DB_TABLE_PARAMETERS} p USING (message_id) WHERE m.message_id = ?",
+                                   [message_id]) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return None
+        return {i: parameters for i, parameters in rows if i is not None}
+
+    async def add(self, message_id: int, channel_id: int, author_id: int, metadata: Dict[int, str],
+                  image_hashes: Optional[Dict[int, int]] = None):
+        if not self.db or self.max_messages <= 0:
+            return
+        async with self.db.execute(f"INSERT OR IGNORE INTO {DB_TABLE_MESSAGES} VALUES (?, ?, ?)",
+                                   [message_id, channel_id, author_id]) as cursor:
+            self.count += cursor.rowcount
+        await self.db.executemany(f"INSERT OR REPLACE INTO {DB_TABLE_PARAMETERS} VALUES (?, ?, ?)",
+                                  [(message_id, i, parameters) for i, parameters in metadata.items()])
+        for i, parameters in metadata.items():
+            await self.add_search(message_id, i, parameters)
+        if image_hashes:
+            # sqlite integers are signed
+            await self.db.executemany(f"INSERT OR REPLACE INTO {DB_TABLE_IMAGE_HASHES} VALUES (?, ?, ?)",
+                                      [(message_id, i, image_hash - 2**63) for i, image_hash in image_hashes.items()])
+            for i, image_hash in image_hashes.items():
+                self.hash_tree.add(image_hash, (message_id, i))
+        await self.db.commit()
+        if self.count > self.max_messages * (1 + PRUNE_SLACK):
+            await self.prune()
+
+    async def remove(self, message_id: int):
+        if not self.db:
+            return
+        async with self.db.execute(f"DELETE FROM {DB_TABLE_MESSAGES} WHERE message_id = ?", [message_id]) as cursor:
+            self.count -= cursor.rowcount
+        await self.db.execute(f"DELETE FROM {DB_TABLE_PARAMETERS} WHERE message_id = ?", [message_id])
+        await self.db.execute(f"DELETE FROM {DB_TABLE_IMAGE_HASHES} WHERE message_id = ?", [message_id])
+        await self.delete_search("message_id = ?", [message_id])
+        await self.db.commit()
+
+    async def remove_author(self, author_id: int):
+        if not self.db:
+            return
+        await self.db.execute(f"DELETE FROM {DB_TABLE_PARAMETERS} WHERE message_id IN "
+                              f"(SELECT message_id FROM {DB_TABLE_MESSAGES} WHERE author_id = ?)", [author_id])
+        await self.db.execute(f"DELETE FROM {DB_TABLE_IMAGE_HASHES} WHERE message_id IN "
+                              f"(SELECT message_id FROM {DB_TABLE_MESSAGES} WHERE author_id = ?)", [author_id])
+        await self.delete_search(f"message_id IN (SELECT message_id FROM {DB_TABLE_MESSAGES} WHERE author_id = ?)", [author_id])
+        async with self.db.execute(f"DELETE FROM {DB_TABLE_MESSAGES} WHERE author_id = ?", [author_id]) as cursor:
+            self.count -= cursor.rowcount
+        await self.db.commit()
+
+    async def contains(self, message_ids: List[int]) -> Set[int]:
+        if not self.db or not message_ids:
+            return set()
+        placeholders = ", ".join("?" * len(message_ids))
+        async with self.db.execute(f"SELECT message_id FROM {DB_TABLE_MESSAGES} WHERE message_id IN ({placeholders})",
+                                   message_ids) as cursor:
+            return {row[0] async for row in cursor}
+
+    async def get_checkpoint(self, channel_id: int) -> Tuple[int, int, int]:
+        """Returns the last message ID scanned by a channel backfill, and how many messages were scanned and found."""
+        async with self.db.execute(f"SELECT last_message_id, scanned, found FROM {DB_TABLE_CHECKPOINTS} WHERE channel_id = ?",
+                                   [channel_id]) as cursor:
+            row = await cursor.fetchone()
+        return row or (0, 0, 0)
+
+    async def set_checkpoint(self, channel_id: int, last_message_id: int, scanned: int, found: int):
+        await self.db.execute(f"INSERT OR REPLACE INTO {DB_TABLE_CHECKPOINTS} VALUES (?, ?, ?, ?)",
+                              [channel_id, last_message_id, scanned, found])
+        await self.db.commit()
+
+    async def remove_checkpoint(self, channel_id: int):
+        await self.db.execute(f"DELETE FROM {DB_TABLE_CHECKPOINTS} WHERE channel_id = ?", [channel_id])
+        await self.db.commit()
+
+    async def prune(self):
+        if not self.db or self.count <= self.max_messages:
+            return
+        async with self.db.execute(f"SELECT message_id FROM {DB_TABLE_MESSAGES} ORDER BY message_id DESC "
+                                   f"LIMIT 1 OFFSET ?", [self.max_messages]) as cursor:
+            row = await cursor.fetchone()
+        if row:
+            await self.db.execute(f"DELETE FROM {DB_TABLE_PARAMETERS} WHERE message_id <= ?", [row[0]])
+            await self.db.execute(f"DELETE FROM {DB_TABLE_IMAGE_HASHES} WHERE message_id <= ?", [row[0]])
+            await self.delete_search("message_id <= ?", [row[0]])
+            await self.db.execute(f"DELETE FROM {DB_TABLE_MESSAGES} WHERE message_id <= ?", [row[0]])
+            await self.db.commit()
+            await self.build_hash_tree()
+        self.count = min(self.count, self.max_messages)
+
+    async def add_search(self, message_id: int, attachment: int, parameters: str):
+        prompt, negative_prompt, model, hashes, sampler, seed = get_search_fields(parameters)
+        await self.delete_search("message_id = ? AND attachment = ?", [message_id, attachment])
+        async with self.db.execute(f"INSERT INTO {DB_TABLE_DETAILS} (message_id, attachment, model, sampler, seed) "
+                                   f"VALUES (?, ?, ?, ?, ?)", [message_id, attachment, model, sampler, seed]) as cursor:
+            rowid = cursor.lastrowid
+        await self.db.execute(f"INSERT INTO {DB_TABLE_SEARCH} (rowid, prompt, negative_prompt, model, hashes) "
+                              f"VALUES (?, ?, ?, ?, ?)", [rowid, prompt, negative_prompt, model, hashes])
+
+    async def delete_search(self, condition: str, args: list):
+        await self.db.execute(f"DELETE FROM {DB_TABLE_SEARCH} WHERE rowid IN "
+                              f"(SELECT id FROM {DB_TABLE_DETAILS} WHERE {condition})", args)
+        await self.db.execute(f"DELETE FROM {DB_TABLE_DETAILS} WHERE {condition}", args)
+
+    async def build_search(self):
+        """Fills the search index with parameters that were stored before it existed."""
+        async with self.db.execute(f"SELECT p.message_id, p.attachment, p.parameters FROM {DB_TABLE_PARAMETERS} p "
+                                   f"LEFT JOIN {DB_TABLE_DETAILS} d USING (message_id, attachment) WHERE d.id IS NULL") as cursor:
+            missing = await cursor.fetchall()
+        if not missing:
+            return
+        log.info(f"Adding {len(missing)} images to the search index")
+        for message_id, attachment, parameters in missing:
+            await self.add_search(message_id, attachment, parameters)
+        await self.db.commit()
+
+    async def search(self, channel_ids: List[int], query: str = "", model: str = "", sampler: str = "",
+                     seed_min: Optional[int] = None, seed_max: Optional[int] = None, limit: int = 10) -> List[SearchResult]:
+        """Ranked full-text search over prompts, models and hashes, with optional filters, within the given channels."""
+        if not self.db or not channel_ids:
+            return []
+        conditions, args = [f"m.channel_id IN ({', '.join('?' * len(channel_ids))})"], list(channel_ids)
+        if model:
+            conditions.append("d.model LIKE ?")
+            args.append(f"%{model}%")
+        if sampler:
+            conditions.append("d.sampler LIKE ?")
+            args.append(f"%{sampler}%")
+        if seed_min is not None:
+            conditions.append("d.seed >= ?")
+            args.append(seed_min)
+        if seed_max is not None:
+            conditions.append("d.seed <= ?")
+            args.append(seed_max)
+        # seed ranges are walked in order of seed, so that wide ranges don't need sorting
+        order = "d.seed" if seed_min is not None or seed_max is not None else "d.message_id DESC"
+        # every word must match, without letting the user write FTS syntax
+        match = " ".join(f'"{token}"*' for token in SEARCH_TOKEN_REGEX.findall(query))
+        if match:
+            sql_query = (f"SELECT m.message_id, m.channel_id, m.author_id, d.attachment, "
+                         f"snippet({DB_TABLE_SEARCH}, 0, '**', '**', '…', 16), d.model, d.seed "
+                         f"FROM {DB_TABLE_SEARCH} s JOIN {DB_TABLE_DETAILS} d ON d.id = s.rowid "
+                         f"JOIN {DB_TABLE_MESSAGES} m ON m.message_id = d.message_id "
+                         f"WHERE {DB_TABLE_SEARCH} MATCH ? AND {' AND '.join(conditions)} ORDER BY s.rank LIMIT ?")
+            args = [match] + args
+        else:
+            sql_query = (f"SELECT m.message_id, m.channel_id, m.author_id, d.attachment, substr(s.prompt, 1, 100), d.model, d.seed "
+                         f"FROM {DB_TABLE_DETAILS} d CROSS JOIN {DB_TABLE_MESSAGES} m ON m.message_id = d.message_id "
+                         f"CROSS JOIN {DB_TABLE_SEARCH} s ON s.rowid = d.id "  # don't let it scan the whole FTS table
+                         f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?")
+        async with self.db.execute(sql_query, args + [limit]) as cursor:
+            return [SearchResult(*row) async for row in cursor]
+
+    async def build_hash_tree(self):
+        self.hash_tree = BKTree()
+        async with self.db.execute(f"SELECT message_id, attachment, hash FROM {DB_TABLE_IMAGE_HASHES}") as cursor:
+            async for message_id, attachment, image_hash in cursor:
+                self.hash_tree.add(image_hash + 2**63, (message_id, attachment))
+
+    async def find_repost(self, image_hash: int, max_distance: int, exclude_message_id: int) -> Optional[Tuple[int, str]]:
+        """Returns the message ID and parameters of the closest indexed image that looks the same and has parameters."""
+        for _, (message_id, attachment) in self.hash_tree.search(image_hash, max_distance):
+            if message_id == exclude_message_id:
+                continue
+            # removed messages stay in the tree until the next prune
+            async with self.db.execute(f"SELECT parameters FROM {DB_TABLE_PARAMETERS} WHERE message_id = ? AND attachment = ?",
+                                       [message_id, attachment]) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                return message_id, row[0]
+        return None
+
+    async def resize(self, max_messages: int):
+        self.max_messages = max_messages
+        await self.prune()
+
+    def stats(self) -> str:
+        return f"{self.count:,}/{self.max_messages:,} posts indexed."
@@ -0,0 +1,87 @@
+import time
+import asyncio
+import aiosqlite as sql
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from imagescanner.constants import log, MODEL_CACHE_TTL, MODEL_NOT_FOUND_TTL, MODEL_CACHE_FLUSH_INTERVAL
+
+DB_TABLE_MODELS = "models"
+
+ModelId = Tuple[int, int]
+
+
+class ModelCache:
+    """
+    Remembers which Civitai model each hash belongs to, or that it wasn't found, for a limited time.
+    Everything is loaded into memory at once, and new entries are written to disk in batches on an interval.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db: Optional[sql.Connection] = None
+        self.entries: Dict[str, Tuple[Optional[ModelId], float]] = {}
+        self.dirty: Dict[str, Tuple[Optional[ModelId], float]] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def open(self):
+        self.db = await sql.connect(self.path)
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_MODELS} "
+                              f"(hash TEXT PRIMARY KEY, model_id INTEGER, version_id INTEGER, checked REAL NOT NULL) WITHOUT ROWID;")
+        now = time.time()
+        await self.db.execute(f"DELETE FROM {DB_TABLE_MODELS} WHERE model_id IS NULL AND checked < ? OR checked < ?",
+                              [now - MODEL_NOT_FOUND_TTL, now - MODEL_CACHE_TTL])
+        await self.db.commit()
+        async with self.db.execute(f"SELECT hash, model_id, version_id, checked FROM {DB_TABLE_MODELS}") as cursor:
+            self.entries = {short_hash: ((model_id, version_id) if model_id is not None else None, checked)
+                            async for short_hash, model_id, version_id, checked in cursor}
+        self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def close(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.db:
+            await self.flush()
+            await self.db.close()
+            self.db = None
+
+    def get(self, short_hash: str) -> Tuple[bool, Optional[ModelId]]:
+        """Returns whether the hash is cached, and its model ID and version ID if it was found."""
+        entry = self.entries.get(short_hash)
+        if entry is None:
+            return False, None
+        model_id, checked = entry
+        ttl = MODEL_CACHE_TTL if model_id else MODEL_NOT_FOUND_TTL
+        if checked < time.time() - ttl:
+            del self.entries[short_hash]
+            return False, None
+        return True, model_id
+
+    def set(self, short_hash: str, model_id: Optional[ModelId], checked: Optional[float] = None):
+        entry = (model_id, checked or time.time())
+        self.entries[short_hash] = entry
+        self.dirty[short_hash] = entry
+
+    async def flush(self):
+        if not self.dirty or not self.db:
+            return
+        batch, self.dirty = self.dirty, {}
+        rows = [(short_hash, *(model_id or (None, None)), checked) for short_hash, (model_id, checked) in batch.items()]
+        try:
+            await self.db.executemany(f"INSERT OR REPLACE INTO {DB_TABLE_MODELS} VALUES (?, ?, ?, ?)", rows)
+            await self.db.commit()
+        except sql.Error:
+            self.dirty = {**batch, **self.dirty}  # try again next time
+            raise
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(MODEL_CACHE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except sql.Error:
+                log.exception("Saving Civitai model cache")
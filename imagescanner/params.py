@@ -0,0 +1,153 @@
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Tuple
+
+# A1111 parameters are a list of "key: value," where values may be quoted or be a {...} group containing commas.
+# A separator only counts if it's followed by an even number of quotes until the end of the string, which is what
+# the old lookahead regexes checked by rescanning the rest of the string at every position. Here the quote positions
+# are found once, and each search resumes where the last one left off, so a whole string is parsed in linear time.
+
+
+class QuoteParity:
+    def __init__(self, text: str):
+        self.quotes: List[int] = []
+        i = text.find('"')
+        while i != -1:
+            self.quotes.append(i)
+            i = text.find('"', i + 1)
+        self.length = len(text)
+
+    def outside(self, i: int) -> bool:
+        return (len(self.quotes) - bisect_left(self.quotes, i)) % 2 == 0
+
+    def next_quote(self, i: int) -> int:
+        k = bisect_right(self.quotes, i)
+        return self.quotes[k] if k < len(self.quotes) else self.length
+
+
+class SeparatorFinder:
+    """Finds the next occurrence of a character outside of quotes, or the end of the string."""
+
+    def __init__(self, text: str, char: str, parity: Optional[QuoteParity] = None):
+        self.text = text
+        self.char = char
+        self.parity = parity
+        self.last_start = self.last_result = -1
+
+    def find(self, start: int) -> int:
+        if self.last_start <= start <= self.last_result:  # nothing was found in between last time
+            return self.last_result
+        i = self.text.find(self.char, start)
+        while i != -1 and self.parity and not self.parity.outside(i):
+            i = self.text.find(self.char, self.parity.next_quote(i))
+        result = i if i != -1 else len(self.text)
+        self.last_start, self.last_result = start, result
+        return result
+
+
+def strip_param_groups(params: str) -> str:
+    """Removes every ", key: {...}" group, as they are too long to display."""
+    parity = QuoteParity(params)
+    braces = SeparatorFinder(params, "}", parity)
+    newlines = SeparatorFinder(params, "\n")
+    output = []
+    copied = search = 0
+    while (start := params.find(", ", search)) != -1:
+        colon = params.find(":", start + 2)
+        if colon == -1:
+            break
+        search = colon + 1
+        if colon == start + 2 or not params.startswith(": {", colon):
+            continue
+        end = braces.find(colon + 4)
+        if end >= len(params) or newlines.find(colon + 3) < end:
+            continue
+        output.append(params[copied:start])
+        copied = search = end + 1
+    output.append(params[copied:])
+    return "".join(output)
+
+
+def split_params(params: str) -> List[Tuple[str, str]]:
+    """Splits "key: value," pairs, where a value ends at the first comma outside of quotes in the same line."""
+    parity = QuoteParity(params)
+    commas = SeparatorFinder(params, ",", parity)
+    newlines = SeparatorFinder(params, "\n")
+    output = []
+    pos = 0
+    while (colon := params.find(":", pos)) != -1:
+        key_start = pos + 1 if params.startswith(" ", pos) and colon > pos + 1 else pos
+        pos = colon + 1
+        if colon == key_start or not params.startswith(" ", colon + 1):
+            continue
+        end = commas.find(colon + 3)
+        if end >= len(params) or newlines.find(colon + 2) < end:
+            continue
+        output.append((params[key_start:colon], params[colon+2:end]))
+        pos = end + 1
+    return output
+
+
+def find_hashes(params: str) -> Optional[str]:
+    """Returns the JSON of the first ", Hashes: {...}" group."""
+    parity = QuoteParity(params)
+    braces = SeparatorFinder(params, "}", parity)
+    newlines = SeparatorFinder(params, "\n")
+    search = 0
+    while (start := params.find(", Hashes: {", search)) != -1:
+        search = start + 1
+        group = start + 10
+        end = braces.find(group + 2)
+        if end < len(params) and newlines.find(group + 1) > end:
+            return params[group:end+1]
+    return None
+
+
+if __name__ == "__main__":  # python -m imagescanner.params [files with parameters] to compare against the old regexes
+    import re
+    import sys
+    import random
+    import timeit
+
+    LOOKAHEAD_PATTERN = rf'(?=(?:[^"]*"[^"]*")*[^"]*$)'
+    PARAM_REGEX = re.compile(rf" ?([^:]+): (.+?),{LOOKAHEAD_PATTERN}")
+    PARAM_GROUP_REGEX = re.compile(rf", [^:]+: {{.+?{LOOKAHEAD_PATTERN}}}")
+    HASHES_GROUP_REGEX = re.compile(rf", Hashes: ({{.+?{LOOKAHEAD_PATTERN}}})")
+
+    def parse_with_regex(text: str):
+        stripped = PARAM_GROUP_REGEX.sub("", text)
+        m = HASHES_GROUP_REGEX.search(text)
+        return stripped, PARAM_REGEX.findall(stripped), m.group(1) if m else None
+
+    def parse(text: str):
+        stripped = strip_param_groups(text)
+        return stripped, split_params(stripped), find_hashes(text)
+
+    tokens = [" ", ": ", ":", ", ", ",", '"', "{", "}", "\n", "a", "Steps", ", Hashes: {", ": {", "\"x, y\""]
+    rng = random.Random(0)
+    for n in range(100000):
+        sample = "".join(rng.choice(tokens) for _ in range(rng.randint(0, 40)))
+        if parse(sample) != parse_with_regex(sample):
+            print(f"Mismatch on {sample!r}:\n{parse(sample)}\n{parse_with_regex(sample)}")
+            sys.exit(1)
+    print("Fuzzing found no differences")
+
+    adetailer = ", ".join(f'ADetailer prompt {i}: "masterpiece, best quality, {i}", ADetailer model {i}: face_yolov8n.pt'
+                          for i in range(200))
+    regional = ", ".join(f"RP Prompt {i}: {{\"region\": \"{i}, {i}\", \"ratio\": 0.{i}}}" for i in range(200))
+    hashes = ", ".join(f'"lora{i}": "{i:010x}"' for i in range(20))
+    corpus = {
+        "typical": "Steps: 28, Sampler: DPM++ 2M Karras, CFG scale: 7, Seed: 1, Size: 512x768, Model hash: abcdef1234, "
+                   f"Model: model, Hashes: {{{hashes}}}, Version: v1.6.0,",
+        "adetailer": f"Steps: 28, Sampler: Euler a, {adetailer}, Version: v1.6.0,",
+        "regional": f"Steps: 28, Sampler: Euler a, {regional}, Version: v1.6.0,",
+    }
+    for path in sys.argv[1:]:
+        with open(path, encoding="utf8") as f:
+            corpus[path] = "Steps: " + f.read().rsplit("Steps: ", 1)[-1] + ","
+    for name, text in corpus.items():
+        runs = 20
+        ours = timeit.timeit(lambda: parse(text), number=runs) / runs
+        theirs = timeit.timeit(lambda: parse_with_regex(text), number=runs) / runs
+        same = parse(text) == parse_with_regex(text)
+        print(f"{name} ({len(text):,} chars): {ours * 1e3:.2f} ms vs regex {theirs * 1e3:.2f} ms "
+              f"({theirs / ours:.1f}x), same result: {same}")
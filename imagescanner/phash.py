@@ -0,0 +1,69 @@
+import io
+from PIL import Image
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+HASH_SIZE = 8
+
+
+def dhash(data: bytes) -> int:
+    """
+    Difference hash of an image: whether each pixel is brighter than the next one, in a 9x8 grayscale version.
+    Small edits, recompression and resizing barely change it. Meant to be run in a thread.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))  # lets JPEG decode at a fraction of the size
+        pixels = list(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).getdata())
+    result = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            result = result << 1 | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return result
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree(Generic[T]):
+    """Finds hashes within a Hamming distance of another, visiting only branches that could contain them."""
+
+    def __init__(self):
+        self.root: Optional[Tuple[int, List[T], Dict[int, tuple]]] = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, value: int, item: T):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = (value, [item], {})
+                return
+            node = node[2][distance]
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, T]]:
+        """Returns every item within the distance, closest first."""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
@@ -0,0 +1,72 @@
+import asyncio
+import discord
+from collections import Counter
+from typing import Awaitable, Callable, List, Tuple
+
+from imagescanner.constants import log
+
+ScanJob = Tuple[discord.Message, List[discord.Attachment]]
+
+
+class ScanQueue:
+    """
+    Scans new messages in the background with a fixed number of workers, so that bursts of images don't
+    turn into dozens of simultaneous downloads. Once the queue is full, or a channel has too many messages
+    waiting, new messages are skipped; they will still be scanned on demand if someone reacts to them.
+    """
+
+    def __init__(self, scan: Callable[[discord.Message, List[discord.Attachment]], Awaitable[None]],
+                 max_size: int, workers: int, channel_limit: int):
+        self.scan = scan
+        self.queue: asyncio.Queue[ScanJob] = asyncio.Queue(max_size)
+        self.worker_count = workers
+        self.channel_limit = channel_limit
+        self.channel_pending: Counter[int] = Counter()
+        self.workers: List[asyncio.Task] = []
+        self.queued = 0
+        self.scanned = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    def stop(self):
+        for task in self.workers:
+            task.cancel()
+        self.workers = []
+
+    def submit(self, message: discord.Message, attachments: List[discord.Attachment]) -> bool:
+        if self.channel_pending[message.channel.id] >= self.channel_limit:
+            self.skipped += 1
+            return False
+        try:
+            self.queue.put_nowait((message, attachments))
+        except asyncio.QueueFull:
+            self.skipped += 1
+            return False
+        self.channel_pending[message.channel.id] += 1
+        self.queued += 1
+        return True
+
+    async def worker(self):
+        while True:
+            message, attachments = await self.queue.get()
+            try:
+                await self.scan(message, attachments)
+                self.scanned += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # noqa, reason: a worker must survive any single message
+                self.failed += 1
+                log.exception("Scanning message")
+            finally:
+                self.channel_pending[message.channel.id] -= 1
+                if self.channel_pending[message.channel.id] <= 0:
+                    del self.channel_pending[message.channel.id]
+                self.queue.task_done()
+
+    def stats(self) -> str:
+        return f"{self.queued:,} messages queued, {self.scanned:,} scanned, {self.skipped:,} skipped and " \
+               f"{self.failed:,} failed. {self.queue.qsize()}/{self.queue.maxsize} waiting, " \
+               f"from {len(self.channel_pending)} channels."
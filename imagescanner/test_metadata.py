@@ -0,0 +1,127 @@
+import io
+import zlib
+from PIL import Image, PngImagePlugin
+
+from imagescanner.metadata import PngParser, JpegParser, WebpParser, EXIF_IFD_POINTER, EXIF_USER_COMMENT, \
+    decode_user_comment, get_parser, parse_metadata
+
+PARAMETERS = "1girl, smile\nNegative prompt: lowres\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1, Size: 64x64"
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return len(data).to_bytes(4, "big") + chunk_type + data + zlib.crc32(chunk_type + data).to_bytes(4, "big")
+
+
+def make_png(**text) -> bytes:
+    info = PngImagePlugin.PngInfo()
+    for key, value in text.items():
+        info.add_text(key, value)
+    fp = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(fp, "PNG", pnginfo=info)
+    return fp.getvalue()
+
+
+def make_exif(comment: bytes) -> Image.Exif:
+    exif = Image.Exif()
+    exif[EXIF_IFD_POINTER] = {EXIF_USER_COMMENT: comment}
+    return exif
+
+
+def make_image(image_format: str, **options) -> bytes:
+    fp = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(fp, image_format, **options)
+    return fp.getvalue()
+
+
+def feed_in_pieces(parser, data: bytes, size: int) -> dict:
+    """Feeds the parser the way a ranged download would, a few bytes at a time from wherever it asks."""
+    window = size
+    while not parser.done and parser.offset < len(data):
+        start = parser.offset
+        consumed = parser.feed(memoryview(data)[start:start + window])
+        if consumed:
+            window = size
+        elif start + window >= len(data):
+            break
+        else:
+            window += size
+    return parser.info
+
+
+def test_png_text_chunks():
+    data = make_png(parameters=PARAMETERS)
+    assert parse_metadata(data)["parameters"] == PARAMETERS
+    unicode = "1girl, 笑顔"
+    assert parse_metadata(make_png(parameters=unicode))["parameters"] == unicode
+
+
+def test_png_compressed_chunk():
+    data = make_png()
+    chunk = png_chunk(b"zTXt", b"parameters\0\0" + zlib.compress(PARAMETERS.encode("latin-1")))
+    data = data[:33] + chunk + data[33:]  # after the signature and IHDR
+    assert parse_metadata(data)["parameters"] == PARAMETERS
+
+
+def test_png_in_pieces():
+    data = make_png(Software="test", parameters=PARAMETERS)
+    for size in (1, 7, 64, len(data)):
+        assert feed_in_pieces(PngParser(), data, size)["parameters"] == PARAMETERS
+
+
+def test_png_stops_at_image_data():
+    data = make_png()
+    parser = PngParser()
+    feed_in_pieces(parser, data, 16)
+    assert parser.done
+    assert parser.info == {}
+    assert parser.offset < len(data)
+
+
+def test_png_skips_big_chunks_without_reading_them():
+    parser = PngParser()
+    data = make_png()
+    big_chunk = (100_000).to_bytes(4, "big") + b"eXIf"
+    consumed = parser.feed(memoryview(data[:33] + big_chunk))
+    assert consumed == 33 + 12 + 100_000
+
+
+def test_jpeg_exif_user_comment():
+    for comment in (b"UNICODE\0" + PARAMETERS.encode("utf-16-be"),
+                    b"UNICODE\0" + PARAMETERS.encode("utf-16-le"),
+                    b"ASCII\0\0\0" + PARAMETERS.encode()):
+        data = make_image("JPEG", exif=make_exif(comment))
+        assert parse_metadata(data)["parameters"] == PARAMETERS
+        assert feed_in_pieces(JpegParser(), data, 10)["parameters"] == PARAMETERS
+
+
+def test_jpeg_without_metadata():
+    parser = JpegParser()
+    assert feed_in_pieces(parser, make_image("JPEG"), 10) == {}
+    assert parser.done
+
+
+def test_webp_exif_user_comment():
+    data = make_image("WEBP", exif=make_exif(b"UNICODE\0" + PARAMETERS.encode("utf-16-be")))
+    assert parse_metadata(data)["parameters"] == PARAMETERS
+    assert feed_in_pieces(WebpParser(), data, 10)["parameters"] == PARAMETERS
+
+
+def test_webp_without_metadata():
+    parser = WebpParser()
+    assert feed_in_pieces(parser, make_image("WEBP"), 10) == {}
+    assert parser.done
+
+
+def test_decode_user_comment():
+    assert decode_user_comment(b"UNICODE\0" + "abc".encode("utf-16-le")) == "abc"
+    assert decode_user_comment(b"UNICODE\0" + "abc".encode("utf-16-be")) == "abc"
+    assert decode_user_comment(b"ASCII\0\0\0abc\0") == "abc"
+
+
+def test_wrong_format():
+    assert parse_metadata(b"not an image") == {}
+    parser = get_parser("image.PNG")
+    assert isinstance(parser, PngParser)
+    parser.feed(memoryview(make_image("JPEG")))
+    assert parser.done and parser.info == {}
+    assert get_parser("image.gif") is None
@@ -0,0 +1,72 @@
+import io
+import random
+from PIL import Image, ImageDraw, ImageFilter
+
+from imagescanner.phash import BKTree, dhash, hamming
+
+
+def make_image(seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (512, 384), "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(512), rng.randrange(384)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x, y, x + rng.randint(50, 200), y + rng.randint(50, 200)), fill=color)
+    return img
+
+
+def encode(img: Image.Image, image_format: str = "PNG", **options) -> bytes:
+    fp = io.BytesIO()
+    img.save(fp, image_format, **options)
+    return fp.getvalue()
+
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(2**64 - 1, 0) == 64
+
+
+def test_dhash_is_stable_across_edits():
+    img = make_image(1)
+    original = dhash(encode(img))
+    assert original < 2**64
+    assert dhash(encode(img)) == original
+    assert hamming(dhash(encode(img, "JPEG", quality=40)), original) <= 4
+    assert hamming(dhash(encode(img.resize((256, 192)))), original) <= 4
+    assert hamming(dhash(encode(img.filter(ImageFilter.GaussianBlur(1)))), original) <= 4
+
+
+def test_dhash_tells_images_apart():
+    hashes = [dhash(encode(make_image(seed))) for seed in range(10)]
+    for i, a in enumerate(hashes):
+        for b in hashes[i + 1:]:
+            assert hamming(a, b) > 10
+
+
+def test_bktree_matches_linear_search():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    values += [value ^ 1 << rng.randrange(64) for value in values[:100]]  # near-duplicates
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, i)
+    assert len(tree) == len(values)
+    for query in values[:50] + [rng.getrandbits(64) for _ in range(50)]:
+        for max_distance in (0, 4, 12):
+            expected = sorted((hamming(query, value), i) for i, value in enumerate(values)
+                              if hamming(query, value) <= max_distance)
+            results = tree.search(query, max_distance)
+            assert sorted(results) == expected
+            assert [distance for distance, _ in results] == sorted(distance for distance, _ in results)
+
+
+def test_bktree_duplicates():
+    tree = BKTree()
+    tree.add(0b1010, "a")
+    tree.add(0b1010, "b")
+    tree.add(0b1011, "c")
+    assert tree.search(0b1010, 0) == [(0, "a"), (0, "b")]
+    assert tree.search(0b1010, 1)[-1] == (1, "c")
+    assert BKTree().search(0, 64) == []
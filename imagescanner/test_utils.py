@@ -0,0 +1,82 @@
+import io
+import os
+import asyncio
+from PIL import Image
+
+from imagescanner.metadata import EXIF_IFD_POINTER, EXIF_USER_COMMENT, get_parser
+from imagescanner.utils import read_ranged_metadata
+
+PARAMETERS = "1girl, smile\nNegative prompt: lowres\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1, Size: 512x512"
+
+
+class FakeResponse:
+    def __init__(self, status: int, data: bytes):
+        self.status = status
+        self.data = data
+        self.content = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self) -> bytes:
+        return self.data
+
+    async def iter_chunked(self, size: int):
+        for i in range(0, len(self.data), size):
+            yield self.data[i:i + size]
+
+
+class FakeSession:
+    """Serves a file from memory, counting how many bytes were sent."""
+
+    def __init__(self, data: bytes, ranges: bool = True):
+        self.data = data
+        self.ranges = ranges
+        self.sent = 0
+
+    def get(self, _, headers=None) -> FakeResponse:
+        if not self.ranges:
+            self.sent += len(self.data)
+            return FakeResponse(200, self.data)
+        start, end = map(int, headers["Range"].removeprefix("bytes=").split("-"))
+        if start >= len(self.data):
+            return FakeResponse(416, b"")
+        self.sent += len(self.data[start:end + 1])
+        return FakeResponse(206, self.data[start:end + 1])
+
+
+def make_webp() -> bytes:
+    """A big WebP with its metadata at the end, after the image data."""
+    exif = Image.Exif()
+    exif[EXIF_IFD_POINTER] = {EXIF_USER_COMMENT: b"UNICODE\0" + PARAMETERS.encode("utf-16-be")}
+    fp = io.BytesIO()
+    Image.frombytes("RGB", (512, 512), os.urandom(512 * 512 * 3)).save(fp, "WEBP", lossless=True, exif=exif)
+    return fp.getvalue()
+
+
+def test_ranged_read_skips_image_data():
+    data = make_webp()
+    session = FakeSession(data)
+    info = asyncio.run(read_ranged_metadata(session, "", get_parser("image.webp")))  # noqa
+    assert info["parameters"] == PARAMETERS
+    assert session.sent < len(data) // 4
+
+
+def test_ranged_read_without_range_support():
+    data = make_webp()
+    session = FakeSession(data, ranges=False)
+    info = asyncio.run(read_ranged_metadata(session, "", get_parser("image.webp")))  # noqa
+    assert info["parameters"] == PARAMETERS
+
+
+def test_ranged_read_without_metadata():
+    fp = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(fp, "PNG")
+    info = asyncio.run(read_ranged_metadata(FakeSession(fp.getvalue()), "", get_parser("image.png")))  # noqa
+    assert info == {}
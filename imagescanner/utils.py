@@ -1,12 +1,17 @@
-import io
 import json
+import yarl
+import asyncio
+import aiohttp
 import discord
-from PIL import Image
 from collections import OrderedDict
+from typing import Dict, Optional
 
-from imagescanner.constants import log, NAIV3_PARAMS, PARAM_REGEX, PARAM_GROUP_REGEX, PARAMS_BLACKLIST
+from imagescanner.metadata import MetadataParser, get_parser, feed_parser, THREAD_THRESHOLD
+from imagescanner.params import strip_param_groups, split_params
+from imagescanner.phash import dhash
+from imagescanner.constants import log, NAIV3_PARAMS, PARAMS_BLACKLIST, RANGE_CHUNK_SIZE, THUMBNAIL_SIZE
 
-def get_params_from_string(param_str: str) -> OrderedDict:
+def get_params_from_string(param_str: str, max_length: Optional[int] = 1000) -> OrderedDict:
     output_dict = OrderedDict()
     if "NovelAI3 Parameters: " in param_str:
         prompts, params = param_str.rsplit("NovelAI3 Parameters: ", 1)
@@ -22,15 +27,15 @@ def get_params_from_string(param_str: str) -> OrderedDict:
         except:
             output_dict["Prompt"] = prompts
         params = f"Steps: {params},"
-        params = PARAM_GROUP_REGEX.sub("", params)
-        param_list = PARAM_REGEX.findall(params)
+        params = strip_param_groups(params)
+        param_list = split_params(params)
         for key, value in param_list:
             if len(output_dict) > 24 or any(blacklisted in key for blacklisted in PARAMS_BLACKLIST):
                 continue
             output_dict[key] = value
     for key in output_dict:
-        if len(output_dict[key]) > 1000:
-            output_dict[key] = output_dict[key][:1000] + "..."
+        if max_length and len(output_dict[key]) > max_length:
+            output_dict[key] = output_dict[key][:max_length] + "..."
     return output_dict
 
 def get_embed(embed_dict: dict, author: discord.Member) -> discord.Embed:
@@ -46,25 +51,89 @@ def convert_novelai_info(img_info: dict) -> str:
     negative_prompt = "Negative prompt: " + info.pop('uc')
     return f"{prompt}\n{negative_prompt}\nNovelAI3 Parameters: {json.dumps(info)}"
 
-async def read_attachment_metadata(i: int, attachment: discord.Attachment, metadata: dict, image_bytes: dict):
+async def stream_metadata(resp: aiohttp.ClientResponse, parser: MetadataParser):
+    """Reads a full response, only keeping the bytes the parser hasn't consumed or skipped, and stops when it's done."""
+    buffer = bytearray()
+    received = 0
+    async for chunk in resp.content.iter_chunked(RANGE_CHUNK_SIZE):
+        skip = max(0, parser.offset - received)
+        received += len(chunk)
+        if skip >= len(chunk):
+            continue
+        buffer += chunk[skip:]
+        with memoryview(buffer) as view:
+            consumed = feed_parser(parser, view)
+        del buffer[:consumed]
+        if parser.done:
+            return
+
+async def read_ranged_metadata(session: aiohttp.ClientSession, url: str, parser: MetadataParser) -> Dict[str, str]:
+    """Downloads only the parts of an image that can contain metadata, using range requests."""
+    buffer = bytearray()  # always starts at parser.offset
+    window = RANGE_CHUNK_SIZE
+    while not parser.done:
+        start = parser.offset + len(buffer)
+        headers = {"Range": f"bytes={start}-{start + window - 1}"}
+        async with session.get(url, headers=headers) as resp:
+            if resp.status == 416:  # range starts past the end of the file
+                break
+            resp.raise_for_status()
+            if resp.status != 206:  # ranges not supported
+                await stream_metadata(resp, parser)
+                break
+            data = await resp.read()
+        end_of_file = len(data) < window
+        buffer += data
+        with memoryview(buffer) as view:
+            if len(buffer) > THREAD_THRESHOLD:
+                consumed = await asyncio.to_thread(feed_parser, parser, view)
+            else:
+                consumed = feed_parser(parser, view)
+        if consumed >= len(buffer):  # skipped ahead
+            buffer.clear()
+            window = RANGE_CHUNK_SIZE
+        else:  # needs a bigger piece
+            del buffer[:consumed]
+            window *= 2
+        if end_of_file:
+            break
+    return parser.info
+
+def get_metadata_from_info(info: Dict[str, str]) -> Optional[str]:
+    params = info.get("parameters")
+    if isinstance(params, str) and "Steps" in params:
+        return params
+    if info.get("Title") == "AI generated image" and "Comment" in info:  # novelai
+        return convert_novelai_info(info)
+    return None
+
+async def read_attachment_metadata(session: aiohttp.ClientSession, i: int, attachment: discord.Attachment, metadata: dict):
+    parser = get_parser(attachment.filename)
+    if not parser:
+        return
     try:
-        image_data = await attachment.read()
-        with Image.open(io.BytesIO(image_data)) as img:
-            try:
-                if attachment.filename.endswith(".png"):
-                    info = img.info['parameters']
-                else:  # jpeg jank
-                    info = img._getexif().get(37510).decode('utf8')[7:]
-                if info and "Steps" in info:
-                    metadata[i] = info
-                    image_bytes[i] = image_data
-            except:  # novelai
-                if "Title" in img.info and img.info["Title"] == "AI generated image":
-                    metadata[i] = convert_novelai_info(img.info)
-                    image_bytes[i] = image_data
+        info = await read_ranged_metadata(session, attachment.url, parser)
+        if params := get_metadata_from_info(info):
+            metadata[i] = params
     except:
         log.exception("Downloading attachment")
 
+async def read_attachment_hash(session: aiohttp.ClientSession, attachment: discord.Attachment) -> Optional[int]:
+    """Perceptual hash of an attachment, from a thumbnail resized by Discord's media proxy."""
+    if not attachment.width or not attachment.height:
+        return None
+    scale = THUMBNAIL_SIZE / max(attachment.width, attachment.height)
+    url = yarl.URL(attachment.proxy_url, encoded=True).update_query(width=max(1, round(attachment.width * scale)),
+                                                                    height=max(1, round(attachment.height * scale)))
+    try:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            thumbnail = await resp.read()
+        return await asyncio.to_thread(dhash, thumbnail)
+    except Exception:  # noqa, reason: not worth interrupting the scan
+        log.warning(f"Hashing attachment {attachment.id}", exc_info=True)
+        return None
+
 def remove_field(embed: discord.Embed, field_name: str):
     for i, field in enumerate(embed.fields):
         if field.name == field_name:
@@ -0,0 +1,69 @@
+import enum
+import random
+import time
+
+from novelai.constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN, RETRY_BACKOFF_BASE, RETRY_BACKOFF_CAP
+
+
+def backoff(retry: int) -> float:
+    """Exponential backoff with jitter, so that requests don't retry in lockstep."""
+    delay = min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** retry)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitState(enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Shared between all queued requests. After repeated outage errors it opens and requests fail immediately.
+    Once the cooldown passes a single canary request is let through, which closes the circuit if it succeeds
+    or reopens it with a longer cooldown if it fails.
+    """
+
+    def __init__(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitState.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == CircuitState.OPEN and self.retry_after() <= 0 \
+                or self.state == CircuitState.HALF_OPEN and now - self.probe_started > self.cooldown:  # canary never reported back
+            self.state = CircuitState.HALF_OPEN
+            self.probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.cooldown = CIRCUIT_COOLDOWN
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == CircuitState.HALF_OPEN:
+            self.cooldown = min(CIRCUIT_MAX_COOLDOWN, self.cooldown * 2)
+            self.open()
+        elif self.state == CircuitState.CLOSED and self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.open()
+
+    def open(self):
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
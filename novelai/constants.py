@@ -2,7 +2,19 @@ import re
 from redbot.core.app_commands import Choice
 from collections import OrderedDict
 
-VIEW_TIMEOUT = 5 * 60
+QUEUE_DELAY = 2
+METRICS_EXPORT_INTERVAL = 15
+LOAD_TEST_MESSAGE = "The bot is running a load test. Please try again in a few minutes."
+
+VIEW_STATE_TTL = 24 * 60 * 60
+VIEW_STATE_BLOB_KEYS = ("image", "reference_image_multiple", "mask")
+
+OUTAGE_STATUSES = (500, 520, 408, 522, 524)
+RETRY_BACKOFF_BASE = 2
+RETRY_BACKOFF_CAP = 30
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 30
+CIRCUIT_MAX_COOLDOWN = 10 * 60
 
 MAX_FREE_IMAGE_SIZE = 1024*1024
 MAX_UPLOADED_IMAGE_SIZE = 1920*1080
@@ -22,14 +34,21 @@ DEFAULT_FURRY_NEGATIVE_PROMPT = "{{worst quality}}, [displeasing], {unusual pupi
                                 "absolutely everyone, sequence, {compression artifacts}, hard translated, " \
                                 "{cropped}, {commissioner name}, unknown text, high contrast"
                                 
-NSFW_TERMS = re.compile(r"\b(nsfw|explicit|questionable|sensitive|suggestive|nude|naked|sex|cum"
-                        r"|topless|bottomless|no (panties|bra|clothes|underwear)"
-                        r"|anus|penis|pussy|nipples?|labia|vulva|cleft|clit(oris|oral)?"
-                        r"|anal|oral|vaginal?|[pn]aizuri|miss?ionary|cowgirl|hetero|fell?atio|cunn?ilingus"
-                        r"|futa(nari)?|undressing|gore|guro|ass juice|scat|poop(ing)?|pee(ing)?"
-                        r"|pant(y|ies)|(?<!sports )bra|underwear|lingerie)\b")
-
-TOS_TERMS = re.compile(r"\b(loli(con)?s?|shota(con)?s?|child(ren|s)?)\b")
+# language=RegExp
+NSFW_PATTERN = (r"nsfw|explicit|questionable|sensitive|suggestive|nude|naked|sex|cum"
+                r"|topless|bottomless|no (panties|bra|clothes|underwear)"
+                r"|anus|penis|pussy|nipples?|labia|vulva|cleft|clit(oris|oral)?"
+                r"|anal|oral|vaginal?|[pn]aizuri|miss?ionary|cowgirl|hetero|fell?atio|cunn?ilingus"
+                r"|futa(nari)?|undressing|gore|guro|ass juice|scat|poop(ing)?|pee(ing)?"
+                r"|pant(y|ies)|(?<!sports )bra|underwear|lingerie")
+
+# language=RegExp
+TOS_PATTERN = r"loli(con)?s?|shota(con)?s?|child(ren|s)?"
+
+POLICY_PATTERNS = {
+    "nsfw": NSFW_PATTERN,
+    "tos": TOS_PATTERN,
+}
 
 SAMPLER_TITLES = OrderedDict({
     "k_euler": "Euler",
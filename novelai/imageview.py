@@ -2,37 +2,50 @@ import re
 import discord
 from datetime import datetime, timedelta
 from discord.ui import View
-from novelai_api.ImagePreset import ImagePreset, ImageModel
-from typing import Optional
 
-from novelai.constants import VIEW_TIMEOUT
+from novelai.constants import LOAD_TEST_MESSAGE
 
+EXPIRED = "These buttons have expired."
+
+
+def detached(view: View) -> View:
+    """Stops a view before it's sent, so discord.py doesn't keep a copy of it for that message forever."""
+    view.stop()
+    return view
+
+
+# Both views are persistent: a single instance of each is registered with the bot on load and handles the buttons
+# of every message, looking up the generation parameters in the cog's view store by message ID.
 
 class ImageView(View):
-    def __init__(self, cog, prompt: str, preset: ImagePreset, seed: int, model: ImageModel):
-        super().__init__(timeout=VIEW_TIMEOUT)
+    def __init__(self, cog, recycle_disabled: bool = False):
+        super().__init__(timeout=None)
         self.cog = cog
-        self.prompt = prompt
-        self.preset = preset
-        self.seed = seed
-        self.model = model
-        self.deleted = False
-        self.message: Optional[discord.Message] = None
+        self.recycle.disabled = recycle_disabled
 
     async def message_edit_callback(self, ctx: discord.Interaction):
-        if not self.is_finished() and not self.deleted:
-            ctx.message.edit(view=self)
+        if ctx.message.id in self.cog.view_store:
+            await ctx.message.edit(view=detached(ImageView(self.cog)))
+
+    async def expire(self, ctx: discord.Interaction):
+        await ctx.response.send_message(EXPIRED, ephemeral=True)
+        await ctx.message.edit(view=None)
 
-    @discord.ui.button(emoji="🌱", style=discord.ButtonStyle.grey)
+    @discord.ui.button(emoji="🌱", style=discord.ButtonStyle.grey, custom_id="novelai:image:seed")
     async def seed(self, ctx: discord.Interaction, _: discord.Button):
-        embed = discord.Embed(title="Generation seed", description=f"{self.seed}", color=0x77B255)
+        state = await self.cog.view_store.get(ctx.message.id)
+        if not state:
+            return await self.expire(ctx)
+        embed = discord.Embed(title="Generation seed", description=f"{state.seed}", color=0x77B255)
         await ctx.response.send_message(embed=embed, ephemeral=True)
 
-    @discord.ui.button(emoji="♻", style=discord.ButtonStyle.grey)
-    async def recycle(self, ctx: discord.Interaction, btn: discord.Button):
+    @discord.ui.button(emoji="♻", style=discord.ButtonStyle.grey, custom_id="novelai:image:recycle")
+    async def recycle(self, ctx: discord.Interaction, _: discord.Button):
+        if self.cog.load_test_active:
+            return await ctx.response.send_message(LOAD_TEST_MESSAGE, ephemeral=True)
         if not ctx.guild and not await self.cog.config.dm_allowed():
             return await ctx.response.send_message("Direct message use is disabled.", ephemeral=True)
-    
+
         if ctx.user.id not in await self.cog.config.vip():
             cooldown = await self.cog.config.server_cooldown() if ctx.guild else await self.cog.config.dm_cooldown()
             if self.cog.generating.get(ctx.user.id, False):
@@ -45,16 +58,17 @@ class ImageView(View):
                     content += " (You can use it more frequently inside a server)"
                 return await ctx.response.send_message(content, ephemeral=True)
 
-        self.preset.seed = 0
-        btn.disabled = True
-        await ctx.message.edit(view=self)
-        btn.disabled = False  # re-enables it after the task calls back
+        state = await self.cog.view_store.get(ctx.message.id)
+        if not state:
+            return await self.expire(ctx)
+        state.preset.seed = 0
+        await ctx.message.edit(view=detached(ImageView(self.cog, recycle_disabled=True)))
 
         content = self.cog.get_loading_message()
-        self.cog.queue_add(ctx, self.prompt, self.preset, self.model, ctx.user.id, self.message_edit_callback(ctx))
+        self.cog.queue_add(ctx, state.prompt, state.preset, state.model, ctx.user.id, self.message_edit_callback(ctx))
         await ctx.response.send_message(content=content)
 
-    @discord.ui.button(emoji="🗑️", style=discord.ButtonStyle.grey)
+    @discord.ui.button(emoji="🗑️", style=discord.ButtonStyle.grey, custom_id="novelai:image:delete")
     async def delete(self, ctx: discord.Interaction, _: discord.Button):
         if ctx.message.interaction:
             original_user_id = ctx.message.interaction.user.id
@@ -63,8 +77,7 @@ class ImageView(View):
         else:
             original_user_id = 0
         if not ctx.guild or ctx.user.id == original_user_id or ctx.channel.permissions_for(ctx.user).manage_messages:
-            self.deleted = True
-            self.stop()
+            await self.cog.view_store.remove(ctx.message.id)
             imagelog = self.cog.bot.get_cog("ImageLog")
             if imagelog:
                 imagelog.manual_deleted_by[ctx.message.id] = ctx.user.id
@@ -72,38 +85,29 @@ class ImageView(View):
         else:
             await ctx.response.send_message("Only a moderator or the user who requested the image may delete it.", ephemeral=True)
 
-    async def on_timeout(self) -> None:
-        if self.message and not self.deleted:
-            await self.message.edit(view=None)
-
 
 class RetryView(View):
-    def __init__(self, cog, prompt: str, preset: ImagePreset, model: ImageModel):
-        super().__init__(timeout=VIEW_TIMEOUT)
+    def __init__(self, cog):
+        super().__init__(timeout=None)
         self.cog = cog
-        self.prompt = prompt
-        self.preset = preset
-        self.model = model
-        self.deleted = False
-        self.message: Optional[discord.Message] = None
 
-    @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.grey)
+    @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.grey, custom_id="novelai:retry:retry")
     async def retry(self, ctx: discord.Interaction, _: discord.Button):
+        if self.cog.load_test_active:
+            return await ctx.response.send_message(LOAD_TEST_MESSAGE, ephemeral=True)
         if not ctx.guild and not await self.cog.config.dm_allowed():
             return await ctx.response.send_message("Direct message use is disabled.", ephemeral=True)
-    
+
         if not await self.cog.bot.is_owner(ctx.user):
             if self.cog.generating.get(ctx.user.id, False):
                 content = "Your current image must finish generating before you can request another one."
                 return await ctx.response.send_message(content, ephemeral=True)
 
-        self.deleted = True
-        self.stop()
+        state = await self.cog.view_store.get(ctx.message.id)
         await ctx.message.edit(view=None)
+        if not state:
+            return await ctx.response.send_message(EXPIRED, ephemeral=True)
+        await self.cog.view_store.remove(ctx.message.id)
         content = self.cog.get_loading_message()
-        self.cog.queue_add(ctx, self.prompt, self.preset, self.model, ctx.user.id, ctx.message.edit(view=None))
+        self.cog.queue_add(ctx, state.prompt, state.preset, state.model, ctx.user.id, ctx.message.edit(view=None))
         await ctx.response.send_message(content=content)
-
-    async def on_timeout(self) -> None:
-        if self.message and not self.deleted:
-            await self.message.edit(view=None)
@@ -0,0 +1,102 @@
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+from novelai_api.ImagePreset import ImageModel, ImagePreset, ImageSampler, UCPreset
+
+from novelai.naiapi import NaiAPI
+from novelai.metrics import Metrics
+from novelai.circuitbreaker import CircuitBreaker
+from novelai.viewstore import ViewStore
+from novelai.stubserver import StubServer
+from novelai.constants import DEFAULT_PROMPT, DEFAULT_NEGATIVE_PROMPT
+
+LOAD_TEST_USERS = 50
+LOAD_TEST_PROMPTS = ["1girl, solo, smile", "1boy, scenery, night sky", "cat, flowers, watercolor", "landscape, mountains, river"]
+
+
+class LoadTestMessage(SimpleNamespace):
+    async def add_reaction(self, _):
+        pass
+
+
+class LoadTestInteraction:
+    """The parts of discord.Interaction that the queue uses, so synthetic requests can go through queue_add."""
+    message_ids = 0
+
+    def __init__(self, user_id: int):
+        self.user = SimpleNamespace(id=user_id)
+        self.guild = None
+        self.channel = SimpleNamespace(id=0, nsfw=True)
+
+    async def edit_original_response(self, **_) -> LoadTestMessage:
+        LoadTestInteraction.message_ids += 1
+        return LoadTestMessage(id=LoadTestInteraction.message_ids)
+
+
+def make_preset(seed: int) -> ImagePreset:
+    preset = ImagePreset()
+    preset.n_samples = 1
+    preset.resolution = (832, 1216)
+    preset.uc = DEFAULT_NEGATIVE_PROMPT
+    preset.uc_preset = UCPreset.Preset_None
+    preset.quality_toggle = False
+    preset.sampler = ImageSampler.k_euler_ancestral
+    preset.scale = 5.0
+    preset.cfg_rescale = 0.0
+    preset.decrisper = False
+    preset.noise_schedule = "native"
+    preset.seed = seed
+    preset.uncond_scale = 1.0
+    return preset
+
+
+async def run_load_test(cog, requests: int, latency: float, error_rate: float, queue_delay: float) -> dict:
+    """
+    Temporarily points the cog at a local stub server and pushes synthetic requests through its real queue.
+    The API, view store, metrics, circuit breaker and queue delay of the cog are swapped out during the test and
+    restored afterwards. Other users can't queue requests in the meantime, and nothing is exported or cached.
+    """
+    server = StubServer(latency, error_rate)
+    address = await server.start()
+    view_store = ViewStore(cog.view_store.path.with_name("loadtest_views.db"))
+    await view_store.open()
+    original = cog.api, cog.view_store, cog.metrics, cog.circuit_breaker, cog.queue_delay
+    cog.api = NaiAPI("loadtest", "loadtest", address)
+    cog.view_store = view_store
+    cog.metrics = Metrics()
+    cog.circuit_breaker = CircuitBreaker()
+    cog.queue_delay = queue_delay
+    cog.load_test_active = True
+    start = time.perf_counter()
+    try:
+        for i in range(requests):
+            ctx = LoadTestInteraction(-(i % LOAD_TEST_USERS) - 1)
+            prompt = f"{random.choice(LOAD_TEST_PROMPTS)}, {DEFAULT_PROMPT}"
+            cog.queue_add(ctx, prompt, make_preset(random.randint(1, 2**32 - 1)), ImageModel.Anime_v3)
+        while cog.queue or cog.queue_task and not cog.queue_task.done():
+            await asyncio.sleep(1)
+    finally:
+        elapsed = time.perf_counter() - start
+        # requests left over after a cancel or error must not reach NovelAI once the real API is restored
+        for task, _, _ in cog.queue:
+            task.close()
+        cog.queue.clear()
+        if cog.queue_task and not cog.queue_task.done():
+            await asyncio.wait([cog.queue_task])
+        metrics = cog.metrics
+        cog.api, cog.view_store, cog.metrics, cog.circuit_breaker, cog.queue_delay = original
+        cog.load_test_active = False
+        for uid in range(-LOAD_TEST_USERS, 0):
+            cog.generating.pop(uid, None)
+            cog.user_last_img.pop(uid, None)
+        await view_store.close()
+        view_store.path.unlink(missing_ok=True)
+        await server.stop()
+    return {
+        "elapsed": elapsed,
+        "throughput": metrics.completed / elapsed * 60,
+        "metrics": metrics,
+        "server_requests": server.requests,
+        "server_errors": server.errors,
+    }
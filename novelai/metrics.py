@@ -0,0 +1,76 @@
+import time
+from collections import deque, Counter
+from typing import Optional
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """Keeps a rolling window of samples to calculate percentiles, plus lifetime totals."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> str:
+        if not self.samples:
+            return "No data"
+        return " / ".join(f"p{int(q * 100)} {self.percentile(q):.2f}s" for q in QUANTILES) + f" ({self.count:,} total)"
+
+
+class Metrics:
+    """Request metrics for the NovelAI queue, viewable with [p]novelaiset metrics"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.queue_wait = Histogram()
+        self.upstream_latency = Histogram()
+        self.post_processing = Histogram()
+        self.retries = 0
+        self.completed = 0
+        self.failed = 0
+        self.deleted = 0  # the interaction was deleted before the image could be sent
+        self.error_statuses: Counter[int] = Counter()
+        self.user_requests: Counter[int] = Counter()
+
+    def images_per_hour(self) -> float:
+        hours = max(time.time() - self.started, 1) / 3600
+        return self.completed / hours
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, histogram in (("queue_wait", self.queue_wait),
+                                ("upstream_latency", self.upstream_latency),
+                                ("post_processing", self.post_processing)):
+            metric = f"novelai_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                value = histogram.percentile(q)
+                lines.append(f'{metric}{{quantile="{q}"}} {value if value is not None else "NaN"}')
+            lines.append(f"{metric}_sum {histogram.total}")
+            lines.append(f"{metric}_count {histogram.count}")
+        for name, value in (("retries", self.retries), ("completed", self.completed),
+                            ("failed", self.failed), ("deleted", self.deleted)):
+            lines.append(f"# TYPE novelai_{name}_total counter")
+            lines.append(f"novelai_{name}_total {value}")
+        lines.append("# TYPE novelai_errors_total counter")
+        for status, count in sorted(self.error_statuses.items()):
+            lines.append(f'novelai_errors_total{{status="{status}"}} {count}')
+        # per-user counts stay in [p]novelaiset metrics, as a label per user would make a new series for each one
+        lines.append("# TYPE novelai_requests_total counter")
+        lines.append(f"novelai_requests_total {self.user_requests.total()}")
+        lines.append("# TYPE novelai_users gauge")
+        lines.append(f"novelai_users {len(self.user_requests)}")
+        return "\n".join(lines) + "\n"
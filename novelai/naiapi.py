@@ -27,7 +27,8 @@ class NaiAPI:
 
 
     A custom base address can be passed to the constructor to replace the default
-    (:attr:`BASE_ADDRESS <novelai_api.NovelAI_API.NovelAIAPI.BASE_ADDRESS>`)
+    (:attr:`BASE_ADDRESS <novelai_api.NovelAI_API.NovelAIAPI.BASE_ADDRESS>`),
+    as well as the image address that image endpoints use instead of it
     """
 
     _username: str
@@ -37,7 +38,7 @@ class NaiAPI:
     logger: Logger
     api: Optional[NovelAIAPI]
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, base_address: Optional[str] = None):
 
         self._username = username
         self._password = password
@@ -46,6 +47,12 @@ class NaiAPI:
         self.logger.addHandler(StreamHandler())
 
         self.api = NovelAIAPI(logger=self.logger)
+        if base_address:
+            self.api.BASE_ADDRESS = base_address
+            request = self.api.low_level.request
+            # image endpoints pass the hardcoded IMAGE_API_ADDRESS instead of using BASE_ADDRESS
+            self.api.low_level.request = lambda method, endpoint, data=None, _=None: \
+                request(method, endpoint, data, base_address)
 
     @property
     def encryption_key(self):
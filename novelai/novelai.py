@@ -1,6 +1,7 @@
 import io
 import re
 import json
+import time
 import base64
 import asyncio
 import discord
@@ -10,12 +11,18 @@ from hashlib import md5
 from datetime import datetime, timedelta
 from redbot.core import commands, app_commands, Config
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 from novelai_api import NovelAIError
 from novelai_api.ImagePreset import ImageModel, ImagePreset, ImageSampler, ImageGenerationType, UCPreset
 from typing import Optional, Tuple, Coroutine
 
 from novelai.naiapi import NaiAPI
-from novelai.imageview import ImageView, RetryView
+from novelai.imageview import ImageView, RetryView, detached
+from novelai.viewstore import ViewStore
+from novelai.metrics import Metrics
+from novelai.loadtest import run_load_test
+from novelai.policy import PromptPolicy
+from novelai.circuitbreaker import CircuitBreaker, CircuitOpenError, backoff
 from novelai.constants import *
 
 log = logging.getLogger("red.crab-cogs.novelai")
@@ -35,12 +42,24 @@ class NovelAI(commands.Cog):
         super().__init__()
         self.bot = bot
         self.api: Optional[NaiAPI] = None
-        self.queue: list[Tuple[Coroutine, discord.Interaction]] = []
+        self.queue: list[Tuple[Coroutine, discord.Interaction, float]] = []
         self.queue_task: Optional[asyncio.Task] = None
+        self.queue_delay = QUEUE_DELAY
+        self.load_test_task: Optional[asyncio.Task] = None
+        self.load_test_active = False
         self.generating: dict[int, bool] = {}
         self.user_last_img: dict[int, datetime] = {}
         self.last_generation_datetime: datetime = datetime.min
         self.loading_emoji = ""
+        self.metrics = Metrics()
+        self.circuit_breaker = CircuitBreaker()
+        self.policies: dict[int, PromptPolicy] = {}
+        self.view_store: Optional[ViewStore] = None
+        self.image_view: Optional[ImageView] = None
+        self.retry_view: Optional[RetryView] = None
+        self.metrics_export = False
+        self.metrics_dirty = False
+        self.metrics_export_task: Optional[asyncio.Task] = None
         self.config = Config.get_conf(self, identifier=66766566169)
         defaults_user = {
             "base_prompt": DEFAULT_PROMPT,
@@ -66,20 +85,42 @@ class NovelAI(commands.Cog):
             "dm_allowed": True,
             "loading_emoji": "",
             "vip": [],
+            "metrics_export": False,
         }
         defaults_guild = {
             "nsfw_filter": False,
+            "nsfw_terms": [],
+            "tos_terms": [],
         }
         self.config.register_user(**defaults_user)
         self.config.register_global(**defaults_global)
-        self.config.register_global(**defaults_guild)
+        self.config.register_guild(**defaults_guild)
 
     async def cog_load(self):
         await self.try_create_api()
         self.loading_emoji = await self.config.loading_emoji()
+        self.metrics_export = await self.config.metrics_export()
+        self.view_store = ViewStore(cog_data_path(self).joinpath("views.db"))
+        await self.view_store.open()
+        self.image_view = ImageView(self)
+        self.retry_view = RetryView(self)
+        self.bot.add_view(self.image_view)
+        self.bot.add_view(self.retry_view)
+        self.metrics_export_task = asyncio.create_task(self.metrics_export_loop())
+
+    async def cog_unload(self):
+        if self.metrics_export_task:
+            self.metrics_export_task.cancel()
+        if self.image_view:
+            self.image_view.stop()
+        if self.retry_view:
+            self.retry_view.stop()
+        if self.view_store:
+            await self.view_store.close()
 
     async def red_delete_data_for_user(self, requester: str, user_id: int):
-        pass
+        if self.view_store:
+            await self.view_store.remove_user(user_id)
 
     async def try_create_api(self):
         api = await self.bot.get_shared_api_tokens("novelai")
@@ -93,7 +134,7 @@ class NovelAI(commands.Cog):
     async def consume_queue(self):
         new = True
         while self.queue:
-            task, ctx = self.queue.pop(0)
+            task, ctx, queued_at = self.queue.pop(0)
             alive = True
             if not new:
                 try:
@@ -106,13 +147,14 @@ class NovelAI(commands.Cog):
             if self.queue:
                 asyncio.create_task(self.edit_queue_messages())
             if alive:
+                self.metrics.queue_wait.observe(time.perf_counter() - queued_at)
                 await task
-            await asyncio.sleep(2)
+            await asyncio.sleep(self.queue_delay)
             new = False
 
     async def edit_queue_messages(self):
         tasks = [ctx.edit_original_response(content=self.loading_emoji + f"`Position in queue: {i + 1}`")
-                 for i, (task, ctx) in enumerate(self.queue)]
+                 for i, (_, ctx, _) in enumerate(self.queue)]
         await asyncio.gather(*tasks, return_exceptions=True)
 
     def queue_add(self,
@@ -123,10 +165,21 @@ class NovelAI(commands.Cog):
                   requester: Optional[int] = None,
                   callback: Optional[Coroutine] = None):
         self.generating[ctx.user.id] = True
-        self.queue.append((self.fulfill_novelai_request(ctx, prompt, preset, model, requester, callback), ctx))
+        self.metrics.user_requests[ctx.user.id] += 1
+        self.queue.append((self.fulfill_novelai_request(ctx, prompt, preset, model, requester, callback), ctx, time.perf_counter()))
         if not self.queue_task or self.queue_task.done():
             self.queue_task = asyncio.create_task(self.consume_queue())
 
+    async def get_policy(self, guild: Optional[discord.Guild]) -> PromptPolicy:
+        guild_id = guild.id if guild else 0
+        if guild_id not in self.policies:
+            custom_terms = {}
+            if guild:
+                custom_terms["nsfw"] = await self.config.guild(guild).nsfw_terms()
+                custom_terms["tos"] = await self.config.guild(guild).tos_terms()
+            self.policies[guild_id] = PromptPolicy(custom_terms)
+        return self.policies[guild_id]
+
     def get_loading_message(self):
         message = f"`Position in queue: {len(self.queue) + 1}`" if self.queue_task and not self.queue_task.done() else "`Generating image...`"
         return self.loading_emoji + message
@@ -332,6 +385,9 @@ class NovelAI(commands.Cog):
                                       decrisper: Optional[bool],
                                       model: Optional[ImageModel],
                                       ) -> Optional[Tuple[str, ImagePreset]]:
+        if self.load_test_active:
+            return await ctx.response.send_message(LOAD_TEST_MESSAGE, ephemeral=True)
+
         if not self.api and not await self.try_create_api():
             return await ctx.response.send_message(
                 "NovelAI username and password not set. The bot owner needs to set them like this:\n"
@@ -366,16 +422,18 @@ class NovelAI(commands.Cog):
         
         resolution = resolution or await self.config.user(ctx.user).resolution()
 
-        if ctx.guild and not ctx.channel.nsfw and NSFW_TERMS.search(prompt):
+        categories = (await self.get_policy(ctx.guild)).evaluate(prompt)
+
+        if ctx.guild and not ctx.channel.nsfw and "nsfw" in categories:
             return await ctx.response.send_message(":warning: You may not generate NSFW images in non-NSFW channels.")
 
-        if not ctx.guild and TOS_TERMS.search(prompt):
+        if not ctx.guild and "tos" in categories:
             return await ctx.response.send_message(
                 ":warning: To abide by Discord terms of service, the prompt you chose may not be used in private.\n"
                 "You may use this command in a server, where your generations may be reviewed by a moderator."
             )
 
-        if NSFW_TERMS.search(prompt) and TOS_TERMS.search(prompt):
+        if "nsfw" in categories and "tos" in categories:
             return await ctx.response.send_message(
                 ":warning: To abide by Discord terms of service, the prompt you chose may not be used."
             )
@@ -428,30 +486,48 @@ class NovelAI(commands.Cog):
         try:
             try:
                 for retry in range(4):
+                    if not self.circuit_breaker.allow_request():
+                        raise CircuitOpenError(self.circuit_breaker.retry_after())
                     try:
                         async with self.api as wrapper:
                             action = ImageGenerationType.IMG2IMG if preset._settings.get("image", None) else ImageGenerationType.NORMAL
                             self.last_generation_datetime = datetime.now()
+                            start = time.perf_counter()
                             async for _, img in wrapper.api.high_level.generate_image(prompt, model, preset, action):
                                 image_bytes = img
+                            self.metrics.upstream_latency.observe(time.perf_counter() - start)
+                            self.circuit_breaker.record_success()
                             break
                     except NovelAIError as error:
-                        if error.status not in (500, 520, 408, 522, 524) or retry == 3:
+                        self.metrics.error_statuses[error.status] += 1
+                        if error.status in OUTAGE_STATUSES:
+                            self.circuit_breaker.record_failure()
+                        else:  # the service is up even if the request failed
+                            self.circuit_breaker.record_success()
+                        if error.status not in OUTAGE_STATUSES or retry == 3:
                             raise
                         log.warning("NovelAI encountered an error." if error.status in (500, 520) else "Timed out.")
+                        self.metrics.retries += 1
                         if retry == 1:
                             await ctx.edit_original_response(content=self.loading_emoji + "`Generating image...` :warning:")
-                        await asyncio.sleep(retry + 2)
+                        await asyncio.sleep(backoff(retry))
             except Exception as error:
-                view = RetryView(self, prompt, preset, model)
                 if isinstance(error, discord.errors.NotFound):
+                    self.metrics.deleted += 1
                     raise
-                if isinstance(error, NovelAIError):
+                self.metrics.failed += 1
+                view = detached(RetryView(self))
+                if isinstance(error, CircuitOpenError):
+                    eta = datetime.now() + timedelta(seconds=error.retry_after)
+                    content = "NovelAI seems to be experiencing an outage, so requests are paused. " \
+                              f"Please try again {discord.utils.format_dt(eta, 'R')}."
+                    log.warning(str(error))
+                elif isinstance(error, NovelAIError):
                     if error.status == 401:
                         return await ctx.edit_original_response(content=":warning: Failed to authenticate NovelAI account.")
                     elif error.status == 402:
                         return await ctx.edit_original_response(content=":warning: The subscription and/or credits have run out for this NovelAI account.")
-                    elif error.status in (500, 520, 408, 522, 524):
+                    elif error.status in OUTAGE_STATUSES:
                         content = "NovelAI seems to be experiencing an outage, and multiple retries have failed. " \
                                   "Please be patient and try again soon."
                         view = None
@@ -471,12 +547,13 @@ class NovelAI(commands.Cog):
                     log.error(f"Generating image: {type(error).__name__} - {error}")
                 msg = await ctx.edit_original_response(content=f":warning: {content}", view=view)
                 if view:
-                    view.message = msg
+                    await self.view_store.add(msg.id, prompt, preset, model, user_id=ctx.user.id)
                 return
             finally:
                 self.generating[ctx.user.id] = False
                 self.user_last_img[ctx.user.id] = datetime.now()
 
+            start = time.perf_counter()
             image = Image.open(io.BytesIO(image_bytes))
             comment = json.loads(image.info["Comment"])
             seed = comment["seed"]
@@ -492,28 +569,46 @@ class NovelAI(commands.Cog):
 
             name = md5(image_bytes).hexdigest() + ".png"
             file = discord.File(io.BytesIO(image_bytes), name)
-            view = ImageView(self, prompt, preset, seed, model)
+            self.metrics.post_processing.observe(time.perf_counter() - start)
+            self.metrics.completed += 1
+            view = detached(ImageView(self))
             content = f"{'Reroll' if callback else 'Retry'} requested by <@{requester}>" if requester and ctx.guild else None
             msg = await ctx.edit_original_response(content=content, attachments=[file], view=view, allowed_mentions=discord.AllowedMentions.none())
-            view.message = msg
+            await self.view_store.add(msg.id, prompt, preset, model, seed, ctx.user.id)
 
             imagescanner = self.bot.get_cog("ImageScanner")
-            if imagescanner:
+            if imagescanner and not self.load_test_active:
                 if imagescanner.always_scan_generated_images or ctx.channel.id in imagescanner.scan_channels:  # noqa
                     img_info = imagescanner.convert_novelai_info(image.info)  # noqa
-                    imagescanner.image_cache[msg.id] = ({1: img_info}, {1: image_bytes})  # noqa
+                    await imagescanner.image_cache.put(msg.id, {1: img_info}, {1: image_bytes})  # noqa
                     await msg.add_reaction("🔎")
         except discord.errors.NotFound:
             pass
         except:
             log.exception("Fulfilling request")
         finally:
+            if not self.load_test_active:
+                self.metrics_dirty = True
             if callback:
                 try:
                     await callback
                 except:
                     pass
 
+    async def export_metrics(self):
+        self.metrics_dirty = False
+        try:
+            await asyncio.to_thread(cog_data_path(self).joinpath("metrics.prom").write_text,
+                                    self.metrics.to_prometheus(), encoding="utf-8")
+        except:
+            log.exception("Exporting metrics")
+
+    async def metrics_export_loop(self):
+        while True:
+            await asyncio.sleep(METRICS_EXPORT_INTERVAL)
+            if self.metrics_export and self.metrics_dirty and not self.load_test_active:
+                await self.export_metrics()
+
     @app_commands.command(name="novelaidefaults",
                           description="Views or updates your personal default values for /novelai")
     @app_commands.describe(base_prompt="Gets added after each prompt. \"none\" to delete, \"default\" to reset.",
@@ -679,6 +774,84 @@ class NovelAI(commands.Cog):
         else:
             await ctx.reply("NSFW filter disabled. Images may more easily be NSFW by accident.")
 
+    @novelaiset.command(name="loadtest")
+    @commands.is_owner()
+    async def novelaiset_loadtest(self, ctx: commands.Context, requests: int = 100, latency: float = 1.0,
+                                  error_rate: float = 0.05, queue_delay: float = 0.0):
+        """Benchmarks the queue against a local fake NovelAI server, without spending credits.
+
+        Other users can't generate images while the test runs. Run again to cancel."""
+        if self.load_test_task and not self.load_test_task.done():
+            self.load_test_task.cancel()
+            return await ctx.reply("Load test cancelled.")
+        if self.queue or self.queue_task and not self.queue_task.done():
+            return await ctx.reply("The queue must be empty to start a load test.")
+        if not self.view_store:
+            return await ctx.reply("The cog hasn't finished loading.")
+        requests = max(1, min(100_000, requests))
+        error_rate = max(0.0, min(1.0, error_rate))
+        await ctx.reply(f"Starting load test with {requests} requests, {latency:.1f}s latency and {error_rate:.0%} errors.")
+        self.load_test_task = asyncio.create_task(run_load_test(self, requests, max(0.0, latency), error_rate, max(0.0, queue_delay)))
+        try:
+            result = await self.load_test_task
+        except asyncio.CancelledError:
+            return
+        metrics = result["metrics"]
+        embed = discord.Embed(title="NovelAI load test", color=await ctx.embed_color())
+        embed.add_field(name="Duration", value=f"{result['elapsed']:.1f}s")
+        embed.add_field(name="Throughput", value=f"{result['throughput']:.1f} images/minute")
+        embed.add_field(name="Completed", value=f"{metrics.completed:,} / {requests:,}")
+        embed.add_field(name="Server requests", value=f"{result['server_requests']:,} ({result['server_errors']:,} errors)")
+        embed.add_field(name="Retries", value=f"{metrics.retries:,}")
+        embed.add_field(name="Failed", value=f"{metrics.failed:,}")
+        embed.add_field(name="Queue wait", value=metrics.queue_wait.summary(), inline=False)
+        embed.add_field(name="Latency", value=metrics.upstream_latency.summary(), inline=False)
+        embed.add_field(name="Post-processing", value=metrics.post_processing.summary(), inline=False)
+        await ctx.send(embed=embed)
+
+    @novelaiset.group(name="terms", invoke_without_command=True)
+    @commands.guild_only()
+    @commands.admin()
+    async def novelaiset_terms(self, ctx: commands.Context):
+        """Manage extra terms that count as NSFW or against Discord TOS in this server's prompts."""
+        await ctx.send_help()
+
+    @novelaiset_terms.command(name="add")
+    async def novelaiset_terms_add(self, ctx: commands.Context, category: str, *, terms: str):
+        """Add a comma-separated list of terms to a category, either nsfw or tos."""
+        category = category.lower()
+        if category not in POLICY_PATTERNS:
+            return await ctx.reply(f"Category must be one of: {', '.join(POLICY_PATTERNS)}")
+        new_terms = [term.strip().lower() for term in terms.split(",") if term.strip()]
+        if not new_terms:
+            return await ctx.reply("Please enter one or more terms separated by commas.")
+        async with self.config.guild(ctx.guild).get_attr(f"{category}_terms")() as current_terms:
+            current_terms.extend(term for term in new_terms if term not in current_terms)
+        self.policies.pop(ctx.guild.id, None)
+        await ctx.react_quietly("✅")
+
+    @novelaiset_terms.command(name="remove")
+    async def novelaiset_terms_remove(self, ctx: commands.Context, category: str, *, terms: str):
+        """Remove a comma-separated list of terms from a category, either nsfw or tos."""
+        category = category.lower()
+        if category not in POLICY_PATTERNS:
+            return await ctx.reply(f"Category must be one of: {', '.join(POLICY_PATTERNS)}")
+        removed_terms = [term.strip().lower() for term in terms.split(",")]
+        async with self.config.guild(ctx.guild).get_attr(f"{category}_terms")() as current_terms:
+            current_terms[:] = [term for term in current_terms if term not in removed_terms]
+        self.policies.pop(ctx.guild.id, None)
+        await ctx.react_quietly("✅")
+
+    @novelaiset_terms.command(name="list")
+    async def novelaiset_terms_list(self, ctx: commands.Context):
+        """Show the extra terms configured for this server."""
+        embed = discord.Embed(title="Extra prompt terms", color=await ctx.embed_color())
+        for category in POLICY_PATTERNS:
+            terms = await self.config.guild(ctx.guild).get_attr(f"{category}_terms")()
+            value = ", ".join(terms) or "*None*"
+            embed.add_field(name=category.upper(), value=value[:1000] + "..." if len(value) > 1000 else value, inline=False)
+        await ctx.reply(embed=embed)
+
     @novelaiset.command()
     @commands.is_owner()
     async def loadingemoji(self, ctx: commands.Context, emoji: Optional[discord.Emoji]):
@@ -697,6 +870,37 @@ class NovelAI(commands.Cog):
             await self.config.loading_emoji.set(self.loading_emoji)
             await ctx.reply(f"{emoji} will now appear when showing position in queue.")
 
+    @novelaiset.command(name="metrics")
+    @commands.is_owner()
+    async def novelaiset_metrics(self, ctx: commands.Context):
+        """Shows timings and error statistics for image generation since the cog was loaded."""
+        embed = discord.Embed(title="NovelAI metrics", color=await ctx.embed_color())
+        embed.add_field(name="Queue wait", value=self.metrics.queue_wait.summary(), inline=False)
+        embed.add_field(name="NovelAI latency", value=self.metrics.upstream_latency.summary(), inline=False)
+        embed.add_field(name="Post-processing", value=self.metrics.post_processing.summary(), inline=False)
+        embed.add_field(name="Completed", value=f"{self.metrics.completed:,} ({self.metrics.images_per_hour():.1f}/hour)")
+        embed.add_field(name="Failed", value=f"{self.metrics.failed:,}")
+        embed.add_field(name="Deleted", value=f"{self.metrics.deleted:,}")
+        embed.add_field(name="Retries", value=f"{self.metrics.retries:,}")
+        embed.add_field(name="Circuit breaker", value=self.circuit_breaker.state.value)
+        errors = ", ".join(f"{status}: {count}" for status, count in sorted(self.metrics.error_statuses.items()))
+        embed.add_field(name="Errors by status", value=errors or "None", inline=False)
+        users = "\n".join(f"<@{uid}>: {count}" for uid, count in self.metrics.user_requests.most_common(10))
+        embed.add_field(name="Top users", value=users or "None", inline=False)
+        await ctx.reply(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+    @novelaiset.command(name="metricsexport")
+    @commands.is_owner()
+    async def novelaiset_metricsexport(self, ctx: commands.Context):
+        """Toggles writing metrics in Prometheus text format to a file, at most every 15 seconds."""
+        self.metrics_export = not self.metrics_export
+        await self.config.metrics_export.set(self.metrics_export)
+        if self.metrics_export:
+            await self.export_metrics()
+            await ctx.reply(f"Metrics will be exported to `{cog_data_path(self).joinpath('metrics.prom')}`")
+        else:
+            await ctx.reply("Metrics will no longer be exported.")
+
     @novelaiset.group(name="vip", invoke_without_command=True)
     @commands.is_owner()
     async def vip(self, ctx: commands.Context):
@@ -0,0 +1,23 @@
+import re
+from typing import Dict, List, Set
+
+from novelai.constants import POLICY_PATTERNS
+
+
+class PromptPolicy:
+    """
+    Compiles the built-in and custom terms of each category into one regex per category.
+    Each category is searched separately, so terms of different categories can overlap, like "nude" and "nude kid".
+    """
+
+    def __init__(self, custom_terms: Dict[str, List[str]]):
+        self.regexes: Dict[str, re.Pattern] = {}
+        for category, pattern in POLICY_PATTERNS.items():
+            terms = custom_terms.get(category) or []
+            if terms:
+                pattern += "|(?i:" + "|".join(re.escape(term) for term in terms) + ")"
+            # unlike \b, these also work for terms that start or end with punctuation, like c++ or :3
+            self.regexes[category] = re.compile(rf"(?<!\w)(?:{pattern})(?!\w)")
+
+    def evaluate(self, prompt: str) -> Set[str]:
+        return {category for category, regex in self.regexes.items() if regex.search(prompt)}
@@ -0,0 +1,92 @@
+import io
+import json
+import random
+import asyncio
+import zipfile
+from aiohttp import web
+from PIL import Image, PngImagePlugin
+from typing import Optional
+
+STUB_ERROR_STATUSES = (429, 500, 524)
+
+
+class StubServer:
+    """
+    Local stand-in for the NovelAI image endpoint, used for load testing without spending credits.
+    Returns PNGs carrying the same text chunks as real generations, after a configurable delay,
+    and fails a configurable fraction of requests with the errors NovelAI usually returns.
+    """
+
+    def __init__(self, latency: float = 1.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.runner: Optional[web.AppRunner] = None
+        self.requests = 0
+        self.errors = 0
+        app = web.Application(client_max_size=64 * 1024**2)
+        app.router.add_post("/user/login", self.login)
+        app.router.add_post("/ai/generate-image", self.generate_image)
+        self.app = app
+
+    async def start(self) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def login(self, _: web.Request) -> web.Response:
+        return web.json_response({"accessToken": "stub"}, status=201)
+
+    async def generate_image(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        data = await request.json()
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            status = random.choice(STUB_ERROR_STATUSES)
+            return web.json_response({"statusCode": status, "message": "Stub error"}, status=status)
+        image = await asyncio.to_thread(self.render_image, data.get("input", ""), data.get("parameters", {}))
+        fp = io.BytesIO()
+        with zipfile.ZipFile(fp, "w") as z:
+            z.writestr("image_0.png", image)
+        return web.Response(body=fp.getvalue(), content_type="application/x-zip-compressed")
+
+    @staticmethod
+    def render_image(prompt: str, parameters: dict) -> bytes:
+        width, height = parameters.get("width", 832), parameters.get("height", 1216)
+        seed = parameters.get("seed") or random.randint(1, 2**32 - 1)
+        comment = {
+            "prompt": prompt,
+            "steps": parameters.get("steps", 28),
+            "height": height,
+            "width": width,
+            "scale": parameters.get("scale", 5.0),
+            "uncond_scale": parameters.get("uncond_scale", 1.0),
+            "cfg_rescale": parameters.get("cfg_rescale", 0.0),
+            "seed": seed,
+            "n_samples": 1,
+            "noise_schedule": parameters.get("noise_schedule", "native"),
+            "sampler": parameters.get("sampler", "k_euler_ancestral"),
+            "sm": parameters.get("sm", False),
+            "sm_dyn": parameters.get("sm_dyn", False),
+            "uc": parameters.get("negative_prompt", ""),
+            "request_type": "PromptGenerateRequest",
+            "signed_hash": "stub",
+        }
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text("Title", "AI generated image")
+        pnginfo.add_text("Description", prompt)
+        pnginfo.add_text("Software", "NovelAI")
+        pnginfo.add_text("Source", "Stable Diffusion XL C1E1DE52")
+        pnginfo.add_text("Comment", json.dumps(comment))
+        color = tuple(random.Random(seed).randrange(256) for _ in range(3))
+        fp = io.BytesIO()
+        Image.new("RGB", (width // 4, height // 4), color).save(fp, "png", pnginfo=pnginfo)
+        return fp.getvalue()
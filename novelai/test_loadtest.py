@@ -0,0 +1,61 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiohttp import ClientSession
+
+from novelai.novelai import NovelAI
+from novelai.viewstore import ViewStore
+from novelai.loadtest import run_load_test
+
+
+def make_cog(tmp_path) -> NovelAI:
+    with patch("novelai.novelai.Config.get_conf"), patch("novelai.novelai.cog_data_path", return_value=tmp_path):
+        cog = NovelAI(MagicMock())
+    cog.config.generation_cooldown = AsyncMock(return_value=0)
+    cog.view_store = ViewStore(tmp_path / "views.db")
+    return cog
+
+
+def test_load_test_only_calls_the_stub(tmp_path):
+    urls = []
+    send = ClientSession._request
+
+    async def spy(session, method, url, *args, **kwargs):
+        urls.append(str(url))
+        return await send(session, method, url, *args, **kwargs)
+
+    async def run():
+        cog = make_cog(tmp_path)
+        await cog.view_store.open()
+        api, circuit_breaker = cog.api, cog.circuit_breaker
+        try:
+            result = await run_load_test(cog, 5, 0.0, 0.0, 0.0)
+        finally:
+            await cog.view_store.close()
+        assert cog.api is api and cog.circuit_breaker is circuit_breaker
+        assert not cog.load_test_active
+        return result
+
+    with patch.object(ClientSession, "_request", spy):
+        result = asyncio.run(run())
+    assert result["server_requests"] == 5
+    assert result["metrics"].completed == 5
+    assert urls and all(url.startswith("http://127.0.0.1:") for url in urls)
+    assert any(url.endswith("/ai/generate-image") for url in urls)
+
+
+def test_cancelled_load_test_drops_its_requests(tmp_path):
+    async def run():
+        cog = make_cog(tmp_path)
+        await cog.view_store.open()
+        real_metrics = cog.metrics
+        task = asyncio.create_task(run_load_test(cog, 20, 0.2, 0.0, 0.0))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not cog.queue
+        assert not cog.queue_task or cog.queue_task.done()
+        assert real_metrics.completed == real_metrics.failed == 0
+        assert not cog.load_test_active
+        await cog.view_store.close()
+
+    asyncio.run(run())
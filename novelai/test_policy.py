@@ -0,0 +1,42 @@
+from novelai.policy import PromptPolicy
+
+
+def test_builtin_terms():
+    policy = PromptPolicy({})
+    assert policy.evaluate("1girl, solo, smile") == set()
+    assert policy.evaluate("1girl, nude") == {"nsfw"}
+    assert policy.evaluate("loli, beach") == {"tos"}
+    assert policy.evaluate("shota, naked") == {"nsfw", "tos"}
+
+
+def test_whole_words_only():
+    policy = PromptPolicy({})
+    assert policy.evaluate("cucumber, braid") == set()
+    assert policy.evaluate("sports bra") == set()
+
+
+def test_custom_terms():
+    policy = PromptPolicy({"nsfw": ["swimsuit"], "tos": ["Some Character"]})
+    assert policy.evaluate("swimsuit, pool") == {"nsfw"}
+    assert policy.evaluate("some character, smile") == {"tos"}
+    assert policy.evaluate("smile") == set()
+
+
+def test_custom_terms_are_escaped():
+    policy = PromptPolicy({"tos": ["a.b"]})
+    assert policy.evaluate("a.b") == {"tos"}
+    assert policy.evaluate("axb") == set()
+
+
+def test_custom_terms_with_punctuation_at_the_edges():
+    policy = PromptPolicy({"tos": ["c++", "(x)", ":3"]})
+    assert policy.evaluate("1girl, c++, smile") == {"tos"}
+    assert policy.evaluate("(x)") == {"tos"}
+    assert policy.evaluate("smile :3") == {"tos"}
+    assert policy.evaluate("c++x, a(x)") == set()
+
+
+def test_overlapping_terms():
+    policy = PromptPolicy({"tos": ["nude kid"]})
+    assert policy.evaluate("nude kid") == {"nsfw", "tos"}
+    assert policy.evaluate("1girl, nude") == {"nsfw"}
@@ -0,0 +1,83 @@
+import asyncio
+from novelai_api.ImagePreset import ImageModel, ImagePreset, ImageSampler
+
+from novelai.viewstore import ViewStore, DB_TABLE_BLOBS
+
+
+def make_preset(**settings) -> ImagePreset:
+    preset = ImagePreset(**settings)
+    preset.resolution = (832, 1216)
+    preset.sampler = ImageSampler.k_euler_ancestral
+    preset.seed = 123
+    return preset
+
+
+async def count_blobs(store: ViewStore) -> int:
+    async with store.db.execute(f"SELECT COUNT(*) FROM {DB_TABLE_BLOBS}") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+def test_round_trip(tmp_path):
+    async def run():
+        store = ViewStore(tmp_path / "views.db")
+        await store.open()
+        await store.add(1, "1girl, smile", make_preset(image="aW1hZ2U=", strength=0.5), ImageModel.Anime_v3, 123, 10)
+        await store.close()
+
+        store = ViewStore(tmp_path / "views.db")
+        await store.open()
+        assert 1 in store
+        state = await store.get(1)
+        await store.close()
+        assert state.prompt == "1girl, smile"
+        assert state.model == ImageModel.Anime_v3
+        assert state.seed == 123
+        assert state.preset.resolution == (832, 1216)
+        assert state.preset.sampler == ImageSampler.k_euler_ancestral
+        assert state.preset["image"] == "aW1hZ2U="
+        assert state.preset["strength"] == 0.5
+
+    asyncio.run(run())
+
+
+def test_missing_and_removed(tmp_path):
+    async def run():
+        store = ViewStore(tmp_path / "views.db")
+        await store.open()
+        assert await store.get(1) is None
+        await store.add(1, "cat", make_preset(), ImageModel.Anime_v3)
+        await store.remove(1)
+        assert 1 not in store
+        assert await store.get(1) is None
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_shared_blobs_are_stored_once(tmp_path):
+    async def run():
+        store = ViewStore(tmp_path / "views.db")
+        await store.open()
+        await store.add(1, "cat", make_preset(image="c2FtZQ=="), ImageModel.Anime_v3)
+        await store.add(2, "dog", make_preset(image="c2FtZQ=="), ImageModel.Anime_v3)
+        assert await count_blobs(store) == 1
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_remove_user(tmp_path):
+    async def run():
+        store = ViewStore(tmp_path / "views.db")
+        await store.open()
+        await store.add(1, "cat", make_preset(image="b3du"), ImageModel.Anime_v3, user_id=10)
+        await store.add(2, "dog", make_preset(image="c2hhcmVk"), ImageModel.Anime_v3, user_id=10)
+        await store.add(3, "fox", make_preset(image="c2hhcmVk"), ImageModel.Anime_v3, user_id=20)
+        await store.remove_user(10)
+        assert 1 not in store and 2 not in store
+        assert await store.get(1) is None
+        assert (await store.get(3)).preset["image"] == "c2hhcmVk"
+        assert await count_blobs(store) == 1
+        await store.close()
+
+    asyncio.run(run())
@@ -0,0 +1,145 @@
+import enum
+import json
+import time
+import aiosqlite as sql
+from dataclasses import dataclass
+from hashlib import md5
+from pathlib import Path
+from novelai_api.ImagePreset import ImageModel, ImagePreset
+from typing import Optional, Set
+
+from novelai.constants import VIEW_STATE_TTL, VIEW_STATE_BLOB_KEYS
+
+DB_TABLE_VIEWS = "views"
+DB_TABLE_BLOBS = "blobs"
+PRUNE_INTERVAL = 100
+
+
+@dataclass
+class ViewState:
+    prompt: str
+    preset: ImagePreset
+    model: ImageModel
+    seed: Optional[int]
+
+
+class ViewStore:
+    """
+    Keeps the generation parameters behind each message's buttons on disk, keyed by message ID.
+    Big base64 payloads such as img2img images are stored once in a separate table, keyed by their hash.
+    Only the set of known message IDs is kept in memory.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db: Optional[sql.Connection] = None
+        self.index: Set[int] = set()
+        self.inserts = 0
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self.index
+
+    async def open(self):
+        self.db = await sql.connect(self.path)
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_VIEWS} "
+                              f"(message_id INTEGER PRIMARY KEY, prompt TEXT NOT NULL, preset TEXT NOT NULL, "
+                              f"model TEXT NOT NULL, seed INTEGER, created REAL NOT NULL, user_id INTEGER);")
+        async with self.db.execute(f"PRAGMA table_info({DB_TABLE_VIEWS})") as cursor:
+            columns = {row[1] async for row in cursor}
+        if "user_id" not in columns:  # added later
+            await self.db.execute(f"ALTER TABLE {DB_TABLE_VIEWS} ADD COLUMN user_id INTEGER;")
+        await self.db.execute(f"CREATE TABLE IF NOT EXISTS {DB_TABLE_BLOBS} "
+                              f"(hash TEXT PRIMARY KEY, data TEXT NOT NULL, created REAL NOT NULL);")
+        await self.db.commit()
+        await self.prune()
+        async with self.db.execute(f"SELECT message_id FROM {DB_TABLE_VIEWS}") as cursor:
+            self.index = {row[0] async for row in cursor}
+
+    async def close(self):
+        if self.db:
+            await self.db.close()
+            self.db = None
+
+    async def add(self, message_id: int, prompt: str, preset: ImagePreset, model: ImageModel, seed: Optional[int] = None,
+                  user_id: Optional[int] = None):
+        now = time.time()
+        settings = dict(preset._settings)
+        for key in VIEW_STATE_BLOB_KEYS:
+            if not settings.get(key):
+                continue
+            values = settings[key] if isinstance(settings[key], list) else [settings[key]]
+            hashes = []
+            for value in values:
+                blob_hash = md5(value.encode()).hexdigest()
+                await self.db.execute(f"INSERT OR REPLACE INTO {DB_TABLE_BLOBS} VALUES (?, ?, ?)", [blob_hash, value, now])
+                hashes.append(blob_hash)
+            settings[key] = hashes if isinstance(settings[key], list) else hashes[0]
+        preset_json = json.dumps(settings, default=lambda o: o.name if isinstance(o, enum.Enum) else str(o))
+        await self.db.execute(f"INSERT OR REPLACE INTO {DB_TABLE_VIEWS} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              [message_id, prompt, preset_json, model.value, seed, now, user_id])
+        await self.db.commit()
+        self.index.add(message_id)
+        self.inserts += 1
+        if self.inserts % PRUNE_INTERVAL == 0:
+            await self.prune()
+
+    async def get(self, message_id: int) -> Optional[ViewState]:
+        if message_id not in self.index:
+            return None
+        async with self.db.execute(f"SELECT prompt, preset, model, seed, created FROM {DB_TABLE_VIEWS} WHERE message_id = ?",
+                                   [message_id]) as cursor:
+            row = await cursor.fetchone()
+        if not row or row[4] < time.time() - VIEW_STATE_TTL:
+            self.index.discard(message_id)
+            return None
+        prompt, preset_json, model, seed, _ = row
+        settings = json.loads(preset_json)
+        for key in VIEW_STATE_BLOB_KEYS:
+            if not settings.get(key):
+                continue
+            hashes = settings[key] if isinstance(settings[key], list) else [settings[key]]
+            values = []
+            for blob_hash in hashes:
+                async with self.db.execute(f"SELECT data FROM {DB_TABLE_BLOBS} WHERE hash = ?", [blob_hash]) as cursor:
+                    blob = await cursor.fetchone()
+                if not blob:
+                    return None
+                values.append(blob[0])
+            settings[key] = values if isinstance(settings[key], list) else values[0]
+        if "resolution" in settings and isinstance(settings["resolution"], list):
+            settings["resolution"] = tuple(settings["resolution"])
+        return ViewState(prompt, ImagePreset(**settings), ImageModel(model), seed)
+
+    async def remove(self, message_id: int):
+        self.index.discard(message_id)
+        await self.db.execute(f"DELETE FROM {DB_TABLE_VIEWS} WHERE message_id = ?", [message_id])
+        await self.db.commit()
+
+    async def remove_user(self, user_id: int):
+        """Deletes the views of the user's generations, and the images they used that no other view needs."""
+        async with self.db.execute(f"SELECT message_id, preset FROM {DB_TABLE_VIEWS} WHERE user_id = ?", [user_id]) as cursor:
+            rows = [row async for row in cursor]
+        if not rows:
+            return
+        blob_hashes = set()
+        for _, preset_json in rows:
+            settings = json.loads(preset_json)
+            for key in VIEW_STATE_BLOB_KEYS:
+                if settings.get(key):
+                    blob_hashes.update(settings[key] if isinstance(settings[key], list) else [settings[key]])
+        await self.db.execute(f"DELETE FROM {DB_TABLE_VIEWS} WHERE user_id = ?", [user_id])
+        for blob_hash in blob_hashes:
+            await self.db.execute(f"DELETE FROM {DB_TABLE_BLOBS} WHERE hash = ? AND NOT EXISTS "
+                                  f"(SELECT 1 FROM {DB_TABLE_VIEWS} WHERE instr(preset, ?) > 0)", [blob_hash, blob_hash])
+        await self.db.commit()
+        self.index.difference_update(row[0] for row in rows)
+
+    async def prune(self):
+        # blobs are refreshed every time a view references them, so they never expire before their views
+        cutoff = time.time() - VIEW_STATE_TTL
+        async with self.db.execute(f"SELECT message_id FROM {DB_TABLE_VIEWS} WHERE created < ?", [cutoff]) as cursor:
+            expired = [row[0] async for row in cursor]
+        await self.db.execute(f"DELETE FROM {DB_TABLE_VIEWS} WHERE created < ?", [cutoff])
+        await self.db.execute(f"DELETE FROM {DB_TABLE_BLOBS} WHERE created < ?", [cutoff])
+        await self.db.commit()
+        self.index.difference_update(expired)